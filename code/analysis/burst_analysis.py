@@ -1,153 +1,265 @@
 import numpy as np
 from brian2.units import second
-from helper_funcs import unitless, handle_downsampled_spikes, smooth_rate
+from helper_funcs import unitless, handle_downsampled_spikes, smooth_rate, RasterPyramid
+
+
+def spk_mon2csr(spk_idx, spk_t, nn, t_start=0., chunk=int(1e6)):
+    """
+    Counting sort of the (neuron index, spike time) pairs of a SpikeMonitor into spike times grouped by neuron.
+    Goes through the monitor arrays in chunks, so besides them only the float32 output and one chunk are in memory.
+
+    :return: offsets, with the spikes of neuron n in times[offsets[n]:offsets[n+1]], and times in seconds
+    """
+    t_start = np.float32(t_start)
+
+    # first pass: number of spikes per neuron after t_start
+    counts = np.zeros(nn, dtype=np.int64)
+    for c in range(0, len(spk_idx), chunk):
+        keep = np.asarray(spk_t[c:c + chunk]).astype(np.float32) >= t_start
+        counts += np.bincount(np.asarray(spk_idx[c:c + chunk])[keep], minlength=nn)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    # second pass: scatter each chunk behind the spikes already placed, monitors record in time order
+    times = np.empty(offsets[-1], dtype=np.float32)
+    filled = offsets[:-1].copy()
+    for c in range(0, len(spk_idx), chunk):
+        this_t = np.asarray(spk_t[c:c + chunk]).astype(np.float32)
+        keep = this_t >= t_start
+        this_t = this_t[keep]
+        this_idx = np.asarray(spk_idx[c:c + chunk])[keep]
+        order = np.argsort(this_idx, kind='stable')
+        this_idx = this_idx[order]
+        this_counts = np.bincount(this_idx, minlength=nn)
+        rank = np.arange(len(this_idx)) - (np.cumsum(this_counts) - this_counts)[this_idx]
+        times[filled[this_idx] + rank] = this_t[order]
+        filled += this_counts
+
+    return offsets, times
+
+
+# labels of classify_spikes
+SINGLE, BURST_START, BURST_MEMBER = 0, 1, 2
+
+
+def within_diffs(offsets, times):
+    """Differences of consecutive times of the same neuron, for concatenated spike trains with per-neuron offsets."""
+    first = np.zeros(len(times), dtype=bool)
+    first[offsets[:-1][np.diff(offsets) > 0]] = True
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    return np.diff(times)[~first[1:]], rows[1:][~first[1:]]
+
+
+def classify_spikes(offsets, times, valid_burst):
+    """
+    Labels the spikes of concatenated spike trains, following Naud & Sprekeler 2018: a spike after an ISI shorter
+    than valid_burst is a burst member, the spike before the first member is the burst start, all others are singles.
+    Events are burst starts and singles.
+
+    :param offsets: spikes of neuron n in times[offsets[n]:offsets[n+1]], in time order
+    :param times: spike times in seconds
+    :param valid_burst: ISI threshold in ms
+    :return: labels (SINGLE, BURST_START, BURST_MEMBER) per spike, {'events', 'bursts', 'singles'} counts per neuron,
+        number of spikes of each burst in spike order
+    """
+    n_spks = len(times)
+    first = np.zeros(n_spks, dtype=bool)
+    first[offsets[:-1][np.diff(offsets) > 0]] = True
+
+    # a member follows a short ISI of its own neuron, a start is followed by a member
+    member = np.zeros(n_spks, dtype=bool)
+    member[1:] = np.diff(times) * 1e3 < valid_burst
+    member &= ~first
+    start = np.zeros(n_spks, dtype=bool)
+    start[:-1] = member[1:] & ~member[:-1]
+    labels = np.full(n_spks, SINGLE, dtype=np.int8)
+    labels[start] = BURST_START
+    labels[member] = BURST_MEMBER
+
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    counts = {'events': np.bincount(rows[~member], minlength=len(offsets) - 1),
+              'bursts': np.bincount(rows[start], minlength=len(offsets) - 1)}
+    counts['singles'] = counts['events'] - counts['bursts']
+
+    # members belong to the last burst start before them
+    burst_id = np.cumsum(start) - 1
+    spks_per_burst = np.bincount(burst_id[member], minlength=start.sum()).astype(np.float32) + 1
+
+    return labels, counts, spks_per_burst
+
+
+def split_rows(offsets, times, keep):
+    """{row: times of the row where keep} of concatenated spike trains"""
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    kept_offsets = np.cumsum(np.bincount(rows[keep], minlength=len(offsets) - 1))[:-1]
+
+    return dict(enumerate(np.split(times[keep], kept_offsets)))
 
 
 def spk_mon2spk_times(task_info, spk_mon, nn2rec=50):
     """Calculates burst, event and single times from SpikeMonitor.spike_times(), following Naud & Sprekeler 2018."""
 
     # params
-    settle_time = task_info['sim']['settle_time']
+    settle_time = unitless(task_info['sim']['settle_time'], second, as_int=False)
     valid_burst = task_info['sim']['valid_burst']*1e3
-    mon_spk_times = spk_mon.spike_trains()
     sub = int(task_info['sen']['N_E'] * task_info['sen']['sub'])
 
+    # spike times after settle_time, grouped by neuron
+    offsets, mon_spk_times = spk_mon2csr(spk_mon.i, spk_mon.t_, len(spk_mon.source), t_start=settle_time)
+
     # random selection of active neurons
-    active_n = np.array([n for n, spks in mon_spk_times.items() if len(spks[spks >= settle_time]) >= 3])
+    active_n = np.nonzero(np.diff(offsets) >= 3)[0]
     nn_rec1 = np.random.choice(active_n[active_n < sub], size=nn2rec)
     nn_rec2 = np.random.choice(active_n[active_n >= sub], size=nn2rec)
     nn_rec = np.hstack((nn_rec1, nn_rec2))
 
-    # allocate variables
-    event_times = {}
-    burst_times = {}
-    single_times = {}
-    spike_times = {}
-    all_isis = np.zeros(1, dtype=np.float32)
-    all_ibis = np.zeros(1, dtype=np.float32)
-    all_ieis = np.zeros(1, dtype=np.float32)
-    cvs = []
-    mean_spks_per_burst = []
-
-    for i, n in enumerate(nn_rec):
-        # ignore spks during settle_time and work with unitless spike_times
-        this_spks = mon_spk_times[n].astype(np.float32)
-        this_spks = this_spks[this_spks >= settle_time] - settle_time
-        this_spks /= second
-
-        isis = np.diff(this_spks)
-        isis = isis[isis > 0]*1e3
-        all_isis = np.hstack((np.zeros(1), isis, all_isis)).astype(np.float32)
-        is_burst = np.concatenate(([False], isis < valid_burst)).astype(np.int16)
-        is_burst_bool = is_burst.astype(bool)
-        is_event = np.logical_not(is_burst_bool).astype(np.int16)
-        nburst = 0
-        spks_per_burst = np.zeros(1, dtype='float32')
-
-        if is_burst.any():
-            cv = isis.std() / isis.mean()
-            if not np.isnan(cv) and cv > 0:
-                cvs.append(cv)
-
-            # add preceding burst
-            start_burst = np.where(np.diff(is_burst) == True)[0]
-            nburst = len(start_burst)
-            is_burst[start_burst] = 1
-
-            # count number of spikes in each burst
-            ibi = np.concatenate((start_burst, is_burst.shape))  # inter-burst-intervals markers
-            spks_per_burst = np.array([is_burst[ibi[b]:ibi[b + 1]].sum() for b in range(nburst)], dtype='float32')
-            spks_per_burst[spks_per_burst == 1] = 2  # sanity check, there's no 1 spk burst!
-            is_burst[is_burst_bool] = 0  # rmv consecutive burst spks
-            _ = [mean_spks_per_burst.append(spb) for spb in spks_per_burst]
-
-        # get single spks
-        issingle = np.logical_and(is_burst == 0, is_event.astype(bool))
-
-        # sanity check
-        allspks = is_burst.sum() + issingle.sum() + spks_per_burst.sum() - nburst
-        assert allspks == len(this_spks), "Ups, sth is weird in the burst quantification :("
-
-        # get events, bursts, singles times
-        event_times[i] = this_spks[is_event.astype(bool)]
-        burst_times[i] = this_spks[is_burst.astype(bool)]
-        single_times[i] = this_spks[issingle.astype(bool)]
-        spike_times[i] = this_spks
-
-        # isis in ms
-        ieis = np.diff(event_times[i])
-        ibis = np.diff(burst_times[i])
-        all_ieis = np.hstack((np.zeros(1), ieis[ieis > 0]*1e3, all_ieis)).astype(np.float32)
-        all_ibis = np.hstack((np.zeros(1), ibis[ibis > 0]*1e3, all_ibis)).astype(np.float32)
-    all_isis = (all_isis[all_isis > 0], all_ieis[all_ieis > 0], all_ibis[all_ibis > 0],
-                np.array(cvs, dtype=np.float32), np.array(mean_spks_per_burst, dtype=np.float32))
+    # spike trains of the selection concatenated, ignore spks during settle_time and work with unitless spike_times
+    lengths = np.diff(offsets)[nn_rec]
+    rec_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    gather = np.repeat(offsets[nn_rec] - rec_offsets[:-1], lengths) + np.arange(rec_offsets[-1])
+    spks = mon_spk_times[gather] - np.float32(settle_time)
+
+    labels, counts, spks_per_burst = classify_spikes(rec_offsets, spks, valid_burst)
+
+    # sanity check
+    allspks = counts['bursts'].sum() + counts['singles'].sum() + spks_per_burst.sum() - len(spks_per_burst)
+    assert allspks == len(spks), "Ups, sth is weird in the burst quantification :("
+
+    # get events, bursts, singles times
+    event_times = split_rows(rec_offsets, spks, labels != BURST_MEMBER)
+    burst_times = split_rows(rec_offsets, spks, labels == BURST_START)
+    single_times = split_rows(rec_offsets, spks, labels == SINGLE)
+    spike_times = dict(enumerate(np.split(spks, rec_offsets[1:-1])))
+
+    # isis in ms, cvs of the neurons that burst
+    isis, isi_rows = within_diffs(rec_offsets, spks)
+    isi_rows, isis = isi_rows[isis > 0], isis[isis > 0]*1e3
+    n_isis = np.bincount(isi_rows, minlength=len(nn_rec))
+    isi_mean = np.bincount(isi_rows, isis, minlength=len(nn_rec)) / np.maximum(n_isis, 1)
+    isi_std = np.sqrt(np.bincount(isi_rows, (isis - isi_mean[isi_rows])**2, minlength=len(nn_rec)) /
+                      np.maximum(n_isis, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvs = (isi_std / isi_mean)[counts['bursts'] > 0]
+    cvs = cvs[np.logical_not(np.isnan(cvs)) & (cvs > 0)]
+
+    ieis = within_diffs(np.concatenate(([0], np.cumsum(counts['events']))), spks[labels != BURST_MEMBER])[0]
+    ibis = within_diffs(np.concatenate(([0], np.cumsum(counts['bursts']))), spks[labels == BURST_START])[0]
+
+    all_isis = (isis.astype(np.float32), (ieis[ieis > 0]*1e3).astype(np.float32),
+                (ibis[ibis > 0]*1e3).astype(np.float32),
+                cvs.astype(np.float32), spks_per_burst)
     all_spk_times = (event_times, burst_times, single_times, spike_times)
 
     return all_spk_times, all_isis
 
 
-def spk_times2raster(task_info, all_spk_times, broad_step=False, rate=False, downsample=False):
-    """takes dictionaries of spk_times and transforms them to rasters or rates"""
-    from scipy.sparse import lil_matrix
+def counts2raster(task_info, counts, nn2rec=50):
+    """
+    Rasters of events, bursts, singles and spikes from the counts binned during the run (circuits.count_mon2counts),
+    for the same random selection of active neurons as spk_mon2spk_times. Bursts are tagged at their second spike,
+    so a burst and its single can sit in neighbouring bins: singles are events - bursts, clipped at zero.
+
+    :return: events, bursts, singles, spikes as (2*nn2rec x time) float32, time starting after settle_time
+    """
+    # params
+    settle_time = unitless(task_info['sim']['settle_time'], second, as_int=False)
+    count_dt = unitless(task_info['sim'].get('count_dt', task_info['sim']['stim_dt']), second, as_int=False)
+    sub = int(task_info['sen']['N_E'] * task_info['sen']['sub'])
+    settle_bins = int(round(settle_time / count_dt))
+
+    # random selection of active neurons
+    spikes = counts['spks'][:, settle_bins:]
+    active_n = np.nonzero(spikes.sum(axis=1) >= 3)[0]
+    nn_rec1 = np.random.choice(active_n[active_n < sub], size=nn2rec)
+    nn_rec2 = np.random.choice(active_n[active_n >= sub], size=nn2rec)
+    nn_rec = np.hstack((nn_rec1, nn_rec2))
+
+    events = counts['events'][nn_rec, settle_bins:].astype(np.float32)
+    bursts = counts['bursts'][nn_rec, settle_bins:].astype(np.float32)
+    singles = np.clip(events - bursts, 0, None)
+
+    return events, bursts, singles, spikes[nn_rec].astype(np.float32)
+
+
+def spk_times2csr(all_spk_times, dts, tps):
+    """
+    Bins the spike times of spk_mon2spk_times into rasters at several resolutions in one pass: the spikes of all
+    neurons are flattened once and binned per resolution, two spikes in one bin are moved to consecutive bins
+    (handle_downsampled_spikes) so that every spike is a 1 in the raster.
+
+    :param dts: bin widths in seconds
+    :param tps: number of bins for each of dts
+    :return: one (events, bursts, singles, spikes) per bin width, as csr_matrix (neurons x bins) float32
+    """
+    from scipy.sparse import csr_matrix
+    nn = max(all_spk_times[3], key=int) + 1
+
+    # shared by all resolutions: neuron and time of every spike, in neuron order and in time within a neuron
+    flat = []
+    for spk_times in all_spk_times:
+        neurons = sorted(spk_times, key=int)
+        rows = np.repeat(np.array(neurons, dtype=np.int32), [len(spk_times[n]) for n in neurons])
+        times = np.concatenate([np.asarray(spk_times[n], dtype=np.float32) for n in neurons] +
+                               [np.empty(0, dtype=np.float32)])
+        flat.append((rows, times))
+
+    rasters = []
+    for dt, n_bins in zip(dts, tps):
+        this_rasters = []
+        for rows, times in flat:
+            bins = handle_downsampled_spikes(np.floor(times / dt), rows)
+            bins[bins < 0] += n_bins
+            this_rasters.append(csr_matrix((np.ones(len(bins), dtype=np.float32), (rows, bins)),
+                                           shape=(nn, n_bins)))
+        rasters.append(tuple(this_rasters))
+
+    return rasters
 
+
+def spk_times2raster(task_info, all_spk_times, broad_step=False, rate=False, downsample=False, dense=True):
+    """
+    takes dictionaries of spk_times and transforms them to rasters or rates
+
+    :param dense: False to get the rasters as csr_matrix, downsampled rasters and rates are always dense
+    """
     # params
-    event_times, burst_times, single_times, spk_times = all_spk_times
     sim_dt = unitless(task_info['sim']['sim_dt'], second, as_int=False)
     runtime = unitless(task_info['sim']['runtime'], second, as_int=False)
     settle_time = unitless(task_info['sim']['settle_time'], second, as_int=False)
     if broad_step:
         sim_dt = unitless(task_info['sim']['stim_dt'], second, as_int=False)
     tps = unitless(int((runtime - settle_time)), sim_dt)
-    nn = max(spk_times, key=int) + 1
-
-    # allocate variables
-    events = lil_matrix((nn, tps), dtype=np.float32)  # events
-    bursts = lil_matrix((nn, tps), dtype=np.float32)  # bursts
-    singles = lil_matrix((nn, tps), dtype=np.float32)  # single spikes
-    spikes = lil_matrix((nn, tps), dtype=np.float32)  # normal, all spikes
-
-    num_spikes = 0
-    for n in spk_times.keys():
-        # fill sparse matrix with the proper indices of the newdt
-        events[n, handle_downsampled_spikes(np.floor(event_times[n] / sim_dt))] = 1
-        bursts[n, handle_downsampled_spikes(np.floor(burst_times[n] / sim_dt))] = 1
-        singles[n, handle_downsampled_spikes(np.floor(single_times[n] / sim_dt))] = 1
-        spikes[n, handle_downsampled_spikes(np.floor(spk_times[n] / sim_dt))] = 1
-        num_spikes += len(spk_times[n])
+
+    events, bursts, singles, spikes = spk_times2csr(all_spk_times, [sim_dt], [tps])[0]
+    nn = spikes.shape[0]
 
     if not broad_step:
-        assert num_spikes == spikes.toarray().sum(), "Ups, you lost some spikes while creating the rasters."
+        num_spikes = sum(len(spk_times) for spk_times in all_spk_times[3].values())
+        assert num_spikes == spikes.sum(), "Ups, you lost some spikes while creating the rasters."
 
     if rate:
-        # from matrix2rate per subpopulation
+        # from matrix2rate per subpopulation, the means of the subpopulations are taken on the sparse rasters
         smooth_win = unitless(task_info['sim']['smooth_win'], second, as_int=False)
         sub = int(nn / 2)
         rates = []
         for i, matrix in enumerate([events, bursts, singles, spikes]):
-            rate1, rate2 = smooth_rate(matrix.toarray(), smooth_win, sim_dt, sub)
+            pop_means = np.vstack((matrix[:sub].mean(axis=0), matrix[sub:].mean(axis=0)))
+            rate1, rate2 = smooth_rate(np.asarray(pop_means, dtype=np.float32), smooth_win, sim_dt, 1)
             rates.append(np.vstack((rate1, rate2)))
 
         # event_rate, burst_rate, single_rate, firing_rate
         return rates[0], rates[1], rates[2], rates[3]
 
-    elif downsample:
-        # allocate variables
+    rasters = [events, bursts, singles, spikes]
+    if dense:
+        rasters = [matrix.toarray() for matrix in rasters]
+
+    if downsample:
+        # spikes per count_window from the columns of the rasters
         count_window = 0.1      # 100 ms
-        new_tps = int(tps / (count_window/sim_dt))
-        events_downsample = np.empty((nn, new_tps), dtype=np.float32)
-        bursts_downsample = np.empty((nn, new_tps), dtype=np.float32)
-        singles_downsample = np.empty((nn, new_tps), dtype=np.float32)
-        spikes_downsample = np.empty((nn, new_tps), dtype=np.float32)
-
-        idxs = np.linspace(0, (runtime-settle_time)/sim_dt, int((runtime-settle_time)/count_window)+1, dtype=np.int16)
-        for i, idx1 in enumerate(idxs[:-1]):
-            idx2 = idxs[i+1]
-            events_downsample[:, i] = np.squeeze(events.toarray()[:, idx1:idx2].sum(axis=1) / count_window)
-            bursts_downsample[:, i] = np.squeeze(bursts.toarray()[:, idx1:idx2].sum(axis=1) / count_window)
-            singles_downsample[:, i] = np.squeeze(singles.toarray()[:, idx1:idx2].sum(axis=1) / count_window)
-            spikes_downsample[:, i] = np.squeeze(spikes.toarray()[:, idx1:idx2].sum(axis=1) / count_window)
-
-        return events.toarray(), bursts.toarray(), singles.toarray(), spikes.toarray(), \
-               [events_downsample, bursts_downsample, singles_downsample, spikes_downsample]
-
-    return events.toarray(), bursts.toarray(), singles.toarray(), spikes.toarray()
+        downsampled = [RasterPyramid(matrix, sim_dt).rate(count_window).astype(np.float32)
+                       for matrix in [events, bursts, singles, spikes]]
+
+        return rasters[0], rasters[1], rasters[2], rasters[3], downsampled
+
+    return rasters[0], rasters[1], rasters[2], rasters[3]
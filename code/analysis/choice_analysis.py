@@ -1,7 +1,8 @@
 import numpy as np
-from snep.utils import experiment_opener, filter_tasks
-from helper_funcs import get_this_time, get_winner_loser_trials, instant_rate, choice_probability, pair_noise_corr, \
-    plot_pop_averages, plot_fig2
+from snep.utils import experiment_opener
+from snep.tables.trials import open_trial_store
+from helper_funcs import get_this_time, get_winner_loser_trials, instant_rate, roc_auc_batch, noise_corr_all, \
+    sample_pairs, noise_corr_pairs, noise_corr_estimate, plot_pop_averages, plot_fig2
 from tqdm import tqdm
 import pickle
 
@@ -14,7 +15,10 @@ fig_extension = '.png'
 
 # analysis params
 compute_corr = False
+corr_pairs = 0          # > 0: noise correlations of this many sampled pairs per pool pairing instead of all pairs
+corr_file = None        # .npy file the all-pairs correlations are streamed to, in memory if None
 step_cp = 10
+max_bytes = 2**28       # rough bound on the memory of a block of neurons
 
 
 @experiment_opener({# 'test_wimmer':  test_expers[0],
@@ -40,99 +44,84 @@ def get_average_trials(tables_task_ids):
         params = tables.get_general_params(True)
         param_ranges = tables.read_param_ranges()
 
-        # filter tasks to only the targets
-        targets = [{('c',): 0, (target_var,): target_value}, ]
-        target_ids = filter_tasks(task_ids, targets)
-        params[target_var] = target_value
-
-        # params and allocate variables
-        n_trials = len(target_ids)
-        is_winner_pop = np.zeros(n_trials, dtype=bool)
-        pops, tps1 = tables.get_raw_data(target_ids[0], 'rates_dec').shape
-        rates_dec = np.empty((n_trials, pops, tps1), dtype=np.float32)
-        rates_sen = np.empty((n_trials, pops, tps1), dtype=np.float32)
-        nn, tps2 = tables.get_computed(target_ids[0], 'spikes').shape
-        spikes_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
-        bursts_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
-        events_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
-        tps_cp = int(tps2/step_cp)
-        cp_av_per_trial = np.empty((nn, tps_cp), dtype=np.float32)
-        e_cp_av_per_trial = np.empty((nn, tps_cp), dtype=np.float32)
-        bf_cp_av_per_trial = np.empty((nn, tps_cp), dtype=np.float32)
-        sub = int(nn / 2)
-        corr = np.empty((nn, nn, int(tps_cp)), dtype=np.float32)
-        rates_js = np.empty((nn, n_trials, tps_cp), dtype=np.float32)
-        tps_stim = tables.get_raw_data(target_ids[0], 'stim_fluc').shape[0]
-        stim_fluc = np.empty((n_trials, tps_stim), dtype=np.float32)
-
-        for n in tqdm(range(nn)):
-            this_n_spikes = np.empty((n_trials, tps2), dtype=np.float32)
-            this_n_bursts = np.empty((n_trials, tps2), dtype=np.float32)
-            this_n_events = np.empty((n_trials, tps2), dtype=np.float32)
-
-            for i, tid in enumerate(target_ids):
-                if n == 0:
-                    rates_dec[i] = tables.get_raw_data(tid, 'rates_dec')
-                    rates_sen[i] = tables.get_raw_data(tid, 'rates_sen')
-                    stim_fluc[i] = tables.get_raw_data(tid, 'stim_fluc')
-                    winner_pop = tables.get_raw_data(tid, 'winner_pop')[0]
-                    if np.isclose(winner_pop, 0):
-                        is_winner_pop[i] = True
-
-                    if compute_corr:
-                        for nj in range(nn):
-                            rates_js[nj, i] = instant_rate(params, tables.get_computed(tid, 'spikes')[nj],
-                                                           smooth_win=0.25)
-
-                # retrieve spikes per neuron
-                this_n_spikes[i] = tables.get_computed(tid, 'spikes')[n]
-                this_n_bursts[i] = tables.get_computed(tid, 'bursts')[n]
-                this_n_events[i] = tables.get_computed(tid, 'events')[n]
-
-            # re-order winner pop
-            if np.isclose(n,  sub):
-                is_winner_pop = np.logical_not(is_winner_pop)
-            spikes1, spikes2 = get_winner_loser_trials(this_n_spikes, is_winner_pop)
-            bursts1, bursts2 = get_winner_loser_trials(this_n_bursts, is_winner_pop)
-            events1, events2 = get_winner_loser_trials(this_n_events, is_winner_pop)
-
-            # fill average arrays
-            spikes_av_per_trial[n] = spikes1.mean(axis=0)
-            spikes_av_per_trial[nn+n] = spikes2.mean(axis=0)
-            bursts_av_per_trial[n] = bursts1.mean(axis=0)
-            bursts_av_per_trial[nn+n] = bursts2.mean(axis=0)
-            events_av_per_trial[n] = events1.mean(axis=0)
-            events_av_per_trial[nn+n] = events2.mean(axis=0)
-
-            # instantaneous rates and cps
-            rates1 = instant_rate(params, spikes1, smooth_win=0.1, step=step_cp)
-            rates2 = instant_rate(params, spikes2, smooth_win=0.1, step=step_cp)
-            cp_av_per_trial[n] = choice_probability(rates1, rates2)
-            e_rates1 = instant_rate(params, events1, smooth_win=0.1, step=step_cp)
-            e_rates2 = instant_rate(params, events2, smooth_win=0.1, step=step_cp)
-            e_cp_av_per_trial[n] = choice_probability(e_rates1, e_rates2)
-            b_rates1 = instant_rate(params, bursts1, smooth_win=0.1, step=step_cp)
-            b_rates2 = instant_rate(params, bursts2, smooth_win=0.1, step=step_cp)
-            bf1 = b_rates1 / e_rates1
-            bf1[np.isnan(bf1)] = 0  # handle division by zero
-            bf2 = b_rates2 / e_rates2
-            bf2[np.isnan(bf2)] = 0  # handle division by zero
-            bf_cp_av_per_trial[n] = choice_probability(bf1, bf2)
-            all_cps = [cp_av_per_trial, e_cp_av_per_trial, bf_cp_av_per_trial]
-
-            # correlations
-            if compute_corr:
-                for nj in range(nn):
-                    corr[n, nj, :] = pair_noise_corr(rates_js[n], rates_js[nj])
+        # columnar copy of the trials, then filter to only the targets
+        with open_trial_store(tables, task_ids,
+                              neuron=[('computed', 'spikes'), ('computed', 'bursts'), ('computed', 'events')],
+                              trial=[('raw_data', 'rates_dec'), ('raw_data', 'rates_sen'),
+                                     ('raw_data', 'stim_fluc'), ('raw_data', 'winner_pop')]) as store:
+            targets = [{('c',): 0, (target_var,): target_value}, ]
+            trials = store.select(targets)
+            params[target_var] = target_value
+
+            # params and allocate variables
+            n_trials = len(trials)
+            rates_dec = store.trial('rates_dec', trials)
+            rates_sen = store.trial('rates_sen', trials)
+            stim_fluc = store.trial('stim_fluc', trials)
+            tps_stim = stim_fluc.shape[1]
+            is_winner_pop = np.isclose(store.trial('winner_pop', trials)[:, 0], 0)
+            nn, _, tps2 = store.shape('neuron', 'spikes')
+            spikes_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
+            bursts_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
+            events_av_per_trial = np.empty((int(2*nn), tps2), dtype=np.float32)
+            tps_cp = int(tps2/step_cp)
+            sub = int(nn / 2)
+            rates = {name: np.empty((nn, n_trials, tps_cp), dtype=np.float32)
+                     for name in ('spikes', 'events', 'bursts')}
+            rates_js = np.empty((nn, n_trials, tps_cp), dtype=np.float32)
+
+            # winner trials of each neuron, the second half of the neurons belongs to the other pool
+            is_winner_n = np.concatenate((np.tile(is_winner_pop, (sub, 1)), np.tile(~is_winner_pop, (nn - sub, 1))))
+
+            # averages and instantaneous rates of all trials, read and smoothed in blocks of neurons
+            block = max(1, int(max_bytes / (4 * n_trials * tps2)))
+            for n0 in tqdm(range(0, nn, block)):
+                n1 = min(n0 + block, nn)
+                w = is_winner_n[n0:n1, :, np.newaxis]
+                for name, av_per_trial in (('spikes', spikes_av_per_trial), ('bursts', bursts_av_per_trial),
+                                           ('events', events_av_per_trial)):
+                    this_counts = store.neuron(name, slice(n0, n1))[:, trials].astype(np.float32)
+                    av_per_trial[n0:n1] = (this_counts * w).sum(axis=1) / w.sum(axis=1)
+                    av_per_trial[nn+n0:nn+n1] = (this_counts * ~w).sum(axis=1) / (~w).sum(axis=1)
+                    this_counts = this_counts.reshape(-1, tps2)
+                    rates[name][n0:n1] = instant_rate(params, this_counts, smooth_win=0.1,
+                                                      step=step_cp).reshape(n1 - n0, n_trials, tps_cp)
+                    if compute_corr and name == 'spikes':
+                        rates_js[n0:n1] = instant_rate(params, this_counts, smooth_win=0.25,
+                                                       step=step_cp).reshape(n1 - n0, n_trials, tps_cp)
+
+        # cps of all neurons and timepoints, one batch per measure
+        bf = rates['bursts'] / rates['events']
+        bf[np.isnan(bf)] = 0  # handle division by zero
+        cp_av_per_trial, e_cp_av_per_trial, bf_cp_av_per_trial = all_cps = \
+            [roc_auc_batch(r, is_winner_n, max_bytes=max_bytes).astype(np.float32)
+             for r in (rates['spikes'], rates['events'], bf)]
 
         # stim
-        stim1, stim2 = get_winner_loser_trials(stim_fluc, np.logical_not(is_winner_pop))
+        stim1, stim2 = get_winner_loser_trials(stim_fluc, is_winner_pop)
         stim_diff = stim1.mean(axis=0) - stim2.mean(axis=0)
         stim_time = get_this_time(params, tps_stim, include_settle_time=True)
 
+        # correlations
+        pool1, pool2 = np.arange(sub), np.arange(sub, nn)
+        if compute_corr and corr_pairs:
+            corr_ii = np.concatenate([noise_corr_pairs(rates_js, *sample_pairs(p, p, corr_pairs))
+                                      for p in (pool1, pool2)])
+            corr_ij = np.concatenate([noise_corr_pairs(rates_js, *sample_pairs(p, q, corr_pairs))
+                                      for p, q in ((pool1, pool2), (pool2, pool1))])
+            for name, c in (('within', corr_ii), ('across', corr_ij)):
+                mean, lower, upper = noise_corr_estimate(c)
+                print(f'Noise correlations {name} pools from {len(c)} pairs: mean {np.nanmean(mean):.3f}, '
+                      f'95% CI half width up to {np.nanmax(upper - mean):.3f}')
+        else:
+            if compute_corr:
+                corr = noise_corr_all(rates_js, filename=corr_file)
+            else:
+                corr = np.full((nn, nn, tps_cp), np.nan, dtype=np.float32)
+            corr_ii = np.concatenate((corr[:sub, :sub], corr[sub:, sub:]), axis=0).reshape(-1, tps_cp)
+            corr_ij = np.concatenate((corr[:sub, sub:], corr[sub:, :sub]), axis=0).reshape(-1, tps_cp)
+
         # figures
-        corr_ii = np.concatenate((corr[:sub, :sub], corr[sub:, sub:]), axis=0).reshape(-1, tps_cp)
-        corr_ij = np.concatenate((corr[:sub, sub:], corr[sub:, :sub]), axis=0).reshape(-1, tps_cp)
         plot_pop_averages(params, rates_dec, rates_sen, all_cps, corr_ii, corr_ij, task_dir, '/fig1_'+fig_name)
         params['sim']['smooth_win'] = 100*ms
         plot_fig2(params, events_av_per_trial, bursts_av_per_trial, spikes_av_per_trial,
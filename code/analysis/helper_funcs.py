@@ -2,7 +2,6 @@ import numpy as np
 from scipy.signal import lfilter
 from brian2.units import second, Hz, pA, ms, nS, mV
 from brian2tools import plot_raster
-from sklearn import metrics as mtr
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -22,10 +21,11 @@ def unitless(quantity, time_unit, as_int=True):
     return quantity / time_unit
 
 
-def get_OUstim(n, tau, flip_stim=False):
-    """Ornstein-Uhlenbeck process in discrete time"""
+def get_OUstim(n, tau, flip_stim=False, rng=None):
+    """Ornstein-Uhlenbeck process in discrete time, from the global numpy random state or the Generator rng"""
     a = np.exp(-(1 / tau))
-    i = lfilter(np.ones(1), [1, -a], np.sqrt(1 - a**2) * np.random.randn(n))
+    noise = np.random.randn(n) if rng is None else rng.standard_normal(n)
+    i = lfilter(np.ones(1), [1, -a], np.sqrt(1 - a**2) * noise)
     i = np.asanyarray(i, dtype=np.float32)
     if flip_stim:
         i = np.flip(i, axis=0)
@@ -55,18 +55,63 @@ def np_array(*args, **kw):
         return np.array(*args, **kw)
 
 
-def handle_downsampled_spikes(spk_times):
-    """transforms 2 spks in one dt to 2 consecutive spikes"""
-    conflict = np.where(np.diff(spk_times) == 0)[0]
-    spk_times[conflict] -= 1
-    if np.any(np.diff(spk_times) == 0):     # recursive search for no 2 spikes in one dt bin
-        spk_times = handle_downsampled_spikes(spk_times)
-
-    return spk_times.astype(np.int16)
+def handle_downsampled_spikes(spk_times, rows=None):
+    """
+    transforms 2 spks in one dt to 2 consecutive spikes, the earlier one moves back until all bins are distinct.
+    With rows (neuron of each spike, spikes sorted by neuron then time) the bins of several neurons at once.
+    """
+    spk_times = np.asarray(spk_times).astype(np.int64)
+    same_row = True if rows is None else np.diff(rows) == 0
+    while True:
+        conflict = np.nonzero((np.diff(spk_times) == 0) & same_row)[0]
+        if not len(conflict):
+            break
+        spk_times[conflict] -= 1
+
+    return spk_times
+
+
+class RasterPyramid(object):
+    """
+    Counts of a raster (neurons x bins, dense or sparse) at coarser bin widths. A level is computed on first access,
+    from the finest kept level whose factor divides its own, by summing blocks of bins of a reshaped view, and is
+    kept for later use. Bins at the end that do not fill a block are dropped.
+    """
+    def __init__(self, raster, dt):
+        self.dt = dt
+        self.levels = {1: raster}
+
+    def counts(self, factor):
+        """Counts in bins of factor finest bins, dense (neurons x bins)."""
+        if factor not in self.levels:
+            base = max(f for f in self.levels if factor % f == 0)
+            block = factor // base
+            raster = self.levels[base]
+            nn, tps = raster.shape
+            n_bins = tps // block
+            if hasattr(raster, 'tocsc'):
+                # sparse: only the first n_bins*block columns, summed by an aggregation matrix
+                from scipy.sparse import csr_matrix
+                agg = csr_matrix((np.ones(n_bins * block, dtype=raster.dtype),
+                                  (np.arange(n_bins * block), np.arange(n_bins * block) // block)),
+                                 shape=(tps, n_bins))
+                counts = (raster @ agg).toarray()
+            else:
+                counts = raster[:, :n_bins * block].reshape(nn, n_bins, block).sum(axis=2)
+            self.levels[factor] = counts
+
+        return self.levels[factor]
+
+    def factor(self, bin_width):
+        return int(round(bin_width / self.dt))
+
+    def rate(self, bin_width):
+        """Counts per second in bins of bin_width."""
+        return self.counts(self.factor(bin_width)) / bin_width
 
 
 def instant_rate(task_info, spikes, smooth_win=None, step=10):
-    """computes the instantaneous spike count for a neuron at each trl"""
+    """computes the instantaneous spike count for a neuron at each trl, all trials at once"""
     if not smooth_win:
         smooth_win = unitless(task_info['sim']['smooth_win'], second, as_int=False)
     if len(spikes.shape) < 2:
@@ -75,27 +120,68 @@ def instant_rate(task_info, spikes, smooth_win=None, step=10):
     new_dt = get_this_dt(task_info, tps)
     time = get_this_time(task_info, tps)
     time_low_def = get_this_time(task_info, int(tps/step))
-    rates = np.empty((n_trials, int(tps/step)), dtype=np.float32)
-    for i in range(n_trials):
-        rate = smooth_rate(spikes[i], smooth_win, new_dt)
-        rates[i] = interpolate_rates(rate, time, time_low_def)
 
-    return rates
+    return smooth_rates(spikes, smooth_win, new_dt, time=time, time_interp=time_low_def)
 
 
 def smooth_rate(rate, smooth_win, dt, sub=[]):
     """rectangular sliding window on a firing rate to smooth"""
-    kernel = np.ones(int(smooth_win / dt), dtype=np.float32)
     if bool(sub):
-        rate1 = rate[:sub].mean(axis=0) / smooth_win
-        rate2 = rate[sub:].mean(axis=0) / smooth_win
-        smoothed_rate1 = np.convolve(rate1, kernel, mode='same').astype(np.float32)
-        smoothed_rate2 = np.convolve(rate2, kernel, mode='same').astype(np.float32)
+        rates = np.vstack((rate[:sub].mean(axis=0), rate[sub:].mean(axis=0)))
+        smoothed_rate1, smoothed_rate2 = smooth_rates(rates, smooth_win, dt)
         return smoothed_rate1, smoothed_rate2
 
-    rate /= smooth_win
-    smoothed_rate = np.convolve(np.squeeze(rate), kernel, mode='same').astype(np.float32)
-    return smoothed_rate
+    return smooth_rates(np.squeeze(rate), smooth_win, dt)
+
+
+def smooth_rates(signals, smooth_win, dt, window=None, time=None, time_interp=None, max_bytes=2**28):
+    """
+    Smooths counts per bin of many signals (..., time) along the last axis into rates, as np.convolve(mode='same')
+    with a window of smooth_win divided by smooth_win. The flat window is a difference of cumulative sums, other
+    windows use an FFT convolution. With time_interp the rates are linearly interpolated from time onto it in the
+    same pass (as interpolate_rates). Rows are processed in blocks of about max_bytes.
+
+    :param window: weights of the window, flat (smooth_win / dt ones) by default
+    :return: float32 array (..., time) or (..., time_interp)
+    """
+    from scipy.signal import fftconvolve
+    signals = np.asarray(signals)
+    lead, tps = signals.shape[:-1], signals.shape[-1]
+    x = signals.reshape(-1, tps)
+    if window is None:
+        width = int(smooth_win / dt)
+    else:
+        width = len(window)
+        window = np.asarray(window, dtype=np.float64)
+    # 'same' keeps the part of the full convolution starting at (width - 1) // 2
+    start = (width - 1) // 2
+
+    if time_interp is not None:
+        # interpolation indices and weights, shared by all rows
+        time, time_interp = np.asarray(time, dtype=np.float64), np.asarray(time_interp, dtype=np.float64)
+        assert time_interp.min() >= time[0] and time_interp.max() <= time[-1], 'time_interp outside of time'
+        idx = np.clip(np.searchsorted(time, time_interp, side='right') - 1, 0, tps - 2)
+        frac = (time_interp - time[idx]) / (time[idx + 1] - time[idx])
+        out = np.empty((x.shape[0], len(time_interp)), dtype=np.float32)
+    else:
+        out = np.empty((x.shape[0], tps), dtype=np.float32)
+
+    block = max(1, int(max_bytes / (32 * tps)))
+    for r in range(0, x.shape[0], block):
+        rows = x[r:r + block].astype(np.float64)
+        if window is None:
+            cumsum = np.concatenate((np.zeros((len(rows), 1)), np.cumsum(rows, axis=1)), axis=1)
+            hi = np.clip(np.arange(tps) + start + 1, 0, tps)
+            lo = np.clip(np.arange(tps) + start + 1 - width, 0, tps)
+            smoothed = cumsum[:, hi] - cumsum[:, lo]
+        else:
+            smoothed = fftconvolve(rows, window[np.newaxis], mode='full', axes=1)[:, start:start + tps]
+        smoothed /= smooth_win
+        if time_interp is not None:
+            smoothed = smoothed[:, idx] * (1 - frac) + smoothed[:, idx + 1] * frac
+        out[r:r + block] = smoothed
+
+    return out.reshape(lead + out.shape[-1:])
 
 
 def interpolate_rates(rate, time, time_interp):
@@ -105,6 +191,117 @@ def interpolate_rates(rate, time, time_interp):
     return f(time_interp)
 
 
+class SpikeData(object):
+    """Spikes of one trial of a multi-trial run, with the attributes of a SpikeMonitor that the analyses use"""
+    def __init__(self, i, t, n):
+        self.i = i
+        self.t_ = t
+        self.t = t * second
+        self.source = range(n)
+        self.num_spikes = i.size
+
+
+class RateData(object):
+    """Population rate of one trial of a multi-trial run, with the attributes of a PopulationRateMonitor"""
+    def __init__(self, rate, dt):
+        self.rate_ = rate
+        self.rate = rate * Hz
+        self.dt = dt
+        self.t_ = np.arange(rate.size) * dt
+        self.t = self.t_ * second
+
+    def smooth_rate(self, window='gaussian', width=None):
+        """same as PopulationRateMonitor.smooth_rate"""
+        width = unitless(width, second, as_int=False)
+        if window == 'gaussian':
+            width_dt = int(np.round(2 * width / self.dt))
+            window = np.exp(-np.arange(-width_dt, width_dt + 1) ** 2 / (2 * (width / self.dt) ** 2))
+        elif window == 'flat':
+            width_dt = int(width / 2 / self.dt) * 2 + 1
+            window = np.ones(width_dt)
+        else:
+            raise NotImplementedError(f'Unknown window {window}')
+        return np.convolve(self.rate_, window / window.sum(), mode='same') * Hz
+
+
+def split_trials(monitor, n_trials, runtime):
+    """
+    Cuts the recording of a multi-trial run into its trials, with times relative to the start of each trial.
+
+    :return: list with a SpikeData, RateData or (StateMonitor) namespace of the recorded variables per trial
+    """
+    from types import SimpleNamespace
+    from brian2.monitors import SpikeMonitor, PopulationRateMonitor
+    runtime = unitless(runtime, second, as_int=False)
+    dt = monitor.clock.dt_
+    starts = np.arange(n_trials + 1) * runtime - dt / 2
+
+    if isinstance(monitor, PopulationRateMonitor):
+        rate = monitor.rate_
+        steps = rate.size // n_trials
+        return [RateData(rate[k*steps:(k+1)*steps], dt) for k in range(n_trials)]
+
+    t = monitor.t_
+    edges = np.searchsorted(t, starts)
+    if isinstance(monitor, SpikeMonitor):
+        if not monitor.record:
+            return [monitor] * n_trials
+        i = monitor.i[:]
+        n = len(monitor.source)
+        return [SpikeData(i[a:b], t[a:b] - k*runtime, n)
+                for k, (a, b) in enumerate(zip(edges[:-1], edges[1:]))]
+
+    return [SimpleNamespace(t_=t[a:b] - k*runtime, **{v: getattr(monitor, v)[:, a:b] for v in monitor.record_variables})
+            for k, (a, b) in enumerate(zip(edges[:-1], edges[1:]))]
+
+
+def pad_settle(monitor, settle_time):
+    """
+    Recording of a run that started from the settled state (settle_cache) as if it covered the whole run: times are
+    shifted by settle_time and rates and recorded variables are zero during the settle phase, which the analyses skip.
+
+    :return: SpikeData, RateData or (StateMonitor) namespace of the recorded variables
+    """
+    from types import SimpleNamespace
+    from brian2.monitors import SpikeMonitor, PopulationRateMonitor
+    settle_time = unitless(settle_time, second, as_int=False)
+    dt = monitor.clock.dt_
+    n_pad = int(round(settle_time / dt))
+
+    if isinstance(monitor, PopulationRateMonitor):
+        return RateData(np.concatenate((np.zeros(n_pad, dtype=monitor.rate_.dtype), monitor.rate_)), dt)
+
+    if isinstance(monitor, SpikeMonitor):
+        if not monitor.record:
+            return monitor
+        return SpikeData(monitor.i[:], monitor.t_ + settle_time, len(monitor.source))
+
+    padded = {v: np.hstack((np.zeros((getattr(monitor, v).shape[0], n_pad)), getattr(monitor, v)))
+              for v in monitor.record_variables}
+    return SimpleNamespace(t_=np.concatenate((np.arange(n_pad) * dt, monitor.t_ + settle_time)), **padded)
+
+
+def stack_trials(trials):
+    """
+    Joins the result dicts of the trials of a multi-trial run into one, with the trials along the first axis.
+    Arrays whose shape differs between trials (e.g. isis) are concatenated, with name_offsets such that
+    trial k is values[offsets[k]:offsets[k+1]].
+    """
+    if not isinstance(trials[0], dict):
+        return trials[0]
+
+    stacked = {}
+    for name in trials[0]:
+        values = [np.asarray(trial[name]) for trial in trials]
+        if all(v.shape == values[0].shape for v in values):
+            stacked[name] = np.stack(values)
+        else:
+            values = [np.atleast_1d(v) for v in values]
+            stacked[name] = np.concatenate(values)
+            stacked[name + '_offsets'] = np.concatenate(([0], np.cumsum([v.shape[0] for v in values])))
+    return stacked
+
+
 def choice_selection(task_info, monitors, downsample_step=10):
     # params
     sim_dt = unitless(task_info['sim']['sim_dt'], second, as_int=False)
@@ -118,8 +315,8 @@ def choice_selection(task_info, monitors, downsample_step=10):
     # smooth rate monitors and downsample
     time = np.arange(0, runtime, sim_dt, dtype=np.float32)
     time_low_def = np.arange(0, runtime, new_dt, dtype=np.float32)
-    smooth_rates = [rate.smooth_rate(window='flat', width=smooth_win) for rate in monitors]
-    interp_rates = [interpolate_rates(rate, time, time_low_def) for rate in smooth_rates]
+    smoothed = [rate.smooth_rate(window='flat', width=smooth_win) for rate in monitors]
+    interp_rates = [interpolate_rates(rate, time, time_low_def) for rate in smoothed]
     rate_dec1, rate_dec2, rate_sen1, rate_sen2 = interp_rates
     rates_dec = np.vstack((rate_dec1, rate_dec2)).astype(np.float32)
     rates_sen = np.vstack((rate_sen1, rate_sen2)).astype(np.float32)
@@ -153,17 +350,90 @@ def reorder_winner_pop(pop_array, stack=False):
     return np_array([pop_array[1], pop_array[0]])
 
 
-def choice_probability(winner_trials, loser_trials, step=1):
-    """computes CP of a neuron from its spike distributions at each timepoint"""
-    tps = winner_trials.shape[1]
-    cp = np.empty(int(tps/step), dtype=np.float32)
-    bins = np.arange(-1, 151)
-    for t in np.linspace(0, tps-step, int(tps/step), dtype=np.int16):
-        x1, e1 = np.histogram(winner_trials[:, t:t+step], bins=bins, density=True)
-        x2, e2 = np.histogram(loser_trials[:, t:t+step], bins=bins, density=True)
-        cp[int(t/step)] = mtr.auc(np.cumsum(x1), np.cumsum(x2))
-
-    return cp
+def choice_probability(winner_trials, loser_trials, step=1, n_boot=0, ci=95, seed=None):
+    """computes CP of a neuron from its rate distributions at each timepoint, pooling the trials of each step"""
+    n1, tps = winner_trials.shape
+    n2 = loser_trials.shape[0]
+    tps_cp = int(tps/step)
+    rates = np.concatenate((winner_trials[:, :tps_cp*step], loser_trials[:, :tps_cp*step]))
+    rates = rates.reshape(n1 + n2, tps_cp, step).transpose(0, 2, 1).reshape(-1, tps_cp)
+    is_winner = np.repeat(np.arange(n1 + n2) < n1, step)
+
+    cp = roc_auc_batch(rates, is_winner, n_boot=n_boot, ci=ci, seed=seed)
+    if n_boot:
+        return tuple(x.astype(np.float32) for x in cp)
+    return cp.astype(np.float32)
+
+
+def midranks(x):
+    """ranks (from 1) along the last axis, tied values get the average of the ranks they span"""
+    n = x.shape[-1]
+    order = np.argsort(x, axis=-1, kind='mergesort')
+    x_sorted = np.take_along_axis(x, order, axis=-1)
+
+    # first and last sorted position of the run of equal values each element belongs to
+    pos = np.arange(n)
+    run_start = np.ones(x.shape, dtype=bool)
+    run_start[..., 1:] = x_sorted[..., 1:] != x_sorted[..., :-1]
+    run_end = np.ones(x.shape, dtype=bool)
+    run_end[..., :-1] = run_start[..., 1:]
+    first = np.maximum.accumulate(np.where(run_start, pos, 0), axis=-1)
+    last = np.minimum.accumulate(np.where(run_end, pos, n - 1)[..., ::-1], axis=-1)[..., ::-1]
+
+    ranks = np.empty(x.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=-1)
+    return ranks
+
+
+def roc_auc_batch(rates, is_winner, n_boot=0, ci=95, seed=None, max_bytes=2**28):
+    """
+    ROC area of winner vs loser trials from the Mann-Whitney U statistic, for all neurons and timepoints at once.
+    AUC = (R_w - n_w(n_w+1)/2) / (n_w n_l), with R_w the summed midranks of the winner trials.
+
+    :param rates: array (..., n_trials, tps)
+    :param is_winner: bool array (n_trials,), or one per neuron (..., n_trials)
+    :param n_boot: if > 0, also returns percentile bootstrap CIs, resampling trials within winners and losers
+    :param max_bytes: rough bound on temporary memory, rows and bootstrap samples are processed in blocks
+    :return: auc (..., tps), and if n_boot also lower and upper CI bounds
+    """
+    rates = np.asarray(rates)
+    is_winner = np.asarray(is_winner, dtype=bool)
+    n_trials, tps = rates.shape[-2:]
+    lead = rates.shape[:-2]
+
+    # one row per (neuron, timepoint) with all trials, each row gets its winner mask
+    x = np.moveaxis(rates, -1, -2).reshape(-1, n_trials)
+    w = np.broadcast_to(is_winner[..., np.newaxis, :], lead + (tps, n_trials)).reshape(-1, n_trials)
+
+    def auc_rows(x, w):
+        n_w = w.sum(axis=-1)
+        n_l = n_trials - n_w
+        block = max(1, int(max_bytes / (40 * n_trials)))
+        r_w = np.concatenate([(midranks(x[r:r + block]) * w[r:r + block]).sum(axis=-1)
+                              for r in range(0, x.shape[0], block)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (r_w - n_w * (n_w + 1) / 2) / (n_w * n_l)
+
+    auc = auc_rows(x, w).reshape(lead + (tps,))
+    if not n_boot:
+        return auc
+
+    assert is_winner.ndim == 1, 'bootstrap needs the same winner trials for all neurons'
+    rng = np.random.RandomState(seed)
+    winners, losers = np.where(is_winner)[0], np.where(~is_winner)[0]
+    w_boot = np.concatenate((np.ones(len(winners), dtype=bool), np.zeros(len(losers), dtype=bool)))
+    n_batch = max(1, int(max_bytes / (40 * x.size)))
+    auc_boot = np.empty((n_boot,) + auc.shape)
+    for b in range(0, n_boot, n_batch):
+        nb = min(n_batch, n_boot - b)
+        resampled = np.concatenate((rng.choice(winners, (nb, len(winners))),
+                                    rng.choice(losers, (nb, len(losers)))), axis=1)
+        x_boot = x.reshape(-1, tps, n_trials)[:, :, resampled]       # (rows, tps, nb, n_trials)
+        x_boot = np.moveaxis(x_boot, 2, 0).reshape(-1, n_trials)
+        auc_boot[b:b + nb] = auc_rows(x_boot, np.broadcast_to(w_boot, x_boot.shape)).reshape((nb,) + auc.shape)
+    lower, upper = np.nanpercentile(auc_boot, [(100 - ci) / 2, (100 + ci) / 2], axis=0)
+
+    return auc, lower, upper
 
 
 def pair_noise_corr(rates1, rates2, step=1):
@@ -177,6 +447,89 @@ def pair_noise_corr(rates1, rates2, step=1):
     return corr
 
 
+def zscore_trials(rates):
+    """z-scores rates (..., n_trials, tps) across trials, nan where a rate does not vary"""
+    mean = rates.mean(axis=-2, keepdims=True, dtype=np.float64)
+    std = rates.std(axis=-2, keepdims=True, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((rates - mean) / std).astype(np.float32)
+
+
+def noise_corr_all(rates, filename=None, max_bytes=2**28):
+    """
+    Pearson correlations across trials of all pairs of neurons at each timepoint, as pair_noise_corr with step=1.
+    The correlations of a block of pairs at all timepoints are one batched product of z-scored rates, blocks of
+    about max_bytes are written to the output one after the other.
+
+    :param rates: array (nn, n_trials, tps)
+    :param filename: .npy file the correlations are streamed to (and returned memory-mapped), in memory if None
+    :return: corr (nn, nn, tps) float32
+    """
+    nn, n_trials, tps = rates.shape
+    z = np.moveaxis(zscore_trials(np.asarray(rates)), -1, 0)       # (tps, nn, n_trials)
+    if filename is None:
+        corr = np.empty((nn, nn, tps), dtype=np.float32)
+    else:
+        corr = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32, shape=(nn, nn, tps))
+
+    block = max(1, int(np.sqrt(max_bytes / (8 * tps))))
+    for i0 in range(0, nn, block):
+        for j0 in range(i0, nn, block):
+            # (tps, block_i, block_j), the transposed block is filled from the same product
+            c = np.moveaxis(np.matmul(z[:, i0:i0 + block], np.swapaxes(z[:, j0:j0 + block], 1, 2)) / n_trials, 0, -1)
+            corr[i0:i0 + block, j0:j0 + block] = c
+            if j0 != i0:
+                corr[j0:j0 + block, i0:i0 + block] = np.swapaxes(c, 0, 1)
+    if filename is not None:
+        corr.flush()
+
+    return corr
+
+
+def sample_pairs(rows, cols, n_pairs, seed=None):
+    """n_pairs random pairs of different neurons (i from rows, j from cols), drawn with replacement"""
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    assert len(np.union1d(rows, cols)) > 1, 'pairs need at least two neurons'
+    rng = np.random.RandomState(seed)
+    i, j = rng.choice(rows, n_pairs), rng.choice(cols, n_pairs)
+    same = i == j
+    while same.any():
+        j[same] = rng.choice(cols, same.sum())
+        same = i == j
+    return i, j
+
+
+def noise_corr_pairs(rates, i, j, max_bytes=2**28):
+    """
+    Noise correlations (as noise_corr_all) of the pairs (i[k], j[k]) only, to estimate population averages
+    from sampled pairs when all pairs are too many.
+
+    :return: corr (n_pairs, tps) float32
+    """
+    nn, n_trials, tps = rates.shape
+    z = zscore_trials(np.asarray(rates))
+    corr = np.empty((len(i), tps), dtype=np.float32)
+    block = max(1, int(max_bytes / (8 * n_trials * tps)))
+    for k in range(0, len(i), block):
+        corr[k:k + block] = (z[i[k:k + block]] * z[j[k:k + block]]).mean(axis=1)
+    return corr
+
+
+def noise_corr_estimate(corr_pairs, ci=95):
+    """
+    Mean noise correlation over sampled pairs with a normal confidence interval of the mean, pairs with
+    undefined (nan) correlations are left out.
+
+    :param corr_pairs: (n_pairs, tps) from noise_corr_pairs
+    :return: mean, lower, upper (tps)
+    """
+    from scipy.stats import norm
+    mean = np.nanmean(corr_pairs, axis=0)
+    sem = np.nanstd(corr_pairs, axis=0) / np.sqrt(np.maximum(np.sum(~np.isnan(corr_pairs), axis=0), 1))
+    half = norm.ppf((100 + ci) / 200) * sem
+    return mean, mean - half, mean + half
+
+
 def create_inset(axes, data2plt, c, xlim, w=1, h=0.7, nyticks=4):
     from mpl_toolkits.axes_grid1.inset_locator import inset_axes
     ax_ins = inset_axes(axes, w, h, loc=1)
@@ -418,7 +771,7 @@ def plot_isis(task_info, isis, ieis, ibis, cvs, spks_per_burst, task_dir, fig_na
     save_figure(task_dir, fig5, fig_name)
 
 
-def plot_fig3(task_info, dend_mon, events, bursts, spikes, pop_dend, task_dir):
+def plot_fig3(task_info, dend_rec, events, bursts, spikes, pop_dend, task_dir):
     sns.set(context=cntxt, style='darkgrid')
     smooth_win = task_info['sim']['smooth_win']
     eta0 = unitless(task_info['plastic']['eta0'], pA)
@@ -430,7 +783,7 @@ def plot_fig3(task_info, dend_mon, events, bursts, spikes, pop_dend, task_dir):
     B0 = unitless(task_info['plastic']['tauB'], second) * target
     eta = eta0 * tau_update / tauB
     fb_rate = unitless(task_info['plastic']['dec_winner_rate'], Hz)
-    time = np.linspace(0, dend_mon.t_[-1], bursts.shape[1])
+    time = np.linspace(0, dend_rec.t_muOUd[-1], bursts.shape[1])
     last_time = time[-1]
     zoom_inteval = (last_time-5, last_time-3)
     xlim_inteval = (0, last_time)
@@ -440,36 +793,36 @@ def plot_fig3(task_info, dend_mon, events, bursts, spikes, pop_dend, task_dir):
     fig3, axs = plt.subplots(nrows, ncols, figsize=(int(6*ncols), int(4*nrows)), dpi=100, sharex='row')
     fig3.add_axes(axs[0, 0])
     plt.title(r'Plasticity weights')
-    plt.plot(dend_mon.t_, dend_mon.muOUd[:nn2plt].T*1e12, color='gray', lw=0.5)
-    plt.plot(dend_mon.t_, dend_mon.muOUd.mean(axis=0)*1e12, color='C0', lw=1.5)
+    plt.plot(dend_rec.t_muOUd, dend_rec.muOUd[:nn2plt].T*1e12, color='gray', lw=0.5)
+    plt.plot(dend_rec.t_muOUd, dend_rec.muOUd_mean*1e12, color='C0', lw=1.5)
     plt.ylabel(r'$\mu_{OU_{d}}$ $(pA)$')
     plt.xlim(xlim_inteval)
-    create_inset(axs[0, 0], (dend_mon.t_, dend_mon.muOUd.mean(axis=0) * 1e12), 'C0', zoom_inteval)
+    create_inset(axs[0, 0], (dend_rec.t_muOUd, dend_rec.muOUd_mean * 1e12), 'C0', zoom_inteval)
 
     fig3.add_axes(axs[1, 0])
-    B = dend_mon.B.mean(axis=0)
+    B = dend_rec.B_mean
     plt.title(r'Difference from target')
-    plt.plot(dend_mon.t_[::step_update], dend_mon.B[:nn2plt, ::step_update].T - B0, color='gray', lw=0.5)
-    plt.plot(dend_mon.t_, B - B0, color='C4', lw=1.5)
+    plt.plot(dend_rec.t_B[::step_update], dend_rec.B[:nn2plt, ::step_update].T - B0, color='gray', lw=0.5)
+    plt.plot(dend_rec.t_B, B - B0, color='C4', lw=1.5)
     plt.ylabel(r'$B - B0$')
     plt.xlim(xlim_inteval)
-    create_inset(axs[1, 0], (dend_mon.t_, B - B0), 'C4', zoom_inteval)
+    create_inset(axs[1, 0], (dend_rec.t_B, B - B0), 'C4', zoom_inteval)
 
     fig3.add_axes(axs[0, 1])
     plt.title(r'Dendritic background current')
-    plt.plot(dend_mon.t_[::step_update], dend_mon.Ibg[:nn2plt, ::step_update].T*1e9, color='gray', lw=0.2)
-    plt.plot(dend_mon.t_[::step_update], dend_mon.Ibg[:, ::step_update].mean(axis=0)*1e9, color='black', lw=1)
+    plt.plot(dend_rec.t_Ibg, dend_rec.Ibg[:nn2plt].T*1e9, color='gray', lw=0.2)
+    plt.plot(dend_rec.t_Ibg, dend_rec.Ibg_mean*1e9, color='black', lw=1)
     plt.ylabel('$I_{OU_{d}}$ $(nA)$')
     plt.xlim(xlim_inteval)
-    create_inset(axs[0, 1], (dend_mon.t_[::step_update], dend_mon.Ibg[:, ::step_update].mean(axis=0)*1e9), 'black', zoom_inteval)
+    create_inset(axs[0, 1], (dend_rec.t_Ibg, dend_rec.Ibg_mean*1e9), 'black', zoom_inteval)
 
     fig3.add_axes(axs[1, 1])
     plt.title(r'Dendritic feedback current')
-    plt.plot(dend_mon.t_[::step_update], dend_mon.g_ea[:nn2plt, ::step_update].T*1e3, color='gray', lw=0.2)
-    plt.plot(dend_mon.t_[::step_update], dend_mon.g_ea[:, ::step_update].mean(axis=0)*1e3, color='C3', lw=1)
+    plt.plot(dend_rec.t_g_ea, dend_rec.g_ea[:nn2plt].T*1e3, color='gray', lw=0.2)
+    plt.plot(dend_rec.t_g_ea, dend_rec.g_ea_mean*1e3, color='C3', lw=1)
     plt.xlim(xlim_inteval)
     plt.ylabel(r'$g_{ea}$ $(a.u.)$ ${\sim}I_{dec}$')
-    create_inset(axs[1, 1], (dend_mon.t_[::step_update], dend_mon.g_ea[:, ::step_update].mean(axis=0)*1e3), 'C3', zoom_inteval)
+    create_inset(axs[1, 1], (dend_rec.t_g_ea, dend_rec.g_ea_mean*1e3), 'C3', zoom_inteval)
 
     fig3.add_axes(axs[2, 1])
     plt.plot(pop_dend.t, pop_dend.smooth_rate(window='flat', width=smooth_win), color='C4', lw=1)
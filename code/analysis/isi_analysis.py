@@ -1,4 +1,5 @@
 from snep.utils import experiment_opener, filter_tasks
+from snep.tables.trials import open_trial_store
 from helper_funcs import plot_isis, np_array
 from tqdm import tqdm
 import pickle
@@ -33,31 +34,12 @@ def get_isis(tables_task_ids):
         params = tables.get_general_params(True)
         param_ranges = tables.read_param_ranges()
 
-        # filter tasks to only the targets
-        targets = [{('c',): 0, (target_var,): target_value}, ]
-        target_ids = filter_tasks(task_ids, targets)
-        params[target_var] = target_value
-
-        # allocate variables to save
-        cvs = []
-        isis = []
-        ieis = []
-        ibis = []
-        spks_per_burst = []
-
-        for i, tid in tqdm(enumerate(target_ids)):
-            cvs.extend(tables.get_computed(tid, 'cvs'))
-            isis.extend(tables.get_computed(tid, 'isis'))
-            ieis.extend(tables.get_computed(tid, 'ieis'))
-            ibis.extend(tables.get_computed(tid, 'ibis'))
-            spks_per_burst.extend(tables.get_computed(tid, 'spks_per_burst'))
-
-        # from lists to arrays
-        cvs = np_array(cvs)
-        isis = np_array(isis)
-        ieis = np_array(ieis)
-        ibis = np_array(ibis)
-        spks_per_burst = np_array(spks_per_burst)
+        # columnar copy of the trials, then filter to only the targets
+        names = ['cvs', 'isis', 'ieis', 'ibis', 'spks_per_burst']
+        with open_trial_store(tables, task_ids, ragged=[('computed', name) for name in names]) as store:
+            trials = store.select([{('c',): 0, (target_var,): target_value}, ])
+            params[target_var] = target_value
+            cvs, isis, ieis, ibis, spks_per_burst = [np_array(store.ragged(name, trials)) for name in names]
 
         # plot figure and save data
         plot_isis(params, cvs, isis, ieis, ibis, spks_per_burst, task_dir, fig_name)
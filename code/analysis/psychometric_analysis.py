@@ -1,5 +1,6 @@
 import numpy as np
-from snep.utils import experiment_opener, filter_tasks
+from snep.utils import experiment_opener
+from snep.tables.trials import open_trial_store
 from helper_funcs import plot_psychometric
 import pickle
 
@@ -36,13 +37,12 @@ def get_psychometric(tables_task_ids):
         n_trials = len(param_ranges[('iter',)].value)
         winner_pops = np.empty((len(c_ranges), n_trials))
 
-        for c, c_value in enumerate(c_ranges):    # linspace(-1, 1, 11):
-            # filtertasks
-            targets = [{('c',): c_value, ('bfb',): 0}, ]
-            target_ids = filter_tasks(task_ids, targets)
-
-            for i, tid in enumerate(target_ids):
-                winner_pops[c, i] = np.logical_not(tables.get_raw_data(tid, 'winner_pop')[0])
+        with open_trial_store(tables, task_ids, trial=[('raw_data', 'winner_pop')]) as store:
+            for c, c_value in enumerate(c_ranges):    # linspace(-1, 1, 11):
+                # filtertasks
+                targets = [{('c',): c_value, ('bfb',): 0}, ]
+                trials = store.select(targets)
+                winner_pops[c, :len(trials)] = np.logical_not(store.trial('winner_pop', trials)[:, 0])
 
         # figures and save data
         plot_psychometric(c_ranges, winner_pops, task_dir, fig_name)
@@ -0,0 +1,66 @@
+# Content-addressed cache of compiled cpp_standalone projects.
+#   - a project is keyed on what shapes the generated code: equations, group sizes and structural flags
+#   - tasks check out a copy of the cached project, brian2 only rewrites the files whose content changed
+#     and make only recompiles those (per-task constants and seeds), the rest of the objects are reused
+#   - the key only decides reuse, never correctness: a stale copy is simply recompiled where needed
+import os
+import shutil
+import tempfile
+
+# entries of task_info['sim'] that change which objects end up in the generated code
+structure_sim_keys = ['sim_dt', 'stim_dt', 'runtime', 'num_method', '2c_model', 'plasticity', 'online_stim',
+                      'plt_fig1', 'burst_analysis', 'n_trials', 'binned_spikes', 'count_dt',
+                      'warm_start', 'aggregated_input', 'topology_cache']
+
+
+def structure_key(task_info):
+    """Hash of the network structure: equations from neuron_models, group sizes, structural sim flags and OpenMP."""
+    import brian2
+    import neuron_models as nm
+    from param_tree import content_hash
+
+    structure = {
+        'eqs': {name: eqs for name, eqs in vars(nm).items() if name.startswith('eqs_')},
+        'dec': task_info['dec'],
+        'sen': task_info['sen'],
+        'sim': {k: task_info['sim'][k] for k in structure_sim_keys if k in task_info['sim']},
+        'openmp': brian2.prefs.devices.cpp_standalone.openmp_threads > 0,
+        'brian2': brian2.__version__}
+
+    return content_hash(structure)[:16]
+
+
+def checkout_build(task_info, cache_dir, tempdir):
+    """
+    Copy the cached project matching the network structure into the task's tempdir, if there is one.
+
+    :return: project directory for set_device and the structure key
+    """
+    key = structure_key(task_info)
+    build_dir = os.path.join(tempdir, 'standalone')
+    cached = os.path.join(cache_dir, key)
+    if os.path.isdir(cached):
+        # copytree keeps the mtimes, so make sees the objects as up to date
+        shutil.copytree(cached, build_dir, symlinks=True)
+        print(f'Reusing compiled standalone project {key}')
+
+    return build_dir, key
+
+
+def publish_build(build_dir, key, cache_dir):
+    """Atomically add a compiled project to the cache, unless another worker already published it."""
+    cached = os.path.join(cache_dir, key)
+    if os.path.isdir(cached):
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.' + key, dir=cache_dir)
+    try:
+        staged = os.path.join(staging, key)
+        shutil.copytree(build_dir, staged, symlinks=True, ignore=shutil.ignore_patterns('results', 'static_arrays'))
+        os.rename(staged, cached)
+        print(f'Published compiled standalone project {key}')
+    except OSError:
+        pass    # published concurrently by another worker, keep theirs
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
@@ -8,6 +8,7 @@
 import numpy as np
 import neuron_models as nm
 import get_params as params
+from streams import stream, stream_seed
 from helper_funcs import get_OUstim, unitless, get_this_dt, get_this_time
 from brian2 import PoissonGroup, PoissonInput, linked_var, TimedArray, seed, Network
 from brian2.groups import NeuronGroup
@@ -25,14 +26,23 @@ def get_hierarchical_net(task_info):
     sen_groups, sen_synapses, sen_subgroups = mk_sen_circuit(task_info)
     fffb_synapses = mk_fffb_synapses(task_info, dec_subgroups, sen_subgroups)
 
-    seed(task_info['seed'])
+    if not keyed_streams(task_info):
+        seed(task_info['seed'])
     # seed(1657831915)
+    seed_stream(task_info, 'init', 'dec')
     dec_groups = init_conds_dec(dec_groups)
+    seed_stream(task_info, 'init', 'sen')
     sen_groups = init_conds_sen(sen_groups, two_comp=task_info['sim']['2c_model'])
     monitors = mk_monitors(task_info, dec_groups, sen_groups, dec_subgroups, sen_subgroups)
     net = Network(dec_groups.values(), dec_synapses.values(),
                   sen_groups.values(), sen_synapses.values(),
                   fffb_synapses.values(), *monitors, name='hierarchical_net')
+    if task_info['sim']['online_stim']:
+        # kept out of monitors, whose order the analyses rely on, retrieve with net['stim_mon']
+        net.add(mk_stim_monitor(task_info, sen_groups['stim_common']))
+    if task_info['sim'].get('binned_spikes', False):
+        # same for the spike counters, retrieve with net['count_mon']
+        net.add(mk_count_monitor(task_info, sen_groups['SE']))
 
     return net, monitors
 
@@ -41,10 +51,13 @@ def get_plasticity_net(task_info):
     """Construct sensory circuit for inhibitory plasticity experiment."""
     sen_groups, sen_synapses, sen_subgroups = mk_sen_circuit_plastic(task_info)
 
-    seed(task_info['seed'])
+    if not keyed_streams(task_info):
+        seed(task_info['seed'])
+    seed_stream(task_info, 'init', 'sen')
     sen_groups = init_conds_sen(sen_groups, two_comp=True, plastic=True)
     monitors = mk_monitors_plastic(task_info, sen_groups, sen_subgroups)
     net = Network(sen_groups.values(), sen_synapses.values(), *monitors, name='plasticity_net')
+    net.add(mk_recorders_plastic(task_info, sen_subgroups))
 
     return net, monitors
 
@@ -62,7 +75,7 @@ def mk_dec_circuit(task_info):
     N_D1 = int(N_E * sub)               # size of exc sub-pop D1, D2
     N_D2 = N_D1                         # size of exc sub-pop D2
     N_D3 = int(N_E * (1 - 2 * sub))     # size of exc sub-pop D3, the rest
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
 
     # define namespace
     paramdec = params.get_dec_params(task_info)
@@ -86,20 +99,38 @@ def mk_dec_circuit(task_info):
                        refractory='tau_refI', namespace=paramdec, name='decI')
 
     # weight connections according to different subgroups
+    seed_stream(task_info, 'connectivity', 'dec')
     condsame = '(label_pre != 3 and label_pre == label_post)'
     conddiff = '(label_pre != 3 and label_pre != label_post) or (label_pre == 3 and label_post != 3)'
     condrest = '(label_post == 3)'
 
     # NMDA: exc --> exc
-    synDEDEn = Synapses(decE, decE, model=nm.eqs_NMDA, method=num_method,
-                        on_pre='x_en += w', delay=d,
+    #   - a spike only drives the NMDA gating of its own neuron, so one-to-one
+    synDEDEn = Synapses(decE, decE, on_pre='x_en += 1', delay=d,
                         namespace=paramdec, name='synDEDEn')
-    synDEDEn.connect()
-    synDEDEn.w['i == j'] = 1
-    synDEDEn.w['i != j'] = 0
-    synDEDEn.w_nmda[condsame] = 'w_p * gEEn/gleakE'
-    synDEDEn.w_nmda[conddiff] = 'w_m * gEEn/gleakE'
-    synDEDEn.w_nmda[condrest] = 'gEEn/gleakE'
+    synDEDEn.connect(j='i')
+
+    #   - g_ent = sum(w_nmda * g_en) with w_nmda set by labels: sum g_en per sub-pop first, then spread the
+    #     3 pooled values
+    decP = NeuronGroup(3, model=nm.eqs_NMDA_pool, namespace=paramdec, name='decP')
+    decP.label = np.arange(1, 4)
+
+    synDEDPn = Synapses(decE, decP, model=nm.eqs_NMDA_sum, method=num_method,
+                        namespace=paramdec, name='synDEDPn')
+    synDEDPn.connect(condition='label_pre == label_post')
+
+    synDPDEn = Synapses(decP, decE, model=nm.eqs_NMDA, method=num_method,
+                        namespace=paramdec, name='synDPDEn')
+    synDPDEn.connect()
+    synDPDEn.w_nmda[condsame] = 'w_p * gEEn/gleakE'
+    synDPDEn.w_nmda[conddiff] = 'w_m * gEEn/gleakE'
+    synDPDEn.w_nmda[condrest] = 'gEEn/gleakE'
+
+    #   - both summed updaters run in 'groups' before decE integrates (order 0), the pool sum before the spread,
+    #     so g_ent is the sum of the g_en of the same step and never lags
+    for syn, order in ((synDEDPn, -2), (synDPDEn, -1)):
+        for updater in syn.summed_updaters.values():
+            updater.when, updater.order = 'groups', order
 
     # NMDA: exc --> inh
     decI.w_nmda = '(gEIn/gleakI) / (gEEn/gleakE)'
@@ -141,10 +172,10 @@ def mk_dec_circuit(task_info):
     extI = PoissonInput(decI, 'g_ea', N=1, rate=nu_ext_3I, weight='gXI/gleakI')
 
     # variables to return
-    groups = {'DE': decE, 'DI': decI, 'DX': extE, 'DX3': extE3, 'DXI': extI}
+    groups = {'DE': decE, 'DI': decI, 'DP': decP, 'DX': extE, 'DX3': extE3, 'DXI': extI}
     subgroups = {'DE1': decE1, 'DE2': decE2, 'DE3': decE3}
-    synapses = {'synDEDEn': synDEDEn, 'synDEDEa': synDEDEa, 'synDEDIa': synDEDIa,
-                'synDIDE': synDIDE, 'synDIDI': synDIDI}
+    synapses = {'synDEDEn': synDEDEn, 'synDEDPn': synDEDPn, 'synDPDEn': synDPDEn,
+                'synDEDEa': synDEDEa, 'synDEDIa': synDEDIa, 'synDIDE': synDIDE, 'synDIDI': synDIDI}
 
     return groups, synapses, subgroups
 
@@ -161,7 +192,7 @@ def mk_sen_circuit(task_info):
     N_X = task_info['sen']['N_X']       # size of external population
     sub = task_info['sen']['sub']       # fraction of stim-selective exc neurons
     N_E1 = int(N_E * sub)               # size of exc sub-pop 1, 2
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
     two_comp = task_info['sim']['2c_model']
 
     # define namespace
@@ -170,12 +201,25 @@ def mk_sen_circuit(task_info):
     else:
         paramsen = params.get_sen_params(task_info)
 
+    # stimulus from a TimedArray (Irec) or generated during the run
+    online_stim = task_info['sim']['online_stim']
+    eqs_stim = nm.eqs_stim_linked if online_stim else nm.eqs_stim_array
+
+    # binned spike recording: exc neurons count their spikes, events and bursts in the reset
+    binned_spikes = task_info['sim'].get('binned_spikes', False)
+    eqs_counts, reset_counts = (nm.eqs_spike_counts, nm.eqs_spike_counts_reset) if binned_spikes else ('', '')
+    paramsen['valid_burst'] = task_info['sim']['valid_burst'] * second
+
+    # external population, or its input drawn per neuron and step
+    aggregated = task_info['sim'].get('aggregated_input', False)
+    eqs_ext = nm.eqs_aggregated_input.format(name='X') if aggregated else ''
+
     # neuron groups
     if two_comp:
-        eqs_soma = nm.eqs_naud_soma + nm.eqs_stim_array
+        eqs_soma = nm.eqs_naud_soma + eqs_stim + eqs_counts + eqs_ext
         senE = NeuronGroup(N_E, model=eqs_soma, method=num_method, threshold='V>=Vt',
                            reset='''V = Vl
-                                    w_s += bws''',
+                                    w_s += bws''' + reset_counts,
                            refractory='tau_refE', namespace=paramsen, name='senE')
         dend = NeuronGroup(N_E, model=nm.eqs_naud_dend, method=num_method, namespace=paramsen, name='dend')
         senE.V_d = linked_var(dend, 'V_d')
@@ -185,19 +229,26 @@ def mk_sen_circuit(task_info):
         dend1 = dend[:N_E1]
         dend2 = dend[N_E1:]
     else:
-        senE = NeuronGroup(N_E, model=nm.eqs_wimmer_exc, method=num_method, threshold='V>=Vt', reset='V=Vr',
-                           refractory='tau_refE', namespace=paramsen, name='senE')
+        senE = NeuronGroup(N_E, model=nm.eqs_wimmer_exc + eqs_stim + eqs_counts + eqs_ext, method=num_method,
+                           threshold='V>=Vt', reset='V=Vr\n' + reset_counts, refractory='tau_refE',
+                           namespace=paramsen, name='senE')
         senE1 = senE[:N_E1]
         senE2 = senE[N_E1:]
 
-    senI = NeuronGroup(N_I, model=nm.eqs_wimmer_inh, method=num_method, threshold='V>=Vt', reset='V=Vr',
+    if binned_spikes:
+        senE.t_spk = -1e4 * second
+
+    senI = NeuronGroup(N_I, model=nm.eqs_wimmer_inh + eqs_ext, method=num_method, threshold='V>=Vt', reset='V=Vr',
                        refractory='tau_refI', namespace=paramsen, name='senI')
 
     # external population
-    extS = PoissonGroup(N_X, rates='nu_ext', namespace=paramsen)
+    if aggregated:
+        extS = mk_sen_ext_aggregated(task_info, senE, senI, paramsen)
+    else:
+        extS = PoissonGroup(N_X, rates='nu_ext', namespace=paramsen)
 
     # synapses
-    synapses = mk_sen_synapses(task_info, senE, senI, extS, paramsen)
+    synapses = mk_sen_synapses(task_info, senE, senI, None if aggregated else extS, paramsen)
 
     # variables to return
     if two_comp:
@@ -207,6 +258,12 @@ def mk_sen_circuit(task_info):
         groups = {'SE': senE, 'SI': senI, 'SX': extS}
         subgroups = {'SE1': senE1, 'SE2': senE2}
 
+    if online_stim:
+        stim_groups, syn_stim_mean = mk_sen_stimulus_online(task_info, N_E1)
+        senE.I = linked_var(stim_groups['stimE'], 'I')
+        groups = {**groups, **stim_groups}
+        synapses = {**synapses, 'syn_stim_mean': syn_stim_mean}
+
     return groups, synapses, subgroups
 
 
@@ -222,7 +279,7 @@ def mk_sen_circuit_plastic(task_info):
     N_X = task_info['sen']['N_X']       # size of external population
     sub = task_info['sen']['sub']       # fraction of stim-selective exc neurons
     N_E1 = int(N_E * sub)               # size of exc sub-pop 1, 2
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
 
     # define namespace
     paramplastic = params.get_plasticity_params(task_info)
@@ -236,8 +293,14 @@ def mk_sen_circuit_plastic(task_info):
     else:
         eqs_soma_plastic = nm.eqs_naud_soma + nm.eqs_stim_array
 
+    # external and feedback populations, or their input drawn per neuron and step
+    aggregated = task_info['sim'].get('aggregated_input', False)
+    eqs_ext = nm.eqs_aggregated_input.format(name='X') if aggregated else ''
+    eqs_fb = nm.eqs_aggregated_input.format(name='DX') if aggregated else ''
+    eqs_soma_plastic += eqs_ext
+
     # neuron groups
-    eqs_dend_plastic = nm.eqs_naud_dend + nm.eqs_plasticity
+    eqs_dend_plastic = nm.eqs_naud_dend + nm.eqs_plasticity + eqs_fb
     senE = NeuronGroup(N_E, model=eqs_soma_plastic, method=num_method, threshold='V>=Vt',
                        reset='''V = Vl
                                 w_s += bws''',
@@ -246,9 +309,12 @@ def mk_sen_circuit_plastic(task_info):
                        reset='''B += 1
                                 burst_start = 0''',
                        refractory='burst_stop >= min_burst_stop', namespace=paramplastic, name='dend')
-    senI = NeuronGroup(N_I, model=nm.eqs_wimmer_inh, method=num_method, threshold='V>=Vt', reset='V=Vr',
+    senI = NeuronGroup(N_I, model=nm.eqs_wimmer_inh + eqs_ext, method=num_method, threshold='V>=Vt', reset='V=Vr',
                        refractory='tau_refI', namespace=paramplastic, name='senI')
-    extS = PoissonGroup(N_X, rates='nu_ext', namespace=paramplastic)
+    if aggregated:
+        extS = mk_sen_ext_aggregated(task_info, senE, senI, paramplastic)
+    else:
+        extS = PoissonGroup(N_X, rates='nu_ext', namespace=paramplastic)
 
     # subgroups
     senE1 = senE[:N_E1]
@@ -285,14 +351,16 @@ def mk_sen_circuit_plastic(task_info):
     dend1.run_regularly('muOUd = clip(muOUd - eta * (B - B0), -100*amp, 0)', dt=tau_update)
 
     # connections
-    sen_synapses = mk_sen_synapses(task_info, senE, senI, extS, paramplastic)
+    sen_synapses = mk_sen_synapses(task_info, senE, senI, None if aggregated else extS, paramplastic)
     extD1, synDXdend1 = mk_poisson_fb(task_info, dend1)
 
     # variables to return
     groups = {'SE': senE, 'dend': dend, 'SI': senI, 'SX': extS, 'DX': extD1}
     subgroups = {'SE1': senE1, 'SE2': senE2,
                  'dend1': dend1, 'dend2': dend2}
-    synapses = {**sen_synapses, **{'synDXdend': synDXdend1, 'syn_burst_trace': syn_burst_trace}}
+    synapses = {**sen_synapses, **{'syn_burst_trace': syn_burst_trace}}
+    if synDXdend1 is not None:
+        synapses['synDXdend'] = synDXdend1
 
     if task_info['sim']['online_stim']:
         groups = {**groups, **{'stim_common': stim_common, 'stimE': stimE}}
@@ -301,13 +369,14 @@ def mk_sen_circuit_plastic(task_info):
 
 
 def mk_sen_synapses(task_info, exc, inh, ext, param_space):
-    """creates synapses for the different types of sensory circuits"""
+    """creates synapses for the different types of sensory circuits, without external ones if ext is None"""
     # unpack variables
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
     sub = task_info['sen']['sub']
     dE = param_space['dE']
     dI = param_space['dI']
     dX = param_space['dX']
+    seed_stream(task_info, 'connectivity', 'sen')
 
     # weight according to different subgroups
     condsame = '(i<N_pre*sub and j<N_post*sub) or (i>=N_pre*sub and j>=N_post*sub)'
@@ -318,7 +387,7 @@ def mk_sen_synapses(task_info, exc, inh, ext, param_space):
                        on_pre='''x_ea += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSESE')
-    synSESE.connect(p='eps')
+    connect_random(task_info, synSESE, param_space['eps'])
     synSESE.w[condsame] = 'w_p * gEE/gleakE * (1 + randn()*0.5)'
     synSESE.w[conddiff] = 'w_m * gEE/gleakE * (1 + randn()*0.5)'
     synSESE.delay = dE
@@ -328,7 +397,7 @@ def mk_sen_synapses(task_info, exc, inh, ext, param_space):
                        on_pre='''x_ea += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSESI')
-    synSESI.connect(p='eps')
+    connect_random(task_info, synSESI, param_space['eps'])
     synSESI.w = 'gEI/gleakI * (1 + randn()*0.5)'
     synSESI.delay = dE
 
@@ -337,7 +406,7 @@ def mk_sen_synapses(task_info, exc, inh, ext, param_space):
                        on_pre='''x_i += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSISE')
-    synSISE.connect(p='eps')
+    connect_random(task_info, synSISE, param_space['eps'])
     synSISE.w = 'gIE/gleakE * (1 + randn()*0.5)'
     synSISE.delay = dI
 
@@ -346,17 +415,22 @@ def mk_sen_synapses(task_info, exc, inh, ext, param_space):
                        on_pre='''x_i += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSISI')
-    synSISI.connect(p='eps')
+    connect_random(task_info, synSISI, param_space['eps'])
     synSISI.w = 'gII/gleakI * (1 + randn()*0.5)'
     synSISI.delay = dI
 
+    synapses = {'synSESE': synSESE, 'synSESI': synSESI,
+                'synSISE': synSISE, 'synSISI': synSISI}
+    if ext is None:
+        return synapses
+
     # external inputs and synapses
     synSXSE = Synapses(ext, exc, model='w : 1', method=num_method,
                        on_pre='''x_ea += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSXSE')
-    synSXSE.connect(condition=condsame, p='epsX * (1 + alphaX)')
-    synSXSE.connect(condition=conddiff, p='epsX * (1 - alphaX)')
+    connect_random(task_info, synSXSE, param_space['epsX'] * (1 + param_space['alphaX']),
+                   p_across=param_space['epsX'] * (1 - param_space['alphaX']), sub=sub)
     synSXSE.w = 'gXE/gleakE * (1 + randn()*0.5)'
     synSXSE.delay = dX
 
@@ -364,89 +438,295 @@ def mk_sen_synapses(task_info, exc, inh, ext, param_space):
                        on_pre='''x_ea += w
                                  w = clip(w, 0, gmax)''',
                        namespace=param_space, name='synSXSI')
-    synSXSI.connect(p='epsX')
+    connect_random(task_info, synSXSI, param_space['epsX'])
     synSXSI.w = 'gXI/gleakI * (1 + randn()*0.5)'
     synSXSI.delay = dX
 
     # variables to return
-    synapses = {'synSESE': synSESE, 'synSESI': synSESI,
-                'synSISE': synSISE, 'synSISI': synSISI,
-                'synSXSE': synSXSE, 'synSXSI': synSXSI}
+    synapses = {**synapses, 'synSXSE': synSXSE, 'synSXSI': synSXSI}
 
     return synapses
 
 
-def mk_sen_stimulus(task_info, arrays=False):
+def mk_sen_ext_aggregated(task_info, senE, senI, param_space):
+    """
+    External input of the sensory circuit aggregated per neuron (mk_aggregated_input), with the in-degrees and
+    weights of the external synapses of mk_sen_synapses.
+
+    :return: the group drawing the common input
+    """
+    rng = stream(task_info['sim']['seed_con'], 'sen', 'ext_indegree')
+    N_X = task_info['sen']['N_X']
+    sub = task_info['sen']['sub']
+    epsX = param_space['epsX']
+    corr = task_info['sim'].get('ext_corr', None)
+
+    # synaptic weights vary by randn()*0.5 around their mean
+    targets = [(senE, 'x_ea', get_indegrees(N_X, len(senE), sub, epsX, param_space['alphaX'], rng),
+                float(param_space['gXE'] / param_space['gleakE']), 0.5),
+               (senI, 'x_ea', get_indegrees(N_X, len(senI), sub, epsX, 0, rng),
+                float(param_space['gXI'] / param_space['gleakI']), 0.5)]
+
+    return mk_aggregated_input(targets, param_space['nu_ext'], epsX if corr is None else corr, 'X')
+
+
+def get_indegrees(n_pre, n_post, sub, eps, alpha, rng):
+    """
+    In-degrees of random connections between two populations split into sub-populations (i < n_pre*sub and
+    j < n_post*sub) with probability eps*(1 + alpha) within and eps*(1 - alpha) across.
+    """
+    n1_pre = int(np.ceil(n_pre * sub))
+    n_same = np.where(np.arange(n_post) < n_post * sub, n1_pre, n_pre - n1_pre)
+    return rng.binomial(n_same, eps * (1 + alpha)) + rng.binomial(n_pre - n_same, eps * (1 - alpha))
+
+
+def mk_aggregated_input(targets, rate, corr, name):
+    """
+    Aggregated Poisson input, replaces a population of independent Poisson sources and its synapses. Every step,
+    each target neuron gets the spikes of its in-degree sources as one Poisson count, their summed weight is drawn
+    with the mean and variance of the individual weights. Targets of random connections share sources, this is
+    kept as a count common to all targets, a fraction corr of the mean input.
+
+    :param targets: list of (group or subgroup, target variable, in-degrees, mean weight, cv of the weights), the
+                    groups have nm.eqs_aggregated_input formatted with name
+    :param rate: firing rate of the sources
+    :param corr: correlation of the input counts of two targets, the connection probability for shared sources
+    :return: the group drawing the common count
+    """
+    from brian2.groups.subgroup import Subgroup
+    dt = targets[0][0].clock.dt
+    mean_indegree = np.mean(np.concatenate([indegrees for _, _, indegrees, _, _ in targets]))
+    com = NeuronGroup(1, model='n_com : 1', namespace={'lam_com': float(corr * mean_indegree * rate * dt)},
+                      name=f'{name}_com')
+    com.run_regularly('n_com = poisson(lam_com)', when='synapses', order=-1)
+
+    for target, target_var, indegrees, weight, cv in targets:
+        group = target.source if isinstance(target, Subgroup) else target
+        start = getattr(target, 'start', 0)
+        idx = slice(start, start + len(indegrees))
+        lam, w = np.zeros(len(group)), np.zeros(len(group))
+        lam[idx] = np.clip(indegrees - corr * mean_indegree, 0, None) * float(rate * dt)
+        w[idx] = weight * (indegrees > 0)
+        setattr(group, f'lam_{name}', lam)
+        setattr(group, f'w_{name}', w)
+        setattr(group, f'n_com_{name}', linked_var(com, 'n_com', index=np.zeros(len(group), dtype=int)))
+        group.run_regularly(nm.aggregated_input_code.format(name=name, target_var=target_var, cv=cv),
+                            when='synapses', name=f'{group.name}_{name}_input')
+
+    return com
+
+
+def mk_sen_stimulus(task_info, arrays=False, stim_seed=None, t_start=None):
     """
     Generate common and private part of the stimuli for sensory neurons from an OU process.
 
+    :param stim_seed: seed of this stimulus, defaults to the task seed
+    :param t_start: time of the run at which the simulation starts (from a settled state), the TimedArray then
+                    starts there while the arrays still cover the whole run
     :return: TimedArray with the stimulus for sensory excitatory neurons
     """
-    # set seed with np - for standalone mode brian's seed() is not sufficient!
-    if task_info['sim']['replicate_stim']:
-        # replicated stimuli across iters
-        np.random.seed(123)
-    else:
-        # every iter has different stimuli
-        np.random.seed(task_info['seed'])
-
     # TimedArray stim
     if not task_info['sim']['online_stim']:
-        # simulation params
-        nn = int(task_info['sen']['N_E'] * task_info['sen']['sub'])     # no. of neurons in sub-pop1
-        stim_dt = task_info['sim']['stim_dt']
-        runtime = unitless(task_info['sim']['runtime'], stim_dt)
-        stim_on = unitless(task_info['sim']['stim_on'], stim_dt)
-        stim_off = unitless(task_info['sim']['stim_off'], stim_dt)
-        flip_stim = task_info['sim']['ramp_stim']
-        stim_time = get_this_time(task_info, runtime, include_settle_time=True)
-        tps = stim_off - stim_on                             # total stim points
-
-        # stimulus namespace
-        paramstim = params.get_stim_params(task_info)
-        tau = unitless(paramstim['tau_stim'], stim_dt)      # OU time constant
-        c = paramstim['c']
-        I0 = paramstim['I0']
-        I0_wimmer = paramstim['I0_wimmer']
-        mu1 = paramstim['mu1']
-        mu2 = paramstim['mu2']
-        if task_info['sim']['ramp_stim']:
-            # smooth the stim onset with a positive exponential decay
-            tau_ramp = 20e-3 / unitless(stim_dt, second, as_int=False)
-            mu1 *= (1 - np.exp(-np.arange(tps) / tau_ramp))
-            mu2 *= (1 - np.exp(-np.arange(tps) / tau_ramp))
-            mu1 = mu1[None, :]
-            mu2 = mu2[None, :]
-        sigma_stim = paramstim['sigma_stim']
-        sigma_ind = paramstim['sigma_ind']
-
-        # common and private part
-        z1 = np.tile(get_OUstim(tps, tau, flip_stim), (nn, 1))
-        z2 = np.tile(get_OUstim(tps, tau, flip_stim), (nn, 1))
-        np.random.seed(np.random.randint(10000))
-        zk1 = get_OUstim(tps * nn, tau, flip_stim).reshape(nn, tps)
-        zk2 = get_OUstim(tps * nn, tau, flip_stim).reshape(nn, tps)
-
-        # stim2TimedArray with zero padding if necessary
-        i1 = I0 + I0_wimmer * (c * mu1 + sigma_stim * z1 + sigma_ind * zk1)
-        i2 = I0 + I0_wimmer * (c * mu2 + sigma_stim * z2 + sigma_ind * zk2)
-        stim1 = i1.T.astype(np.float32)
-        stim2 = i2.T.astype(np.float32)
-        i1t = np.concatenate((np.zeros((stim_on, nn)), stim1,
-                              np.zeros((runtime - stim_off, nn))), axis=0).astype(np.float32)
-        i2t = np.concatenate((np.zeros((stim_on, nn)), stim2,
-                              np.zeros((runtime - stim_off, nn))), axis=0).astype(np.float32)
-        Irec = TimedArray(np.concatenate((i1t, i2t), axis=1)*amp, dt=stim_dt)
+        i_all, stim1, stim2, stim_time, stim_fluc = mk_sen_stimulus_values(task_info, stim_seed)
+        if t_start is not None:
+            i_all = i_all[int(round(t_start / task_info['sim']['stim_dt'])):]
+        Irec = TimedArray(i_all*amp, dt=task_info['sim']['stim_dt'])
 
         if arrays:
-            stim1 = i1t.T.astype(np.float32)
-            stim2 = i2t.T.astype(np.float32)
-            stim_fluc = np.hstack((np.zeros(stim_on), z1[0] - z2[0], np.zeros(runtime-stim_off)))
             return Irec, stim1, stim2, stim_time, stim_fluc
 
         return Irec
 
 
+def mk_sen_stimulus_trials(task_info, trial_seeds):
+    """
+    Stimuli of all trials of a multi-trial run, one after the other in a single TimedArray.
+
+    :return: TimedArray, list with (stim1, stim2, stim_time, stim_fluc) of each trial
+    """
+    all_values, trial_arrays = [], []
+    for trial_seed in trial_seeds:
+        i_all, stim1, stim2, stim_time, stim_fluc = mk_sen_stimulus_values(task_info, trial_seed)
+        all_values.append(i_all)
+        trial_arrays.append((stim1, stim2, stim_time, stim_fluc))
+    Irec = TimedArray(np.concatenate(all_values, axis=0)*amp, dt=task_info['sim']['stim_dt'])
+
+    return Irec, trial_arrays
+
+
+def mk_sen_stimulus_values(task_info, stim_seed=None):
+    """
+    Values of the stimulus of mk_sen_stimulus, (time, neurons) in amp without units.
+
+    :return: values, stim1, stim2, stim_time, stim_fluc
+    """
+    # set seed with np - for standalone mode brian's seed() is not sufficient!
+    # replicated stimuli across iters, otherwise every iter has different stimuli
+    root_seed = 123 if task_info['sim']['replicate_stim'] else task_info['seed'] if stim_seed is None else stim_seed
+    if keyed_streams(task_info):
+        rng_common, rng_private = stream(root_seed, 'stim', 'common'), stream(root_seed, 'stim', 'private')
+    else:
+        np.random.seed(root_seed)
+        rng_common = rng_private = None
+
+    # simulation params
+    nn = int(task_info['sen']['N_E'] * task_info['sen']['sub'])     # no. of neurons in sub-pop1
+    stim_dt = task_info['sim']['stim_dt']
+    runtime = unitless(task_info['sim']['runtime'], stim_dt)
+    stim_on = unitless(task_info['sim']['stim_on'], stim_dt)
+    stim_off = unitless(task_info['sim']['stim_off'], stim_dt)
+    flip_stim = task_info['sim']['ramp_stim']
+    stim_time = get_this_time(task_info, runtime, include_settle_time=True)
+    tps = stim_off - stim_on                             # total stim points
+
+    # stimulus namespace
+    paramstim = params.get_stim_params(task_info)
+    tau = unitless(paramstim['tau_stim'], stim_dt)      # OU time constant
+    c = paramstim['c']
+    I0 = paramstim['I0']
+    I0_wimmer = paramstim['I0_wimmer']
+    mu1 = paramstim['mu1']
+    mu2 = paramstim['mu2']
+    if task_info['sim']['ramp_stim']:
+        # smooth the stim onset with a positive exponential decay
+        tau_ramp = 20e-3 / unitless(stim_dt, second, as_int=False)
+        mu1 *= (1 - np.exp(-np.arange(tps) / tau_ramp))
+        mu2 *= (1 - np.exp(-np.arange(tps) / tau_ramp))
+        mu1 = mu1[None, :]
+        mu2 = mu2[None, :]
+    sigma_stim = paramstim['sigma_stim']
+    sigma_ind = paramstim['sigma_ind']
+
+    # common and private part
+    z1 = np.tile(get_OUstim(tps, tau, flip_stim, rng=rng_common), (nn, 1))
+    z2 = np.tile(get_OUstim(tps, tau, flip_stim, rng=rng_common), (nn, 1))
+    if rng_private is None:
+        np.random.seed(np.random.randint(10000))
+    zk1 = get_OUstim(tps * nn, tau, flip_stim, rng=rng_private).reshape(nn, tps)
+    zk2 = get_OUstim(tps * nn, tau, flip_stim, rng=rng_private).reshape(nn, tps)
+
+    # stim2TimedArray with zero padding if necessary
+    i1 = I0 + I0_wimmer * (c * mu1 + sigma_stim * z1 + sigma_ind * zk1)
+    i2 = I0 + I0_wimmer * (c * mu2 + sigma_stim * z2 + sigma_ind * zk2)
+    stim1 = i1.T.astype(np.float32)
+    stim2 = i2.T.astype(np.float32)
+    i1t = np.concatenate((np.zeros((stim_on, nn)), stim1,
+                          np.zeros((runtime - stim_off, nn))), axis=0).astype(np.float32)
+    i2t = np.concatenate((np.zeros((stim_on, nn)), stim2,
+                          np.zeros((runtime - stim_off, nn))), axis=0).astype(np.float32)
+
+    stim1 = i1t.T.astype(np.float32)
+    stim2 = i2t.T.astype(np.float32)
+    stim_fluc = np.hstack((np.zeros(stim_on), z1[0] - z2[0], np.zeros(runtime-stim_off)))
+    return np.concatenate((i1t, i2t), axis=1), stim1, stim2, stim_time, stim_fluc
+
+
+def get_stim_online_params(task_info):
+    """Stimulus namespace for mk_sen_stimulus_online, with the stim window and the onset ramp."""
+    paramstim = params.get_stim_params(task_info)
+    stim_dt = paramstim['stim_dt']
+    paramstim.update({'stim_on': task_info['sim']['stim_on'],
+                      'stim_off': task_info['sim']['stim_off'],
+                      'tau_ramp': 20e-3 * second,
+                      'ramp_on': int(task_info['sim']['ramp_stim']),
+                      'a_stim': np.exp(-unitless(stim_dt, paramstim['tau_stim'], as_int=False))})
+    return paramstim
+
+
+def mk_sen_stimulus_online(task_info, nn):
+    """
+    Stimulus of mk_sen_stimulus generated during the simulation instead of as a TimedArray.
+    The common (z) and private (zk) parts are the same discrete OU processes as get_OUstim, advanced once per
+    stim_dt and held at zero outside the stimulus window, so only the state of 2 + 2*nn variables is kept
+    instead of the whole stimulus. The population mean of zk is summed into stim_common for recording.
+
+    :return: groups (stim_common, stimE), synapses that compute the mean private part
+    """
+    paramstim = get_stim_online_params(task_info)
+    stim_dt = paramstim['stim_dt']
+    if task_info['sim']['replicate_stim']:
+        print('Online stimulus follows the task seed, replicate_stim is ignored')
+
+    stim_common = NeuronGroup(2, model=nm.eqs_stim_gated_common, dt=stim_dt, namespace=paramstim,
+                              name='stim_common')
+    stimE = NeuronGroup(2 * nn, model=nm.eqs_stim_gated, dt=stim_dt, namespace=paramstim, name='stimE')
+    stimE.z = linked_var(stim_common, 'z', index=np.repeat([0, 1], nn))
+    stimE[:nn].mu = paramstim['mu1']
+    stimE[nn:].mu = paramstim['mu2']
+
+    # exact AR(1) update, restarted from 0 at stim_on like get_OUstim
+    ou_update = '{z} = int(t - t_trial >= stim_on and t - t_trial < stim_off) * ' \
+                '(a_stim*{z} + sqrt(1 - a_stim**2)*{sigma}*randn())'
+    stim_common.run_regularly(ou_update.format(z='z', sigma='sigma_stim'), dt=stim_dt, when='start', order=-1)
+    stimE.run_regularly(ou_update.format(z='zk', sigma='sigma_ind'), dt=stim_dt, when='start', order=-1)
+
+    syn_stim_mean = Synapses(stimE, stim_common, model='zk_mean_post = zk_pre / nn : 1 (summed)',
+                             dt=stim_dt, namespace={'nn': nn}, name='syn_stim_mean')
+    syn_stim_mean.connect(i=np.arange(2 * nn), j=np.repeat([0, 1], nn))
+
+    return {'stim_common': stim_common, 'stimE': stimE}, syn_stim_mean
+
+
+def mk_stim_monitor(task_info, stim_common):
+    """Records the common part and the mean private part of the online stimulus, 2 values per stim_dt."""
+    from brian2.monitors import StateMonitor
+    return StateMonitor(stim_common, variables=['z', 'zk_mean'], record=True, dt=task_info['sim']['stim_dt'],
+                        when='end', name='stim_mon')
+
+
+def mk_count_monitor(task_info, senE):
+    """
+    Records the cumulative spike counters of the sensory exc neurons once per count_dt, before the thresholds of
+    the step so that the difference of two records is the count of the bin [t_k, t_k + count_dt).
+    """
+    from brian2.monitors import StateMonitor
+    count_dt = task_info['sim'].get('count_dt', task_info['sim']['stim_dt'])
+    return StateMonitor(senE, variables=['n_spk', 'n_event', 'n_burst'], record=True, dt=count_dt,
+                        when='thresholds', order=-1, name='count_mon')
+
+
+def count_mon2counts(count_mon, senE, n_trials=1):
+    """
+    Bins the cumulative counters recorded by mk_count_monitor, the last bin closes with the final state of senE.
+    Counters keep running across the trials of a multi-trial run, which are cut into equal parts.
+
+    :return: one dict per trial of spike, event and burst counts (neurons x bins) as int32
+    """
+    trials = [{} for _ in range(n_trials)]
+    for name in ('n_spk', 'n_event', 'n_burst'):
+        cumulative = np.hstack((getattr(count_mon, name), np.asarray(getattr(senE, name)[:])[:, None]))
+        counts = np.diff(cumulative, axis=1).astype(np.int32)
+        for k, trial_counts in enumerate(np.split(counts, n_trials, axis=1)):
+            trials[k][name[2:] + 's'] = trial_counts
+
+    return trials
+
+
+def stim_mon2arrays(task_info, stim_mon):
+    """
+    Rebuilds what mk_sen_stimulus(arrays=True) returns from the online stimulus monitor. stim1 and stim2 hold
+    the population mean of the stimulus (1 x time), which is all the analyses use.
+
+    :return: stim1, stim2, stim_time, stim_fluc
+    """
+    paramstim = get_stim_online_params(task_info)
+    stim_time = np.asarray(stim_mon.t_, dtype=np.float32)
+    stim_on = unitless(paramstim['stim_on'], second, as_int=False)
+    stim_off = unitless(paramstim['stim_off'], second, as_int=False)
+    tau_ramp = unitless(paramstim['tau_ramp'], second, as_int=False)
+    I0, I0_wimmer = float(paramstim['I0']), float(paramstim['I0_wimmer'])
+
+    gate = np.logical_and(stim_time >= stim_on, stim_time < stim_off)
+    ramp = 1 - paramstim['ramp_on'] * np.exp(-np.clip(stim_time - stim_on, 0, None) / tau_ramp)
+    z, zk_mean = stim_mon.z, stim_mon.zk_mean
+    stims = [gate * (I0 + I0_wimmer * (paramstim['c'] * mu * ramp + z[k] + zk_mean[k]))
+             for k, mu in enumerate((paramstim['mu1'], paramstim['mu2']))]
+    stim1, stim2 = [np.asarray(s, dtype=np.float32)[None, :] for s in stims]
+    stim_fluc = np.asarray((z[0] - z[1]) / paramstim['sigma_stim'], dtype=np.float32)
+
+    return stim1, stim2, stim_time, stim_fluc
+
+
 def mk_fffb_synapses(task_info, dec_subgroups, sen_subgroups):
     """
     Feedforward and feedback synapses of hierarchical network.
@@ -456,7 +736,7 @@ def mk_fffb_synapses(task_info, dec_subgroups, sen_subgroups):
     # params
     paramfffb = params.get_fffb_params(task_info)
     d = paramfffb['d']
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
     two_comp = task_info['sim']['2c_model']
 
     # unpack subgroups
@@ -480,8 +760,9 @@ def mk_fffb_synapses(task_info, dec_subgroups, sen_subgroups):
                          on_pre='x_ea += w', delay=d, name='synDE1SE1', namespace=paramfffb)
     synDE2SE2 = Synapses(decE2, fb_target2, model='w = w_fb : 1', method=num_method,
                          on_pre='x_ea += w', delay=d, name='synDE2SE2', namespace=paramfffb)
+    seed_stream(task_info, 'connectivity', 'fffb')
     for syn in [synSE1DE1, synSE2DE2, synDE1SE1, synDE2SE2]:
-        syn.connect(p='eps')
+        connect_random(task_info, syn, paramfffb['eps'])
 
     fffb_synapses = {'synSE1DE1': synSE1DE1, 'synSE2DE2': synSE2DE2,
                      'synDE1SE1': synDE1SE1, 'synDE2SE2': synDE2SE2}
@@ -493,27 +774,130 @@ def mk_poisson_fb(task_info, dend1):
     """
     Feedback synapses from poisson mimicking decision circuit, to sensory plastic subpopulation.
 
-    :return: a poisson group and a synapse object
+    :return: a poisson group and a synapse object, with aggregated_input the group of the common input and None
     """
     # params
     paramfffb = params.get_fffb_params(task_info)
     d = paramfffb['d']
-    num_method = task_info['sim']['num_method']
+    num_method = get_num_method(task_info)
 
     # Poisson group
     N_E = task_info['dec']['N_E']           # number of exc neurons (1600)
     subDE = task_info['dec']['sub']         # stim-selective fraction in decision exc neurons
     N_DX = int(subDE * N_E)                 # number decision mock neurons
+    if task_info['sim'].get('aggregated_input', False):
+        rng = stream(task_info['sim']['seed_con'], 'fb', 'ext_indegree')
+        corr = task_info['sim'].get('ext_corr', None)
+        targets = [(dend1, 'x_ea', rng.binomial(N_DX, paramfffb['eps'], size=len(dend1)), paramfffb['w_fb'], 0.)]
+        extD1 = mk_aggregated_input(targets, task_info['plastic']['dec_winner_rate'],
+                                    paramfffb['eps'] if corr is None else corr, 'DX')
+        return extD1, None
+
     extD1 = PoissonGroup(N_DX, rates=task_info['plastic']['dec_winner_rate'])
 
     # FB synapse
     synDXdend1 = Synapses(extD1, dend1, model='w = w_fb : 1', method=num_method,
                           on_pre='x_ea += w', delay=d, name='synDXdend1', namespace=paramfffb)
-    synDXdend1.connect(p='eps')
+    seed_stream(task_info, 'connectivity', 'fb')
+    connect_random(task_info, synDXdend1, paramfffb['eps'])
 
     return extD1, synDXdend1
 
 
+def connect_random(task_info, syn, p, p_across=None, sub=None):
+    """
+    Random connections of syn with probability p, or with sub, p within and p_across across the sub-populations
+    (i < N_pre*sub and j < N_post*sub) of source and target. With topology_cache the pattern is sampled once per
+    seed_con and loaded from the topology store (sim topology_dir), otherwise brian samples it in every task.
+    """
+    import topology_cache
+    if task_info['sim'].get('topology_cache', False):
+        indptr, indices = topology_cache.get_topology(task_info['sim']['seed_con'], syn.name, len(syn.source),
+                                                      len(syn.target), float(p), task_info['sim']['topology_dir'],
+                                                      p_across=p_across, sub=sub)
+        i, j = topology_cache.csr2ij(indptr, indices)
+        syn.connect(i=i, j=j)
+    elif sub is None:
+        syn.connect(p=p)
+    else:
+        condsame = '(i<N_pre*sub and j<N_post*sub) or (i>=N_pre*sub and j>=N_post*sub)'
+        conddiff = '(i<N_pre*sub and j>=N_post*sub) or (i>=N_pre*sub and j<N_post*sub)'
+        syn.connect(condition=condsame, p=p, namespace={'sub': sub})
+        syn.connect(condition=conddiff, p=p_across, namespace={'sub': sub})
+
+
+def get_trial_seeds(task_info, n_trials):
+    """
+    Seeds of the trials of a multi-trial run, the first one is the task seed so a single trial is unchanged.
+    With keyed streams, a trial gives the same results as a single task with its seed.
+    """
+    if keyed_streams(task_info):
+        return [int(task_info['seed'])] + [stream_seed(task_info['seed'], 'trial', k) for k in range(1, n_trials)]
+    rng = np.random.RandomState(int(task_info['seed']))
+    return [int(task_info['seed'])] + [int(s) for s in rng.randint(2**31 - 1, size=n_trials - 1)]
+
+
+def get_num_method(task_info):
+    """
+    Integration method of the groups. With 'auto' brian takes for each group the first method that can integrate
+    its equations: exact for linear ones, exponential Euler for conditionally linear ones (conductance based
+    membranes and synapses) and Euler for the rest (stochastic and non-linear dendrites).
+    """
+    num_method = task_info['sim']['num_method']
+    return ('exact', 'exponential_euler', 'euler') if num_method == 'auto' else num_method
+
+
+def keyed_streams(task_info):
+    return task_info['sim'].get('keyed_streams', False)
+
+
+def seed_stream(task_info, purpose, population='', trial_seed=None):
+    """
+    With keyed streams, seeds brian's random numbers for what follows (connect, initial conditions or the run) from
+    the stream of (root seed, population, purpose). The root seed is seed_con for connectivity and the task or trial
+    seed otherwise. Without keyed streams the seeds set by the callers are used as before.
+    """
+    if not keyed_streams(task_info):
+        return
+    if purpose == 'connectivity':
+        root_seed = task_info['sim']['seed_con']
+    else:
+        root_seed = task_info['seed'] if trial_seed is None else trial_seed
+    seed(stream_seed(root_seed, population, purpose))
+
+
+def reset_trial(task_info, net, t_trial, trial_seed=None):
+    """
+    Brings the hierarchical net back to its initial state before the next trial of a multi-trial run:
+    all variables with a differential equation are zeroed, refractoriness is cleared and the initial conditions
+    are drawn again (from the seed set before calling this, or from the streams of trial_seed). Spikes still in
+    flight in the synaptic delays (1 ms) reach the next trial, which starts with its settle time.
+
+    :param t_trial: start time of the next trial, times of the online stimulus are relative to it
+    """
+    from brian2 import NeuronGroup, Synapses
+    from brian2.units.fundamentalunits import Quantity
+
+    for obj in net.objects:
+        if isinstance(obj, (NeuronGroup, Synapses)):
+            for name in obj.equations.diff_eq_names:
+                setattr(obj, name, Quantity(0, dim=obj.variables[name].dim))
+            if 'lastspike' in obj.variables:
+                obj.lastspike = -1e4 * second
+                obj.not_refractory = True
+            if 't_spk' in obj.variables:
+                obj.t_spk = -1e4 * second
+                obj.in_burst = 0
+    if task_info['sim']['online_stim']:
+        net['stim_common'].t_trial = t_trial
+        net['stimE'].t_trial = t_trial
+
+    seed_stream(task_info, 'init', 'dec', trial_seed)
+    init_conds_dec({'DE': net['decE'], 'DI': net['decI']})
+    seed_stream(task_info, 'init', 'sen', trial_seed)
+    init_conds_sen({'SE': net['senE'], 'SI': net['senI']}, two_comp=task_info['sim']['2c_model'])
+
+
 def init_conds_dec(dec_groups):
     dec_groups['DE'].V = '-50*mV + 2*mV * rand()'
     dec_groups['DI'].V = '-50*mV + 2*mV * rand()'
@@ -553,8 +937,9 @@ def mk_monitors(task_info, dec_groups, sen_groups, dec_subgroups, sen_subgroups)
     senE1 = sen_subgroups['SE1']
     senE2 = sen_subgroups['SE2']
 
-    # create monitors
-    spksSE = SpikeMonitor(senE)
+    # create monitors, with binned spike recording the spikes of senE are only kept for plotting
+    binned_spikes = task_info['sim'].get('binned_spikes', False)
+    spksSE = SpikeMonitor(senE, record=not binned_spikes or task_info['sim']['plt_fig1'])
     rateDE1 = PopulationRateMonitor(decE1)
     rateDE2 = PopulationRateMonitor(decE2)
     rateSE1 = PopulationRateMonitor(senE1)
@@ -574,19 +959,48 @@ def mk_monitors(task_info, dec_groups, sen_groups, dec_subgroups, sen_subgroups)
 
 
 def mk_monitors_plastic(task_info, sen_groups, sen_subgroups):
-    """Define monitors to track results from plasticity experiment."""
-    from brian2.monitors import SpikeMonitor, StateMonitor, PopulationRateMonitor
+    """Define monitors to track results from plasticity experiment, state variables are in mk_recorders_plastic."""
+    from brian2.monitors import SpikeMonitor, PopulationRateMonitor
 
     # unpack neuron groups
     senE = sen_groups['SE']
     dend1 = sen_subgroups['dend1']
 
     # create monitors
-    stim_dt = task_info['sim']['stim_dt']
     spksSE = SpikeMonitor(senE)
-    dend_mon = StateMonitor(dend1, variables=['muOUd', 'Ibg', 'g_ea', 'B'], record=True, dt=stim_dt)
     spks_dend = SpikeMonitor(dend1)
     pop_dend = PopulationRateMonitor(dend1)
-    online_stim_mon = StateMonitor(senE, variables=['I'], record=True, dt=stim_dt)
 
-    return [spksSE, dend_mon, online_stim_mon, spks_dend, pop_dend]
+    return [spksSE, spks_dend, pop_dend]
+
+
+def get_recording_spec_plastic(task_info, nn2plt=10):
+    """
+    What is recorded of the state of the plasticity experiment (see recording.mk_state_recorder): the mean of every
+    variable, nn2plt neurons for plotting and all neurons of muOUd at the end of the run, sampled at stim_dt or, for
+    the slow currents, at tau_update. The stimulus is only kept as mean per sub-population.
+
+    :return: {recorder name: (sub-group name, spec)}
+    """
+    stim_dt = task_info['sim']['stim_dt']
+    tau_update = task_info['plastic']['tau_update']
+    dend_spec = {'muOUd': {'dt': stim_dt, 'record': nn2plt, 'mean': True, 'tail': True},
+                 'B': {'dt': stim_dt, 'record': nn2plt, 'mean': True},
+                 'Ibg': {'dt': tau_update, 'record': nn2plt, 'mean': True},
+                 'g_ea': {'dt': tau_update, 'record': nn2plt, 'mean': True}}
+    stim_spec = {'I': {'dt': stim_dt, 'mean': True}}
+
+    return {'dend_rec': ('dend1', dend_spec), 'stim1_rec': ('SE1', stim_spec), 'stim2_rec': ('SE2', stim_spec)}
+
+
+def mk_recorders_plastic(task_info, sen_subgroups):
+    """State recorders of the plasticity experiment, retrieve with recording.StateRecording(net, spec, name)."""
+    from recording import mk_state_recorder
+    snapshot_dt = task_info['plastic'].get('rec_snapshot_dt', None)
+
+    objects = []
+    for name, (subgroup, spec) in get_recording_spec_plastic(task_info).items():
+        objects += mk_state_recorder(sen_subgroups[subgroup], spec, name,
+                                     snapshot_dt=snapshot_dt if name == 'dend_rec' else None)
+
+    return objects
@@ -0,0 +1,116 @@
+# Accuracy check of an integration step larger than the reference dt, for runs with num_method 'auto' (exact or
+# exponential integrators where the equations allow them) at a coarser sim_dt.
+#   - the hierarchical net runs once at sim_dt and once at ref_dt with the same seeds and stimulus, the burst
+#     statistics of the sensory exc neurons after the settle time are compared
+#   - a step whose statistics differ by more than dt_tol (relative) from the reference is refused
+#   - the verdict only depends on the configuration, not on the coherence or seed, so it is checked by the first
+#     task of a configuration and cached like the settled states (settle_cache.settle_key across seeds)
+import os
+import json
+import tempfile
+import numpy as np
+
+stat_names = ('rate', 'event_rate', 'burst_rate', 'burst_fraction')
+
+
+def burst_stats(counts, duration):
+    """
+    Population statistics of binned counts (circuits.count_mon2counts).
+
+    :return: {'rate', 'event_rate', 'burst_rate': in Hz, 'burst_fraction': bursts per event}
+    """
+    n_spks, n_events, n_bursts = (counts[name].sum() for name in ('spks', 'events', 'bursts'))
+    nn = counts['spks'].shape[0]
+    return {'rate': n_spks / (nn * duration), 'event_rate': n_events / (nn * duration),
+            'burst_rate': n_bursts / (nn * duration), 'burst_fraction': n_bursts / max(n_events, 1)}
+
+
+def relative_errors(stats, ref_stats):
+    return {name: float(abs(stats[name] - ref_stats[name]) / max(abs(ref_stats[name]), 1e-12))
+            for name in stat_names}
+
+
+def run_burst_stats(task_info, sim_dt, build_dir):
+    """Burst statistics of the hierarchical net of task_info run at sim_dt, without plots or analyses."""
+    import circuits as cir
+    from helper_funcs import unitless
+    from brian2 import set_device, defaultclock, seed, prefs, second
+    from brian2.core.magic import start_scope
+    from brian2.devices.device import reinit_devices
+
+    check_info = {k: dict(v) if isinstance(v, dict) else v for k, v in task_info.items()}
+    check_info['sim'].update({'sim_dt': sim_dt, 'binned_spikes': True, 'plt_fig1': False, 'burst_analysis': False,
+                              'n_trials': 1, 'warm_start': False})
+
+    reinit_devices()
+    set_device('cpp_standalone', directory=build_dir)
+    prefs.core.default_float_dtype = np.float32
+    defaultclock.dt = sim_dt
+    start_scope()
+    seed(check_info['sim']['seed_con'])
+    net, monitors = cir.get_hierarchical_net(check_info)
+    namespace = {}
+    if not check_info['sim']['online_stim']:
+        namespace['Irec'] = cir.mk_sen_stimulus(check_info)
+    cir.seed_stream(check_info, 'run')
+    net.run(check_info['sim']['runtime'], namespace=namespace)
+    counts = cir.count_mon2counts(net['count_mon'], net['senE'])[0]
+    reinit_devices()
+
+    # only after the settle time
+    count_dt = check_info['sim'].get('count_dt', check_info['sim']['stim_dt'])
+    settle_bins = unitless(check_info['sim']['settle_time'], count_dt)
+    counts = {name: c[:, settle_bins:] for name, c in counts.items()}
+    duration = float((check_info['sim']['runtime'] - check_info['sim']['settle_time']) / second)
+
+    return burst_stats(counts, duration)
+
+
+def check_dt(task_info, tempdir, cache_dir):
+    """
+    Refuses a sim_dt above ref_dt that changes the burst statistics by more than dt_tol.
+
+    :return: relative errors of the statistics against the reference dt, None if sim_dt is not above it
+    :raises ValueError: if the step is refused
+    """
+    from settle_cache import settle_key
+    sim_dt, ref_dt = task_info['sim']['sim_dt'], task_info['sim'].get('ref_dt', task_info['sim']['sim_dt'])
+    if sim_dt <= ref_dt:
+        return None
+
+    key = settle_key(task_info, across_seeds=True)
+    path = os.path.join(cache_dir, key + '.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            errors = json.load(f)
+    else:
+        print(f'Checking sim_dt {sim_dt} against the reference {ref_dt}...')
+        ref_stats = run_burst_stats(task_info, ref_dt, os.path.join(tempdir, 'dt_check_ref'))
+        stats = run_burst_stats(task_info, sim_dt, os.path.join(tempdir, 'dt_check'))
+        errors = relative_errors(stats, ref_stats)
+        publish_errors(errors, path)
+
+    print(f'sim_dt {sim_dt} vs {ref_dt}: ' + ', '.join(f'{name} {errors[name]:.1%}' for name in stat_names))
+    tol = task_info['sim'].get('dt_tol', 0.05)
+    failed = [name for name in stat_names if errors[name] > tol]
+    if failed:
+        raise ValueError(f'sim_dt {sim_dt} changes {", ".join(failed)} by more than {tol:.0%} of the values at '
+                         f'{ref_dt}, use a smaller step')
+
+    return errors
+
+
+def publish_errors(errors, path):
+    """Atomically writes the errors of a configuration, a concurrent check of the same one writes the same."""
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, staged = tempfile.mkstemp(prefix='.dt_check', suffix='.json', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(errors, f)
+        os.rename(staged, path)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
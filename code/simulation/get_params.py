@@ -1,8 +1,10 @@
-# all functions return a dictionary of parameters specific to each case.
+# all functions return a dictionary of parameters specific to each case, computed once per content of task_info.
 from brian2.units import Hz, ms, nS, pF, mV, pA, second
 from helper_funcs import adjust_variable
+from param_tree import memoize_params
 
 
+@memoize_params
 def get_dec_params(task_info):
     """Parameters for decision circuit."""
     # local recurrent connections
@@ -53,6 +55,7 @@ def get_dec_params(task_info):
     return paramint
 
 
+@memoize_params
 def get_sen_params(task_info):
     """Parameters for sensory circuit."""
     # local recurrent connections
@@ -102,6 +105,7 @@ def get_sen_params(task_info):
     return paramsen
 
 
+@memoize_params
 def get_2c_params(task_info):
     """Parameters for two compartmental model of excitatory neurons within the sensory circuit."""
     # soma
@@ -156,6 +160,7 @@ def get_2c_params(task_info):
     return paramsen
 
 
+@memoize_params
 def get_stim_params(task_info):
     """Parameters for creating an OU process as stimulus."""
     try:
@@ -185,6 +190,7 @@ def get_stim_params(task_info):
     return paramstim
 
 
+@memoize_params
 def get_fffb_params(task_info):
     """Parameters for creating feedforward and feedback synapses for the hierachical network."""
     eps = 0.2                   # connection probability
@@ -199,6 +205,7 @@ def get_fffb_params(task_info):
     return paramfffb
 
 
+@memoize_params
 def get_plasticity_params(task_info):
     """Parameters for setting inhibitory plasticity rule on dendrites of sensory circuit."""
     from numpy import log as np_log
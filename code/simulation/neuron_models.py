@@ -9,7 +9,6 @@ eqs_wimmer_exc = '''
     dx_i/dt = -x_i / tau_r                  : 1
     tau = CmE/gleakE    : second
     Cm = CmE            : farad
-    I = Irec(t, i)      : amp
 '''
 
 eqs_wimmer_inh = '''
@@ -66,9 +65,58 @@ eqs_stim_online = '''
     z           : 1 (linked)
 '''
 
+# Sensory stimulus generated during the run, z and zk are advanced by run_regularly (exact discrete OU)
+# times are relative to t_trial, the start of the current trial of a multi-trial run
+eqs_stim_gated_common = '''
+    z           : 1
+    zk_mean     : 1
+    t_trial     : second (shared)
+'''
+
+eqs_stim_gated = '''
+    I = int(t - t_trial >= stim_on and t - t_trial < stim_off) * (I0 + I0_wimmer * (c*mu*ramp + z + zk)) : amp
+    ramp = 1 - ramp_on * exp(-clip(t - t_trial - stim_on, 0*second, t) / tau_ramp) : 1
+    zk          : 1
+    mu          : 1 (constant)
+    z           : 1 (linked)
+    t_trial     : second (shared)
+'''
+
 eqs_stim_linked = '''I : amp (linked)'''
 eqs_stim_array = '''I = Irec(t, i)  : amp'''
 
+# Spike counters of sensory exc neurons, advanced in the reset: all spikes, events (first spike after a silence of
+# at least valid_burst) and bursts (tagged at their second spike). Cumulative, binned from a StateMonitor after the run
+eqs_spike_counts = '''
+    n_spk       : integer
+    n_event     : integer
+    n_burst     : integer
+    in_burst    : integer
+    t_spk       : second
+'''
+
+eqs_spike_counts_reset = '''
+    n_spk += 1
+    n_event += int(t - t_spk >= valid_burst)
+    n_burst += int(t - t_spk < valid_burst) * (1 - in_burst)
+    in_burst = int(t - t_spk < valid_burst)
+    t_spk = t
+'''
+
+# Aggregated Poisson input replacing a population of Poisson sources and its synapses (circuits.mk_aggregated_input),
+# formatted with the name of the population: private input events per step, weight of one event (0 for neurons
+# without input) and the input count common to all targets
+eqs_aggregated_input = '''
+    lam_{name}      : 1 (constant)
+    w_{name}        : 1 (constant)
+    n_com_{name}    : 1 (linked)
+'''
+
+aggregated_input_code = '''
+    n_{name} = poisson(lam_{name}) + n_com_{name}
+    {target_var} += w_{name} * clip(n_{name} + {cv} * sqrt(n_{name}) * randn(), 0, inf)
+'''
+
 # Decision neurons
 eqs_wang_exc = '''
     dV/dt = (-g_ea*(V-VrevE) - g_ent*(V-VrevE)/(1+exp(-V/mV*0.062)/3.57) - g_i*(V-VrevI) - (V-Vl)) / tau : volt (unless refractory)
@@ -94,5 +142,14 @@ eqs_wang_inh = '''
 eqs_NMDA = '''
     g_ent_post = w_nmda * g_en_pre      : 1 (summed)
     w_nmda  : 1 (constant)
-    w       : 1 (constant)
+'''
+
+# NMDA gating summed per sub-population, w_nmda only depends on the labels
+eqs_NMDA_pool = '''
+    g_en                : 1
+    label               : integer (constant)
+'''
+
+eqs_NMDA_sum = '''
+    g_en_post = g_en_pre                : 1 (summed)
 '''
@@ -0,0 +1,117 @@
+# Immutable parameter trees with a stable content hash.
+#   - FrozenParams wraps the nested dicts of task_info or of the get_*_params namespaces, values are read-only
+#   - the content hash only depends on the values (with their units), not on dict order or the process, so it can
+#     key caches shared between tasks and workers
+#   - memoize_params caches the get_*_params builders per content of task_info, they are called several times per
+#     task and call each other (get_stim_params -> get_2c_params -> get_sen_params)
+import hashlib
+from functools import lru_cache, wraps
+from collections.abc import Mapping
+import numpy as np
+
+
+def _feed(h, value):
+    """Adds a canonical encoding of value to the hash h."""
+    if isinstance(value, Mapping):
+        h.update(b'{')
+        for k in sorted(value, key=str):
+            _feed(h, k)
+            _feed(h, value[k])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        for v in value:
+            _feed(h, v)
+        h.update(b']')
+    elif isinstance(value, np.ndarray) or hasattr(value, 'dim'):
+        # arrays and brian quantities, with their dimensions
+        array = np.ascontiguousarray(np.asarray(value))
+        h.update(f'a{array.dtype.str}{array.shape}{getattr(value, "dim", "")}'.encode())
+        h.update(array.tobytes())
+    elif isinstance(value, (bool, np.bool_)):
+        h.update(b'b1' if value else b'b0')
+    elif isinstance(value, (int, np.integer)):
+        h.update(f'i{int(value)}'.encode())
+    elif isinstance(value, (float, np.floating)):
+        h.update(f'f{float(value)!r}'.encode())
+    else:
+        h.update(f'{type(value).__name__}{value!r}'.encode())
+
+
+def content_hash(value):
+    """Stable hash of a (nested) parameter dict."""
+    h = hashlib.sha1()
+    _feed(h, value)
+    return h.hexdigest()
+
+
+def _freeze(value):
+    if isinstance(value, FrozenParams):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenParams(value)
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, np.ndarray) and value.ndim > 0:
+        value = value.copy()
+        value.setflags(write=False)
+    return value
+
+
+class FrozenParams(Mapping):
+    """
+    Read-only, hashable view of a nested parameter dict, sub-dicts are FrozenParams too.
+    Two trees are equal when their content hashes are, dict(params) gives a mutable (shallow) copy, e.g. for a
+    brian namespace.
+    """
+    def __init__(self, params):
+        self._params = {k: _freeze(v) for k, v in params.items()}
+        self._hash = None
+
+    def __getitem__(self, key):
+        return self._params[key]
+
+    def __iter__(self):
+        return iter(self._params)
+
+    def __len__(self):
+        return len(self._params)
+
+    @property
+    def content_hash(self):
+        if self._hash is None:
+            self._hash = content_hash(self._params)
+        return self._hash
+
+    def __hash__(self):
+        return hash(self.content_hash)
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenParams):
+            return NotImplemented
+        return self.content_hash == other.content_hash
+
+    def __repr__(self):
+        return f'FrozenParams({self._params!r})'
+
+    def thaw(self):
+        """Mutable deep copy, with nested dicts."""
+        return {k: v.thaw() if isinstance(v, FrozenParams) else v for k, v in self._params.items()}
+
+
+def memoize_params(builder):
+    """
+    Caches a builder of parameters from task_info, e.g. get_sen_params, per content of task_info.
+    The builder sees task_info as FrozenParams, callers get a fresh dict of the cached namespace that they can
+    change or hand to brian.
+    """
+    @lru_cache(maxsize=32)
+    def cached(frozen_task_info):
+        return FrozenParams(builder(frozen_task_info))
+
+    @wraps(builder)
+    def wrapper(task_info):
+        return dict(cached(task_info if isinstance(task_info, FrozenParams) else FrozenParams(task_info)))
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
@@ -0,0 +1,102 @@
+# Bounded recording of state variables, for long (plasticity) runs that have to fit the memory of one task.
+#   - each variable has its own sampling dt and records only a few neurons individually
+#   - population means are pooled during the run by a summed variable, one value per sample instead of one per neuron
+#   - all neurons are only kept for the last tail seconds, like a ring buffer read out at the end of the run, and in
+#     snapshots every snapshot_dt
+# The tail needs the run split in two, so the device has to be set with build_on_run=False (see run_recorded).
+import numpy as np
+from brian2.groups import NeuronGroup
+from brian2.synapses import Synapses
+from brian2.monitors import StateMonitor
+from brian2.units.fundamentalunits import Quantity
+
+
+def mk_state_recorder(group, spec, name, snapshot_dt=None):
+    """
+    Monitors and pooling objects recording the variables of a group according to spec.
+
+    :param spec: {variable: {'dt': sampling dt, 'record': neurons recorded individually, the first n or indices,
+                 'mean': True to record the mean over all neurons, 'tail': True to record all neurons during the
+                 tail of run_recorded}}
+    :param name: prefix of the objects, retrieve the recording with StateRecording(net, spec, name)
+    :param snapshot_dt: interval of snapshots of all variables of spec for all neurons
+    :return: list of brian objects to add to the network
+    """
+    objects = []
+    nn = len(group)
+
+    means = [var for var, s in spec.items() if s.get('mean', False)]
+    if means:
+        # summed variables are dimensionless, values in SI units like the monitors' var_ arrays
+        pool = NeuronGroup(1, model='\n'.join(f'{var}_mean : 1' for var in means), name=f'{name}_pool')
+        objects.append(pool)
+        for var in means:
+            namespace = {'nn_pool': nn, 'unit_pool': Quantity(1, dim=group.variables[var].dim)}
+            syn = Synapses(group, pool, model=f'{var}_mean_post = {var}_pre / (nn_pool * unit_pool) : 1 (summed)',
+                           dt=spec[var]['dt'], namespace=namespace, name=f'{name}_pool_{var}')
+            syn.connect()
+            objects += [syn, StateMonitor(pool, f'{var}_mean', record=0, dt=spec[var]['dt'],
+                                          name=f'{name}_{var}_mean')]
+
+    for var, s in spec.items():
+        record = s.get('record', 0)
+        if isinstance(record, int):
+            record = range(record)
+        if len(record):
+            objects.append(StateMonitor(group, var, record=record, dt=s['dt'], name=f'{name}_{var}'))
+        if s.get('tail', False):
+            # switched on for the last part of the run by run_recorded
+            tail_mon = StateMonitor(group, var, record=True, dt=s['dt'], name=f'{name}_{var}_tail')
+            tail_mon.active = False
+            objects.append(tail_mon)
+
+    if snapshot_dt is not None:
+        objects.append(StateMonitor(group, list(spec), record=True, dt=snapshot_dt, name=f'{name}_snap'))
+
+    return objects
+
+
+def run_recorded(net, duration, tail=None, **kwargs):
+    """Runs the network, with the tail monitors of all state recorders active only during the last tail seconds."""
+    tail_monitors = [obj for obj in net.objects if obj.name.endswith('_tail') and isinstance(obj, StateMonitor)]
+    if tail is None or not tail_monitors or tail >= duration:
+        for mon in tail_monitors:
+            mon.active = True
+        net.run(duration, **kwargs)
+        return
+
+    net.run(duration - tail, **kwargs)
+    for mon in tail_monitors:
+        mon.active = True
+    net.run(tail, **kwargs)
+
+
+class StateRecording(object):
+    """
+    Recording of mk_state_recorder after the run, with unitless arrays in SI units. For each variable var:
+    t_var and var (recorded neurons x time), var_mean (time), t_var_tail and var_tail (all neurons x time)
+    and, with snapshots, t_snap and var_snap (all neurons x snapshots). Missing parts are None.
+    """
+    def __init__(self, net, spec, name):
+        names = [obj.name for obj in net.objects]
+        for var in spec:
+            for part, mon_name in ((var, f'{name}_{var}'), (var + '_tail', f'{name}_{var}_tail')):
+                mon = net[mon_name] if mon_name in names else None
+                setattr(self, part, None if mon is None else np.asarray(getattr(mon, var + '_')))
+                setattr(self, 't_' + part, None if mon is None else np.asarray(mon.t_))
+            mean_name = f'{name}_{var}_mean'
+            setattr(self, var + '_mean', np.asarray(getattr(net[mean_name], var + '_mean'))[0]
+                    if mean_name in names else None)
+            if mean_name in names and getattr(self, 't_' + var) is None:
+                setattr(self, 't_' + var, np.asarray(net[mean_name].t_))
+
+        snap = net[f'{name}_snap'] if f'{name}_snap' in names else None
+        self.t_snap = None if snap is None else np.asarray(snap.t_)
+        for var in spec:
+            setattr(self, var + '_snap', None if snap is None else np.asarray(getattr(snap, var + '_')))
+
+    def tail_mean(self, var, t_from, t_to):
+        """Mean of each neuron over [t_from, t_to) of the tail, times in seconds from the start of the run."""
+        t = getattr(self, 't_' + var + '_tail')
+        keep = np.logical_and(t >= t_from, t < t_to)
+        return getattr(self, var + '_tail')[:, keep].mean(axis=1)
@@ -12,9 +12,14 @@ from helper_funcs import np_array
 config['cluster'] = config.run_on_cluster()
 username = 'paola'
 max_tasks = 200          # 260 cores in the server
-mem_per_task = 20.      # in GB, do a test with 32 GB then find optimal value
+mem_per_task = 20.      # in GB, cluster limit per task, local runs start from it and follow the measured peak
 max_task_time = None    # In HH:MM:SS, important if you want to jump ahead queue. For local run: None
 poll_interval = 2.      # in minutes
+worker_max_tasks = 20   # local run: tasks per worker before it is replaced by a fresh process
+build_cache_dir = os.path.expanduser('~/.cache/brian_standalone')    # compiled projects shared by all tasks
+settle_cache_dir = os.path.expanduser('~/.cache/brian_settle')      # settled states shared by all tasks
+dt_check_dir = os.path.expanduser('~/.cache/brian_dt_check')        # accuracy of sim_dt per configuration
+topology_dir = os.path.expanduser('~/.cache/brian_topology')        # random connectivity per seed_con
 
 
 def run_hierarchical(task_info, taskdir, tempdir):
@@ -24,13 +29,54 @@ def run_hierarchical(task_info, taskdir, tempdir):
 
     # specific imports
     import circuits as cir
+    from build_cache import checkout_build, publish_build
+    from snep.resources import task_threads
+    from recording import run_recorded, StateRecording
+    import settle_cache
+    from dt_check import check_dt
     from burst_analysis import spk_mon2spk_times, spk_times2raster
-    from helper_funcs import plot_fig1, plot_fig2, plot_fig3, plot_plastic_rasters, plot_isis, choice_selection, plot_plastic_check
-    from brian2 import set_device, defaultclock, seed, profiling_summary, prefs
+    from helper_funcs import plot_fig3, plot_plastic_rasters, plot_plastic_check, split_trials, stack_trials, unitless
+    from helper_funcs import pad_settle
+    from brian2 import second, set_device, device, defaultclock, seed, profiling_summary, prefs
     from brian2.core.magic import start_scope
-
-    # setup simulation
-    set_device('cpp_standalone', directory=tempdir)
+    from brian2.devices.device import reinit_devices
+
+    # workers are reused across tasks, start from a clean device
+    reinit_devices()
+    # the connectivity store is found by circuits.connect_random in task_info
+    if task_info['sim'].get('topology_cache', False):
+        task_info['sim']['topology_dir'] = topology_dir
+
+    # several trials can run back-to-back in one standalone binary, built once all runs are defined
+    n_trials = int(task_info['sim'].get('n_trials', 1))
+    multi_trial = n_trials > 1
+    # spikes of the sensory exc neurons counted in bins during the run instead of analysed from a SpikeMonitor
+    binned_spikes = task_info['sim'].get('binned_spikes', False)
+    assert not (multi_trial and task_info['sim']['plasticity']), 'Multi-trial runs need the hierarchical net'
+    # plasticity runs record all neurons only during the last rec_tail seconds, in a second run
+    rec_tail = task_info['plastic'].get('rec_tail', None) if task_info['sim']['plasticity'] else None
+    # single trials of the hierarchical net share their settle phase: the first task of a configuration snapshots
+    # the state at settle_time (a run in three parts), the others start from it
+    settle_time = task_info['sim']['settle_time']
+    warm_start = task_info['sim'].get('warm_start', False) and not multi_trial and not task_info['sim']['plasticity']
+    if warm_start:
+        assert task_info['sim']['stim_on'] >= settle_time, 'The stimulus has to start after the settle phase'
+        settle_key = settle_cache.settle_key(task_info)
+        snapshot = settle_cache.load_snapshot(settle_key, settle_cache_dir)
+    forked = warm_start and snapshot is not None
+
+    # threads planned by snep for this task, large networks get the cores that no other task can use
+    threads = task_threads()
+    prefs.devices.cpp_standalone.openmp_threads = threads if threads > 1 else 0
+
+    # a sim_dt above the reference is refused if it changes the burst statistics of the hierarchical net
+    if not task_info['sim']['plasticity']:
+        check_dt(task_info, tempdir, dt_check_dir)
+
+    # setup simulation, reusing the compiled project of a task with the same network structure
+    build_dir, build_key = checkout_build(task_info, build_cache_dir, tempdir)
+    set_device('cpp_standalone', directory=build_dir, clean=False,
+               build_on_run=not (multi_trial or rec_tail is not None or (warm_start and not forked)))
     prefs.core.default_float_dtype = np.float32
     sim_dt = task_info['sim']['sim_dt']
     runtime = task_info['sim']['runtime']
@@ -44,23 +90,86 @@ def run_hierarchical(task_info, taskdir, tempdir):
     if task_info['sim']['plasticity']:
         # task_info['sim']['smooth_win'] *= 10
         net, monitors = cir.get_plasticity_net(task_info)
+        rec_spec = cir.get_recording_spec_plastic(task_info)
     else:
         net, monitors = cir.get_hierarchical_net(task_info)
-
-    if not task_info['sim']['online_stim']:
-        Irec, stim1, stim2, stim_time, stim_fluc = cir.mk_sen_stimulus(task_info, arrays=True)
+        if forked:
+            settle_cache.restore_snapshot(net, snapshot)
+            if task_info['sim']['online_stim']:
+                # stimulus times are relative to t_trial, the run starts at settle_time
+                net['stim_common'].t_trial = -settle_time
+                net['stimE'].t_trial = -settle_time
+        elif warm_start:
+            net.add(settle_cache.mk_snapshot_monitors(net))
+
+    if multi_trial:
+        trial_seeds = cir.get_trial_seeds(task_info, n_trials)
+        if not task_info['sim']['online_stim']:
+            Irec, stim_trials = cir.mk_sen_stimulus_trials(task_info, trial_seeds)
+    elif not task_info['sim']['online_stim']:
+        Irec, stim1, stim2, stim_time, stim_fluc = cir.mk_sen_stimulus(task_info, arrays=True,
+                                                                       t_start=settle_time if forked else None)
 
     print('Running simulation...')
-    net.run(runtime, report='stdout', profile=True)
+    # with keyed streams the noise of the run (Poisson input, OU noise) has its own stream
+    cir.seed_stream(task_info, 'run')
+    if multi_trial:
+        for k, trial_seed in enumerate(trial_seeds):
+            if k:
+                if not cir.keyed_streams(task_info):
+                    seed(trial_seed)
+                cir.reset_trial(task_info, net, k * runtime, trial_seed)
+                cir.seed_stream(task_info, 'run', trial_seed=trial_seed)
+            net.run(runtime, report='stdout', profile=True)
+        device.build(directory=build_dir, clean=False)
+    elif rec_tail is not None:
+        run_recorded(net, runtime, tail=rec_tail, report='stdout', profile=True)
+        device.build(directory=build_dir, clean=False)
+    elif forked:
+        net.run(runtime - settle_time, report='stdout', profile=True)
+    elif warm_start:
+        settle_cache.run_with_snapshot(net, runtime, settle_time, report='stdout', profile=True)
+        device.build(directory=build_dir, clean=False)
+        settle_cache.publish_snapshot(settle_cache.read_snapshot(net, settle_time), settle_key, settle_cache_dir)
+    else:
+        net.run(runtime, report='stdout', profile=True)
     print(profiling_summary(net=net, show=10))
-
-    if task_info['sim']['online_stim']:
-        # retrieve stim monitor info
-        stim_mon = monitors[2]
-        sub = int(stim_mon.source.__len__() / 2)
-        stim_time = stim_mon.t_
-        stim1 = stim_mon.I[:sub]
-        stim2 = stim_mon.I[sub:]
+    publish_build(build_dir, build_key, build_cache_dir)
+
+    # recordings of a run from the settled state, as if it covered the whole run
+    stim_mon = net['stim_mon'] if task_info['sim']['online_stim'] and not task_info['sim']['plasticity'] else None
+    count_mon = net['count_mon'] if binned_spikes else None
+    if forked:
+        monitors = [pad_settle(mon, settle_time) for mon in monitors]
+        stim_mon = pad_settle(stim_mon, settle_time) if stim_mon is not None else None
+        count_mon = pad_settle(count_mon, settle_time) if count_mon is not None else None
+
+    if multi_trial:
+        # cut the recordings into trials and analyse each like a single run, figures only for the first
+        trial_monitors = list(zip(*[split_trials(mon, n_trials, runtime) for mon in monitors]))
+        if task_info['sim']['online_stim']:
+            stim_trials = [cir.stim_mon2arrays(task_info, trial_stim_mon)
+                           for trial_stim_mon in split_trials(stim_mon, n_trials, runtime)]
+        trial_counts = cir.count_mon2counts(count_mon, net['senE'], n_trials) if binned_spikes \
+            else [None] * n_trials
+        trials = [analyse_trial(task_info, list(trial_monitors[k]), stim_trials[k], taskdir, plots=k == 0,
+                                counts=trial_counts[k]) for k in range(n_trials)]
+        raw_data = stack_trials([trial[0] for trial in trials])
+        raw_data['n_trials'] = np.array([n_trials])
+        sim_state = trials[0][1]
+        computed = stack_trials([trial[2] for trial in trials])
+
+        return {'raw_data': raw_data, 'sim_state': sim_state, 'computed': computed}
+
+    if task_info['sim']['online_stim'] and task_info['sim']['plasticity']:
+        # retrieve stim recording, population means (1 x time)
+        stim_rec1, stim_rec2 = [StateRecording(net, rec_spec[name][1], name) for name in ('stim1_rec', 'stim2_rec')]
+        stim_time = stim_rec1.t_I
+        stim1 = stim_rec1.I_mean[None, :]
+        stim2 = stim_rec2.I_mean[None, :]
+    elif task_info['sim']['online_stim']:
+        # population means of the stimulus generated during the run
+        stim1, stim2, stim_time, stim_fluc = cir.stim_mon2arrays(task_info, stim_mon)
 
     # results
     computed = np.zeros(1, dtype=np.float32)
@@ -68,13 +177,14 @@ def run_hierarchical(task_info, taskdir, tempdir):
 
     if task_info['sim']['plasticity']:
         spksSE = monitors[0]
-        dend_mon = monitors[1]
+        dend_rec = StateRecording(net, rec_spec['dend_rec'][1], 'dend_rec')
         spks_dend = monitors[-2]
         pop_dend = monitors[-1]
-        last_muOUd = np_array(dend_mon.muOUd[:, -int(10e3):-int(5e3)].mean(axis=1))  # last 10:5 sec
+        runtime_ = unitless(runtime, second, as_int=False)
+        last_muOUd = np_array(dend_rec.tail_mean('muOUd', runtime_ - 10, runtime_ - 5))  # last 10:5 sec
         all_spk_times, _ = spk_mon2spk_times(task_info, spksSE)
         events, bursts, singles, spikes = spk_times2raster(task_info, all_spk_times, broad_step=True, rate=True)
-        plot_fig3(task_info, dend_mon, events, bursts, spikes, pop_dend, taskdir)
+        plot_fig3(task_info, dend_rec, events, bursts, spikes, pop_dend, taskdir)
         plot_plastic_rasters(task_info, all_spk_times[3], all_spk_times[1], bursts, taskdir)
         plot_plastic_check(task_info, pop_dend, spks_dend, bursts, all_spk_times[1], taskdir)
 
@@ -83,29 +193,9 @@ def run_hierarchical(task_info, taskdir, tempdir):
                     'spikes': all_spk_times[3]}
 
     else:
-        # choice selection
-        choice_monitors = monitors[1:5]
-        rates_dec, rates_sen, winner_pop = choice_selection(task_info, choice_monitors)
-        raw_data = {'rates_dec': rates_dec, 'rates_sen': rates_sen, 'winner_pop': winner_pop, 'stim_fluc': stim_fluc}
-        stim_diff = stim1.mean(axis=0) - stim2.mean(axis=0)
-        if winner_pop:
-            stim_diff = stim2.mean(axis=0) - stim1.mean(axis=0)
-
-        if task_info['sim']['plt_fig1']:
-            mon2plt = monitors.copy() + [stim1, stim2, stim_time]
-            sim_state = plot_fig1(task_info, mon2plt, taskdir, save_vars=True)
-
-        if task_info['sim']['burst_analysis']:
-            spksSE = monitors[0]
-            all_spk_times, all_isis = spk_mon2spk_times(task_info, spksSE)
-            events, bursts, singles, spikes = spk_times2raster(task_info, all_spk_times, broad_step=True)
-
-            plot_fig2(task_info, events, bursts, spikes, stim_diff, stim_time, rates_dec, winner_pop, taskdir)
-            plot_isis(task_info, *all_isis, task_dir=taskdir)
-
-            computed = {'events': events, 'bursts': bursts, 'singles': singles, 'spikes': spikes,
-                        'isis': all_isis[0], 'ieis': all_isis[1], 'ibis': all_isis[2],
-                        'cvs': all_isis[3], 'spks_per_burst': all_isis[4]}
+        counts = cir.count_mon2counts(count_mon, net['senE'])[0] if binned_spikes else None
+        raw_data, sim_state, computed = analyse_trial(task_info, monitors, (stim1, stim2, stim_time, stim_fluc),
+                                                      taskdir, counts=counts)
 
     results = {
         'raw_data': raw_data,
@@ -115,6 +205,57 @@ def run_hierarchical(task_info, taskdir, tempdir):
     return results
 
 
+def analyse_trial(task_info, monitors, stim, taskdir, plots=True, counts=None):
+    """
+    Choice selection and burst analysis of one trial of the hierarchical net.
+
+    :param monitors: brian monitors, or the SpikeData/RateData of one trial of a multi-trial run
+    :param stim: stim1, stim2, stim_time, stim_fluc
+    :param counts: spike counts binned during the run (circuits.count_mon2counts), replace the SpikeMonitor of senE
+                   in the burst analysis, which then has no ISI statistics
+    :return: raw_data, sim_state, computed
+    """
+    from burst_analysis import spk_mon2spk_times, spk_times2raster, counts2raster
+    from helper_funcs import plot_fig1, plot_fig2, plot_isis, choice_selection
+    stim1, stim2, stim_time, stim_fluc = stim
+    computed = np.zeros(1, dtype=np.float32)
+    sim_state = np.zeros(1, dtype=np.float32)
+
+    # choice selection
+    choice_monitors = monitors[1:5]
+    rates_dec, rates_sen, winner_pop = choice_selection(task_info, choice_monitors)
+    raw_data = {'rates_dec': rates_dec, 'rates_sen': rates_sen, 'winner_pop': winner_pop, 'stim_fluc': stim_fluc}
+    stim_diff = stim1.mean(axis=0) - stim2.mean(axis=0)
+    if winner_pop:
+        stim_diff = stim2.mean(axis=0) - stim1.mean(axis=0)
+
+    if task_info['sim']['plt_fig1'] and plots:
+        mon2plt = monitors.copy() + [stim1, stim2, stim_time]
+        sim_state = plot_fig1(task_info, mon2plt, taskdir, save_vars=True)
+
+    if task_info['sim']['burst_analysis'] and counts is not None:
+        events, bursts, singles, spikes = counts2raster(task_info, counts)
+        if plots:
+            plot_fig2(task_info, events, bursts, spikes, stim_diff, stim_time, rates_dec, winner_pop, taskdir)
+
+        computed = {'events': events, 'bursts': bursts, 'singles': singles, 'spikes': spikes}
+
+    elif task_info['sim']['burst_analysis']:
+        spksSE = monitors[0]
+        all_spk_times, all_isis = spk_mon2spk_times(task_info, spksSE)
+        events, bursts, singles, spikes = spk_times2raster(task_info, all_spk_times, broad_step=True)
+
+        if plots:
+            plot_fig2(task_info, events, bursts, spikes, stim_diff, stim_time, rates_dec, winner_pop, taskdir)
+            plot_isis(task_info, *all_isis, task_dir=taskdir)
+
+        computed = {'events': events, 'bursts': bursts, 'singles': singles, 'spikes': spikes,
+                    'isis': all_isis[0], 'ieis': all_isis[1], 'ibis': all_isis[2],
+                    'cvs': all_isis[3], 'spks_per_burst': all_isis[4]}
+
+    return raw_data, sim_state, computed
+
+
 class JobInfoExperiment(Experiment):
     run_task = staticmethod(run_hierarchical)
 
@@ -161,7 +302,9 @@ class JobInfoExperiment(Experiment):
                 'stim_on': Parameter(1, 'second'),
                 'stim_off': Parameter(3, 'second'),
                 'replicate_stim': False,
-                'num_method': 'euler',
+                'num_method': 'euler',  # 'auto': exact or exponential integrators where possible
+                'ref_dt': Parameter(0.1, 'ms'),     # a larger sim_dt is checked against this one
+                'dt_tol': 0.05,         # relative change of the burst statistics allowed for a larger sim_dt
                 'seed_con': Parameter(184),     # wimmer_good: 184, bad: 195
                 'smooth_win': Parameter(50, 'ms'),
                 'valid_burst': Parameter(16e-3),
@@ -170,6 +313,14 @@ class JobInfoExperiment(Experiment):
                 'burst_analysis': False,
                 'plasticity': False,
                 'online_stim': False,
+                'n_trials': 1,          # trials per task, run back-to-back in one standalone binary
+                'binned_spikes': False,  # count spikes, events and bursts of senE in bins during the run
+                'count_dt': Parameter(1, 'ms'),
+                'warm_start': False,    # share the settle phase between tasks that only differ in the stimulus
+                'settle_across_seeds': False,   # warm_start also across seeds: their trials are correlated
+                'keyed_streams': False,  # random numbers from streams keyed on seed, population and purpose
+                'aggregated_input': False,  # Poisson input summed per neuron, ext_corr (default: eps) correlates it
+                'topology_cache': False,    # random connectivity sampled once per seed_con and shared by all tasks
                 'ramp_stim': True,
                 'flip_stim': False},
 
@@ -178,6 +329,8 @@ class JobInfoExperiment(Experiment):
                 'tau_update': Parameter(10, 'ms'),
                 'eta0': Parameter(1, 'pA'),
                 'min_burst_stop': Parameter(0.1),
+                'rec_tail': Parameter(10, 'second'),           # all neurons of muOUd kept for the last 10 sec
+                'rec_snapshot_dt': Parameter(10, 'second'),    # and in snapshots of all state variables
                 'dec_winner_rate': Parameter(50, 'Hz')}}
 
         param_ranges = {
@@ -207,5 +360,8 @@ if __name__ == '__main__':
     ji_kwargs = dict(root_dir=os.path.expanduser('~/Documents/WS19/MasterThesis/Experiments'))
     job_info = run(JobInfoExperiment, ji_kwargs, username=username, max_tasks=max_tasks, mem_per_task=mem_per_task,
                    max_task_time=max_task_time, poll_interval=poll_interval,
+                   worker_max_tasks=worker_max_tasks, preimport=('numpy', 'scipy', 'tables', 'brian2'),
                    result_dir='Documents/WS19/MasterThesis/Experiments',
-                   additional_files=['circuits.py', 'neuron_models.py', 'get_params.py', 'burst_analysis.py'])
+                   additional_files=['circuits.py', 'neuron_models.py', 'get_params.py', 'burst_analysis.py',
+                                     'build_cache.py', 'recording.py', 'settle_cache.py', 'param_tree.py',
+                                     'streams.py', 'dt_check.py', 'topology_cache.py'])
@@ -0,0 +1,137 @@
+# Shared settle phase of the hierarchical net. The state at settle_time only depends on the network structure,
+# the baseline parameters and the seed, not on the coherence, so it is simulated once per configuration and seed:
+#   - the first task of a configuration snapshots the state of every NeuronGroup at settle_time and publishes it
+#   - later tasks load the snapshot and only simulate the rest of the run, their recordings are padded back to
+#     the full run by helper_funcs.pad_settle
+#   - synapses are fixed by seed_con and have no dynamic state, spikes still in flight in the synaptic delays and
+#     the random number streams are not part of the snapshot: forked tasks continue with their own seed
+#   - with sim settle_across_seeds tasks with different seeds share the settled state too, so their trials are
+#     correlated through it (common random numbers over e.g. a coherence sweep)
+import os
+import tempfile
+import numpy as np
+
+# task_info entries that only act after the settle phase
+stim_keys = ('c',)
+# the seed drives the settle phase too, it is only left out with settle_across_seeds
+seed_keys = ('seed',)
+# cumulative spike counters start again at the fork, their monitor is padded with zeros
+skip_vars = ('n_spk', 'n_event', 'n_burst')
+
+
+def settle_key(task_info, across_seeds=None):
+    """
+    Hash of everything the settle phase depends on: the network structure and all but the stimulus parameters.
+
+    :param across_seeds: leave the seed out of the key, defaults to sim settle_across_seeds
+    """
+    from build_cache import structure_key
+    from param_tree import content_hash
+    if across_seeds is None:
+        across_seeds = task_info['sim'].get('settle_across_seeds', False)
+    skip = stim_keys + seed_keys if across_seeds else stim_keys
+    baseline = {k: v for k, v in task_info.items() if k not in skip}
+
+    return content_hash({'structure': structure_key(task_info), 'baseline': baseline})[:16]
+
+
+def snapshot_vars(group):
+    """Variables that make up the state of a group: everything but constants, shared, linked and summed variables."""
+    from brian2.equations.equations import DIFFERENTIAL_EQUATION, PARAMETER
+    names = []
+    for eq in group.equations.values():
+        if eq.type == DIFFERENTIAL_EQUATION or (eq.type == PARAMETER and
+                                                 not set(eq.flags) & {'constant', 'shared', 'linked', 'summed'}):
+            names.append(eq.varname)
+    for name in ('lastspike', 'not_refractory'):
+        if name in group.variables:
+            names.append(name)
+
+    return [name for name in names if name not in skip_vars]
+
+
+def mk_snapshot_monitors(net):
+    """One inactive StateMonitor per NeuronGroup, switched on for a single step by run_with_snapshot."""
+    from brian2.groups import NeuronGroup
+    from brian2.monitors import StateMonitor
+    monitors = []
+    for obj in list(net.objects):
+        if isinstance(obj, NeuronGroup) and snapshot_vars(obj):
+            mon = StateMonitor(obj, snapshot_vars(obj), record=True, name=f'snapshot_{obj.name}')
+            mon.active = False
+            monitors.append(mon)
+
+    return monitors
+
+
+def run_with_snapshot(net, runtime, settle_time, **kwargs):
+    """Runs the network with the snapshot monitors recording the state at settle_time, the start of its next step."""
+    from brian2 import defaultclock
+    monitors = [obj for obj in net.objects if obj.name.startswith('snapshot_')]
+    net.run(settle_time, **kwargs)
+    for mon in monitors:
+        mon.active = True
+    net.run(defaultclock.dt, **kwargs)
+    for mon in monitors:
+        mon.active = False
+    net.run(runtime - settle_time - defaultclock.dt, **kwargs)
+
+
+def read_snapshot(net, settle_time):
+    """:return: {group/var: values} from the snapshot monitors, times (lastspike, ...) relative to settle_time"""
+    from brian2.units import second
+    snapshot = {}
+    for obj in net.objects:
+        if obj.name.startswith('snapshot_'):
+            group = obj.source
+            for var in obj.record_variables:
+                values = np.asarray(getattr(obj, var + '_'))[:, 0]
+                if group.variables[var].dim == second.dim:
+                    values = values - float(settle_time / second)
+                snapshot[f'{group.name}/{var}'] = values
+
+    return snapshot
+
+
+def restore_snapshot(net, snapshot):
+    """Sets the state of the groups of the network to the snapshot."""
+    from brian2.units.fundamentalunits import Quantity
+    for key, values in snapshot.items():
+        group_name, var = key.split('/')
+        group = net[group_name]
+        if group.variables[var].dtype == bool:
+            setattr(group, var, values.astype(bool))
+        else:
+            setattr(group, var, Quantity(values, dim=group.variables[var].dim))
+
+
+def load_snapshot(key, cache_dir):
+    """:return: the published snapshot of this configuration, or None"""
+    path = os.path.join(cache_dir, key + '.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        snapshot = {k: f[k] for k in f.files}
+    print(f'Starting from the settled state {key}')
+
+    return snapshot
+
+
+def publish_snapshot(snapshot, key, cache_dir):
+    """Atomically add a snapshot to the cache, unless another worker already published one."""
+    path = os.path.join(cache_dir, key + '.npz')
+    if os.path.exists(path):
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, staged = tempfile.mkstemp(prefix='.' + key, suffix='.npz', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **snapshot)
+        os.rename(staged, path)
+        print(f'Published settled state {key}')
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
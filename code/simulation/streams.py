@@ -0,0 +1,24 @@
+# Counter-based random streams: every random quantity of a task is drawn from a Philox stream keyed on what it is
+# for, instead of from wherever the global random state happens to be after the previous draws.
+#   - key parts are the root seed (seed_con for connectivity, the task or trial seed otherwise), the population and
+#     the purpose (connectivity, init, stim, run), e.g. stream(seed, 'sen', 'init')
+#   - the same key gives the same numbers whatever ran before in the process, so tasks can be regrouped over
+#     workers, batched into multi-trial runs or resumed without changing their outputs
+#   - brian has a single random state per run, stream_seed gives the seed of a stream to hand to brian's seed()
+import numpy as np
+from param_tree import content_hash
+
+
+def stream_key(*parts):
+    """128 bit Philox key of the key parts, stable across processes and numpy versions."""
+    return int(content_hash(list(parts))[:32], 16)
+
+
+def stream(*parts):
+    """Numpy Generator of the stream keyed on parts."""
+    return np.random.Generator(np.random.Philox(key=stream_key(*parts)))
+
+
+def stream_seed(*parts):
+    """Seed (31 bit) derived from the stream keyed on parts, for brian's seed() or legacy numpy code."""
+    return int(stream(*parts).integers(2**31 - 1))
@@ -0,0 +1,84 @@
+# Random connectivity sampled once per seed and shared by all tasks, instead of by connect(p=...) in every task.
+#   - a pattern is keyed on seed_con, the name of the synapses, the group sizes and the connection probabilities,
+#     so tasks that only differ in c, bfb or iter load the same one
+#   - patterns are sampled in numpy from a keyed stream (streams.stream) and stored in CSR form: indptr (n_pre + 1)
+#     and the sorted targets of each source as indices
+#   - brian gets the pattern as connect(i=..., j=...), weights and delays are still drawn per task by brian
+#   - the store is the directory task_info['sim']['topology_dir'], set by run_hierarchical like its other caches
+import os
+import tempfile
+import numpy as np
+
+
+def topology_key(seed_con, name, n_pre, n_post, p, p_across=None, sub=None):
+    from param_tree import content_hash
+    return content_hash([seed_con, name, n_pre, n_post, p, p_across, sub])[:16]
+
+
+def sample_csr(n_pre, n_post, p, rng, p_across=None, sub=None, block=256):
+    """
+    Random connections with probability p, or with sub, p within and p_across across the sub-populations
+    (i < n_pre*sub, j < n_post*sub) of source and target. Sampled block by block of sources.
+
+    :return: indptr, indices
+    """
+    j_sub1 = np.arange(n_post) < n_post * sub if sub is not None else None
+    indices, counts = [], []
+    for i0 in range(0, n_pre, block):
+        i = np.arange(i0, min(i0 + block, n_pre))
+        if sub is None:
+            prob = p
+        else:
+            prob = np.where((i[:, None] < n_pre * sub) == j_sub1[None, :], p, p_across)
+        rows, cols = np.nonzero(rng.random((len(i), n_post)) < prob)
+        indices.append(cols.astype(np.int32))
+        counts.append(np.bincount(rows, minlength=len(i)))
+    indptr = np.concatenate(([0], np.cumsum(np.concatenate(counts)))).astype(np.int64)
+
+    return indptr, np.concatenate(indices)
+
+
+def csr2ij(indptr, indices):
+    """Source and target index of every synapse of a CSR pattern."""
+    return np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr)), indices
+
+
+def load_topology(key, cache_dir):
+    """:return: indptr, indices of a stored pattern, or None"""
+    path = os.path.join(cache_dir, key + '.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        return f['indptr'], f['indices']
+
+
+def publish_topology(key, indptr, indices, cache_dir):
+    """Atomically adds a pattern to the store, a concurrent task sampling the same one writes the same."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, staged = tempfile.mkstemp(prefix='.' + key, suffix='.npz', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, indptr=indptr, indices=indices)
+        os.rename(staged, os.path.join(cache_dir, key + '.npz'))
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
+
+
+def get_topology(seed_con, name, n_pre, n_post, p, cache_dir, p_across=None, sub=None):
+    """
+    CSR pattern of the connections named name, loaded from the store in cache_dir or sampled and published.
+
+    :return: indptr, indices
+    """
+    from streams import stream
+    key = topology_key(seed_con, name, n_pre, n_post, p, p_across, sub)
+    topology = load_topology(key, cache_dir)
+    if topology is None:
+        rng = stream(seed_con, name, 'connectivity')
+        topology = sample_csr(n_pre, n_post, p, rng, p_across=p_across, sub=sub)
+        publish_topology(key, *topology, cache_dir)
+
+    return topology
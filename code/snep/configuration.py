@@ -77,11 +77,12 @@ class Config(object):
         else:
             self._config[key] = value
 
-    def prompt_procs(self):
+    def prompt_procs(self, default=None):
         import six
-        default = 1
-        if not self._config['cluster']:
-            default = mp.cpu_count()
+        if default is None:
+            default = 1
+            if not self._config['cluster']:
+                default = mp.cpu_count()
         prompt = 'Enter number of worker processes ({0}): '.format(default)
         inp = 0
         while inp < 1:
@@ -73,6 +73,7 @@ def make(params, taskdir):
     '''
     from brian2 import defaultclock, prefs, set_device, device
     from brian2.devices.device import CurrentDeviceProxy
+    from snep.resources import task_threads
 
     target = params['target']
     if target == 'standalone':
@@ -85,7 +86,10 @@ def make(params, taskdir):
     if target == 'standalone':
         insert_code = CurrentDeviceProxy.__getattr__(device, 'insert_code')
         insert_code('main', 'srand('+str(int(params['seed']))+');')
-        #prefs.devices.cpp_standalone.openmp_threads = 4
+        # threads planned for this task by snep.resources
+        threads = task_threads()
+        if threads > 1:
+            prefs.devices.cpp_standalone.openmp_threads = threads
         #os.environ['MKL_DYNAMIC'] = 'true'
         #os.environ['OMP_NESTED'] = 'true'
 
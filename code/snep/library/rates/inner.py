@@ -4,6 +4,7 @@ from scipy.sparse.sparsetools import csr_matvec
 from scipy.sparse import csr_matrix
 import numexpr as ne
 import numpy as np
+import os
 # from collections import namedtuple
 from typing import NamedTuple, List, Tuple, Dict, Union
 dtype = np.float32
@@ -256,6 +257,79 @@ def inner_rk(run_time, state, f_max, dt, rko):
     return results
 
 
+# compiled libraries of _prepare_inner_c, shared by all processes of this user on a node
+kernel_cache_dir = os.path.expanduser(os.environ.get('SNEP_KERNEL_CACHE', '~/.cache/snep_rates'))
+
+
+def _cpu_signature() -> str:
+    """
+    Identifies the instruction set gcc targets with -march=native, so a cache in a shared home directory
+    never hands a library built on one kind of node to another.
+    """
+    import platform
+    model, flags = '', ''
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name') and not model:
+                    model = line.split(':', 1)[1].strip()
+                elif line.startswith('flags') and not flags:
+                    flags = line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return ' '.join((platform.machine(), model, flags))
+
+
+_gcc_version = None
+
+
+def _kernel_key(h_file_contents: str, c_file_contents: str, cmd: str) -> str:
+    import hashlib
+    import subprocess as sp
+    global _gcc_version
+    if _gcc_version is None:
+        _gcc_version = sp.run('gcc --version', stdout=sp.PIPE, stderr=sp.PIPE, shell=True).stdout.decode()
+    content = '\n'.join((h_file_contents, c_file_contents, cmd, _gcc_version, _cpu_signature()))
+    return hashlib.sha1(content.encode()).hexdigest()[:20]
+
+
+def _kernel_complete(cached_files: List[str]) -> bool:
+    """Entries are published complete by one rename, anything else is left over from an interrupted build."""
+    return all(os.path.exists(fp) for fp in cached_files)
+
+
+class _kernel_cache_lock(object):
+    """
+    Exclusive lock on one cache entry, so concurrent workers on a node compile each library only once
+    and never load a half written one. The lock file is removed by its holder, a process that waited on
+    the removed file takes the lock again on a new one.
+    """
+    def __init__(self, cache_dir: str, key: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock_path = os.path.join(cache_dir, key + '.lock')
+
+    def __enter__(self):
+        import fcntl
+        while True:
+            self.f = open(self.lock_path, 'a')
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.lock_path).st_ino == os.fstat(self.f.fileno()).st_ino:
+                    return self
+            except FileNotFoundError:
+                pass
+            self.f.close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        import fcntl
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
 c_library = NamedTuple('c_library', [('h_file_path', str), ('so_file_path', str),
                                      ('p_types_names', List[Tuple[str, str]]), ('h_c_source', str)])
 def _prepare_inner_c(n_e: int, n_i: int, e2i_nnz: int, i2e_nnz: int, a2i_nnz: int,
@@ -267,6 +341,8 @@ def _prepare_inner_c(n_e: int, n_i: int, e2i_nnz: int, i2e_nnz: int, a2i_nnz: in
                      build_path: str, do_print_arrays: bool, rec_all_plastic: bool, do_mmap: bool) -> c_library:
     import subprocess as sp
     import os
+    import shutil
+    import tempfile
     # from distutils.core import setup
     # from distutils.extension import Extension
     # from Cython.Distutils import build_ext
@@ -435,33 +511,73 @@ typedef unsigned int MKL_UINT;
     h_file_contents += function_definitions.main_declaration+';'
     c_file_contents += function_definitions.main_definition
 
-    with open(c_file_path, mode='w') as f:
-        f.write(c_file_contents)
-    with open(h_file_path, mode='w') as f:
-        f.write(h_file_contents)
-
-    # ld_library_path = os.path.expanduser('~/anaconda/lib:{}:'.format(build_path))
-    # os.environ["LD_LIBRARY_PATH"] = ld_library_path
-    cmd = 'gcc -march=native -std=c99 -msse4 -mavx -O3 -fPIC -m64 ' \
-          f'-Wdouble-promotion -Wshadow -Wall -Wextra -Wl,--no-as-needed "{c_file_path}"'
-
-    # -fopt-info-all : outputs optimization information
-    #  -Wrestrict : warns when aliased parameters passed to restrict arguments (GCC 7)
-    extra_incs = [' -I' + os.path.expanduser(s) for s in ["~/intel/mkl/include"]]
-    cmd += ' '.join(extra_incs)
-    user_path = os.path.expanduser('~')
-    ll_dirs = [f' -L{user_path}/{s}' for s in ['intel/mkl/lib/intel64', 'intel/lib/intel64']]  # [' -L{0}/anaconda/lib'.format(os.path.expanduser('~'))]
-    cmd += ' '.join(ll_dirs)
-    ll_files = [' -l'+l for l in ['mkl_intel_lp64', 'mkl_core', 'iomp5']]  # 'mkl_gf_lp64', 'mkl_gnu_thread',
-    cmd += ' '.join(ll_files)
-    if do_pyx:
-        cmd += ' -c'
+    def compile_cmd(c_path, so_path):
+        # ld_library_path = os.path.expanduser('~/anaconda/lib:{}:'.format(build_path))
+        # os.environ["LD_LIBRARY_PATH"] = ld_library_path
+        cmd = 'gcc -march=native -std=c99 -msse4 -mavx -O3 -fPIC -m64 ' \
+              f'-Wdouble-promotion -Wshadow -Wall -Wextra -Wl,--no-as-needed "{c_path}"'
+
+        # -fopt-info-all : outputs optimization information
+        #  -Wrestrict : warns when aliased parameters passed to restrict arguments (GCC 7)
+        extra_incs = [' -I' + os.path.expanduser(s) for s in ["~/intel/mkl/include"]]
+        cmd += ' '.join(extra_incs)
+        user_path = os.path.expanduser('~')
+        ll_dirs = [f' -L{user_path}/{s}' for s in ['intel/mkl/lib/intel64', 'intel/lib/intel64']]  # [' -L{0}/anaconda/lib'.format(os.path.expanduser('~'))]
+        cmd += ' '.join(ll_dirs)
+        ll_files = [' -l'+l for l in ['mkl_intel_lp64', 'mkl_core', 'iomp5']]  # 'mkl_gf_lp64', 'mkl_gnu_thread',
+        cmd += ' '.join(ll_files)
+        if do_pyx:
+            cmd += ' -c'
+        else:
+            cmd += ' -shared'
+        cmd += f'  -o "{so_path}"'
+        return cmd
+
+    # The library only depends on the generated source, the compiler command and the cpu (-march=native),
+    # so it is shared through a content addressed cache instead of being rebuilt on every call.
+    key = _kernel_key(h_file_contents, c_file_contents, compile_cmd('{c}', '{so}'))
+    cached_dir = os.path.join(kernel_cache_dir, key)
+    cached = [os.path.join(cached_dir, os.path.basename(fp)) for fp in (c_file_path, h_file_path, so_file_path)]
+    if _kernel_complete(cached):
+        print(f'Using cached {sp_type} {sp_trans} iSP:{i2e_plastic} from {cached_dir}')
     else:
-        cmd += ' -shared'
-    cmd += f'  -o "{so_file_path}"'
-    print(f'COMPILING {sp_type} {sp_trans} iSP:{i2e_plastic}')
-    print(cmd)
-    sp.run(cmd, check=True, shell=True)
+        with _kernel_cache_lock(kernel_cache_dir, key):
+            if _kernel_complete(cached):
+                print(f'Using cached {sp_type} {sp_trans} iSP:{i2e_plastic} from {cached_dir}')
+            else:
+                # build in a private staging dir, then publish the complete directory with one rename
+                staging = tempfile.mkdtemp(prefix=f'.{key}', dir=kernel_cache_dir)
+                try:
+                    staged = [os.path.join(staging, os.path.basename(fp)) for fp in cached]
+                    with open(staged[0], mode='w') as f:
+                        f.write(c_file_contents)
+                    with open(staged[1], mode='w') as f:
+                        f.write(h_file_contents)
+                    cmd = compile_cmd(staged[0], staged[2])
+                    print(f'COMPILING {sp_type} {sp_trans} iSP:{i2e_plastic}')
+                    print(cmd)
+                    sp.run(cmd, check=True, shell=True)
+                    if os.path.exists(cached_dir):
+                        # incomplete entry of an interrupted build, moved aside in one rename and removed
+                        stale = tempfile.mkdtemp(prefix=f'.{key}', dir=kernel_cache_dir)
+                        os.rename(cached_dir, os.path.join(stale, key))
+                        shutil.rmtree(stale, ignore_errors=True)
+                    os.rename(staging, cached_dir)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+
+    # build_path gets a copy of the library, each file replaced in one rename so that a process which
+    # loaded the previous one keeps a valid file
+    os.makedirs(build_path, exist_ok=True)
+    for cached_fp, fp in zip(cached, (c_file_path, h_file_path, so_file_path)):
+        fd, copy = tempfile.mkstemp(prefix='.' + os.path.basename(fp), dir=build_path)
+        os.close(fd)
+        try:
+            shutil.copyfile(cached_fp, copy)
+            os.replace(copy, fp)
+        finally:
+            if os.path.exists(copy):
+                os.remove(copy)
 
     # if do_pyx:
     #     pyx_file = os.path.join(build_path, "inner_c.pyx")
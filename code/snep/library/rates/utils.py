@@ -14,13 +14,17 @@ connection_sparse = namedtuple('connection_sparse', ['csr_indices', 'row_ind', '
 connection_dense = namedtuple('connection_dense', ['array', 'row_ind', 'col_ind', 'conn_prob'])
 
 def compute_connections(sparse, scale, p, f_global, d_pre, N_pre, d_post, N_post, J, zero_diagonal,
-                        scalar_data, j_scale=None, j_var=0., in_degree_cv=-1.):
+                        scalar_data, j_scale=None, j_var=0., in_degree_cv=-1., fixed_out=False):
+    """
+    :param fixed_out: with in_degree_cv == 0 also fix the out-degree, the connections are then sampled directly
+        into CSR by vm_fixed_in_out_csr and conn_prob is None
+    """
     if sparse:
         return _compute_connections_sparse(scale, p, f_global, d_pre, N_pre, d_post, N_post, J, zero_diagonal,
-                                           scalar_data, j_scale, j_var, in_degree_cv)
+                                           scalar_data, j_scale, j_var, in_degree_cv, fixed_out)
     else:
         return _compute_connections_dense(scale, p, f_global, d_pre, N_pre, d_post, N_post, J, zero_diagonal,
-                                          j_scale, j_var, in_degree_cv)
+                                          j_scale, j_var, in_degree_cv, fixed_out)
 
 
 def convert_int16(x):
@@ -44,11 +48,16 @@ def convert_int16(x):
 
 # @jit(nopython=True, cache=cache)
 def _compute_connections_sparse(scale, p, f_global, d_pre, N_pre, d_post, N_post, J, zero_diagonal,
-                                scalar_data, J_scale, J_var, in_degree_cv):
+                                scalar_data, J_scale, J_var, in_degree_cv, fixed_out):
     """
     where ``data``, ``row_ind`` and ``col_ind`` satisfy the
             relationship ``a[row_ind[k], col_ind[k]] = data[k]``.
     """
+    if scalar_data:
+        raise NotImplementedError('Sparse connections with a single weight J (scalar_data) are not implemented')
+    if use_fixed_in_out(fixed_out, p, N_pre, N_post, zero_diagonal, in_degree_cv):
+        return _compute_connections_sparse_fixed(scale, p, f_global, N_pre, N_post, J, zero_diagonal,
+                                                 J_scale, J_var)
     conns, coo, cp = compute_connections_base(scale, p, f_global, d_pre, N_pre, d_post, N_post, J,
                                               zero_diagonal, J_scale, J_var, in_degree_cv)
 
@@ -60,15 +69,70 @@ def _compute_connections_sparse(scale, p, f_global, d_pre, N_pre, d_post, N_post
     indices = reallocate_aligned(csr.indices)
     data = reallocate_aligned(csr.data)
 
-    if scalar_data:
-        data = J
-        assert False
     # return (indptr, indices, data), row_ind, col_ind
     return connection_sparse(csr_indices(indptr, indices, data), row_ind, col_ind, cp)
 
 
+def _compute_connections_sparse_fixed(scale, p, f_global, N_pre, N_post, J, zero_diagonal, J_scale, J_var):
+    """
+    Fixed in-degree connections sampled directly into CSR by vm_fixed_in_out_csr, which also fixes the
+    out-degree. Same weights as compute_connections_base, no (N_post, N_pre) array is built, so conn_prob is None.
+    """
+    from scipy.sparse import csr_matrix
+    # drawn from the global random state, so seeding numpy still gives the same network
+    seed = np.random.randint(np.iinfo(np.int32).max)
+    indptr, indices = vm_fixed_in_out_csr(p, N_post, 0 if zero_diagonal else N_pre, scale, f_global, seed)
+    csr = csr_matrix((np.ones(indices.size, dtype=dtype), indices, indptr), shape=(N_post, N_pre))
+
+    j_rescale = scale_j(csr, p, N_pre, J, J_scale, 0)
+    csr.data *= j_rescale
+    if J_var > 0.:
+        csr.data[:] = np.random.normal(loc=j_rescale, scale=np.abs(j_rescale*J_var), size=csr.data.size)
+        print('After randomization')
+        report_connection(csr, p, N_pre, 0)
+
+    row_ind = reallocate_aligned(np.repeat(np.arange(N_post, dtype=indices.dtype), np.diff(indptr)))
+    col_ind = reallocate_aligned(indices)
+    data = reallocate_aligned(csr.data)
+    indptr = reallocate_aligned(indptr)
+    indices = reallocate_aligned(indices)
+
+    return connection_sparse(csr_indices(indptr, indices, data), row_ind, col_ind, None)
+
+
+def fixed_in_out_possible(p, N_pre, N_post, zero_diagonal, in_degree_cv):
+    """
+    Whether a fixed in-degree network can be sampled by vm_fixed_in_out_csr: recurrent without autapses or
+    between distinct populations, with a number of connections that all pre-synaptic cells can share equally.
+    """
+    if in_degree_cv != 0. or (zero_diagonal and N_pre != N_post):
+        return False
+    k_in = int(np.round(p * (N_pre - 1 if zero_diagonal else N_pre)))
+    return k_in > 0 and (N_post * k_in) % N_pre == 0
+
+
+def use_fixed_in_out(fixed_out, p, N_pre, N_post, zero_diagonal, in_degree_cv):
+    """
+    Whether the fixed out-degree asked for by fixed_out can be sampled, prints the sampler used.
+    """
+    if not fixed_out:
+        return False
+    if fixed_in_out_possible(p, N_pre, N_post, zero_diagonal, in_degree_cv):
+        print('Fixed in- and out-degree, sampled by vm_fixed_in_out_csr')
+        return True
+    print('Fixed out-degree not possible for {}x{} with p={} and in-degree CV {}, using the fixed in-degree only'
+          .format(N_post, N_pre, p, in_degree_cv))
+    return False
+
+
 def _compute_connections_dense(scale, p, f_global, d_pre, N_pre, d_post, N_post, J, zero_diagonal,
-                               J_scale, J_var, in_degree_cv):
+                               J_scale, J_var, in_degree_cv, fixed_out):
+    if use_fixed_in_out(fixed_out, p, N_pre, N_post, zero_diagonal, in_degree_cv):
+        c = _compute_connections_sparse_fixed(scale, p, f_global, N_pre, N_post, J, zero_diagonal,
+                                              J_scale, J_var)
+        conns = np.zeros((N_post, N_pre), dtype=dtype)
+        conns[c.row_ind, c.col_ind] = c.csr_indices.data
+        return connection_dense(reallocate_aligned(conns), c.row_ind, c.col_ind, None)
     conns, coo, cp = compute_connections_base(scale, p, f_global, d_pre, N_pre, d_post, N_post, J,
                                               zero_diagonal, J_scale, J_var, in_degree_cv)
     conns = reallocate_aligned(conns)
@@ -366,6 +430,94 @@ def boolean_fixed_in_out(p: dtype, n: int, m: int=0, swap_factor: int=8, max_dis
     return c
 
 
+def vm_fixed_in_out_csr(p: dtype, n: int, m: int=0, scale: float=np.infty, f_global: float=0.,
+                        seed: int=None, max_rounds: int=100):
+    """
+    Samples a connection matrix with fixed in- and out-degree and von Mises distance dependence on a ring
+    directly in CSR form, as a spatial configuration model:
+        - every post-synaptic cell gets k_in stubs, every pre-synaptic cell k_out stubs,
+        - each post stub draws the position of its partner from a von Mises centred on the cell (or
+          uniformly for a fraction f_global), pre stubs sit at their cell's position,
+        - stubs are matched by rank of position, which preserves both degree sequences exactly,
+        - duplicate connections and autapses are removed by swapping the pre-synaptic cell with a
+          connection close in rank, which again preserves all degrees.
+    :param p: Connection probability.
+    :param n: Size of post-synaptic population.
+    :param m: Size of pre-synaptic population. If `m==0` then connection is recurrent without autapses.
+    :param scale: Width of the von Mises as in compute_connections_base, np.infty for no distance dependence.
+    :param f_global: Fraction of connections made without distance dependence.
+    :param seed: Seed of the random state, same seed gives the same network.
+    :param max_rounds: Number of rounds of swaps to remove duplicates and autapses.
+    :return: indptr, indices of the (n,m) CSR matrix, indices sorted within each row.
+    """
+    rng = np.random.RandomState(seed)
+    recurrent = m == 0
+    if recurrent:
+        m = n
+    k_in = int(np.round(p * (m - 1 if recurrent else m)))
+    nnz = n * k_in
+    assert nnz % m == 0, f'{n}x{m} matrix cannot have fixed in- and out-degree when p={p}'
+    k_out = nnz // m
+    idx_dtype = np.int32 if max(n, m) < np.iinfo(np.int32).max else np.int64
+
+    # position of the pre-synaptic partner of every post stub
+    d_min, d_max = -np.pi, np.pi
+    post = np.repeat(np.arange(n, dtype=idx_dtype), k_in)
+    theta = post * (2 * np.pi / n) + d_min
+    if scale == np.infty:
+        theta = rng.uniform(d_min, d_max, nnz)
+    else:
+        theta += rng.vonmises(0., 1. / (np.pi * scale) ** 2, nnz)
+        is_global = rng.uniform(size=nnz) < f_global
+        theta[is_global] = rng.uniform(d_min, d_max, is_global.sum())
+    # pre stubs sorted by position are simply the stubs in order of their cell, so matching by rank
+    # only needs the post stubs sorted by the position of their partner
+    post = post[np.argsort(np.mod(theta - d_min, 2 * np.pi))]
+    pre = np.repeat(np.arange(m, dtype=idx_dtype), k_out)
+    del theta
+
+    def bad_connections(rows=None):
+        # duplicates can only appear in the rows whose connections were changed
+        candidates = np.arange(nnz) if rows is None else np.nonzero(np.isin(post, rows))[0]
+        key = post[candidates].astype(np.int64) * m + pre[candidates]
+        order = np.argsort(key)
+        dup = np.zeros(candidates.size, dtype=np.bool_)
+        dup[order[1:]] = key[order[1:]] == key[order[:-1]]
+        if recurrent:
+            dup |= post[candidates] == pre[candidates]
+        return candidates[dup]
+
+    bad = bad_connections()
+    window = max(1, k_out)
+    for n_round in range(max_rounds):
+        if not bad.size:
+            break
+        # swap pre-synaptic cells of each bad connection with a random connection nearby in rank
+        partner = np.mod(bad + rng.randint(-window, window + 1, bad.size), nnz)
+        ok = (partner != bad) & ~np.isin(partner, bad)
+        if recurrent:
+            ok &= (post[bad] != pre[partner]) & (post[partner] != pre[bad])
+        a, b = bad[ok], partner[ok]
+        # each connection takes part in at most one swap per round
+        _, first = np.unique(np.concatenate((a, b)), return_index=True)
+        once = np.zeros(2 * a.size, dtype=np.bool_)
+        once[first] = True
+        once = once[:a.size] & once[a.size:]
+        a, b = a[once], b[once]
+        pre[a], pre[b] = pre[b], pre[a].copy()
+        bad = bad_connections(np.unique(np.concatenate((post[bad], post[b]))))
+        window = min(2 * window, nnz)
+    assert not bad.size, f'{bad.size} duplicate connections or autapses left after {max_rounds} rounds'
+
+    key = np.sort(post.astype(np.int64) * m + pre)
+    del post, pre
+    indices = (key % m).astype(idx_dtype)
+    indptr = np.zeros(n + 1, dtype=idx_dtype)
+    indptr[1:] = np.cumsum(np.bincount(key // m, minlength=n))
+    print(f'n={n}, m={m}, p={p:.3f}, k_in={k_in}, k_out={k_out}, resolved duplicates in {n_round} rounds')
+    return indptr, indices
+
+
 def plot_connection(scale, p, f_global, d_pre, N_pre, d_post, N_post, zero_diagonal, conns):
     from matplotlib import cm
     from matplotlib.pyplot import GridSpec
@@ -8,6 +8,7 @@ import snep.configuration
 import subprocess as sp
 import multiprocessing as mp
 from snep.tables.data import open_data_file
+from snep.resources import ResourcePlan, TaskPeakMemory
 
 if hasattr(sp, 'run'): #
     def run_local(c, print_cmd=True, print_out=True):
@@ -45,7 +46,8 @@ else:
 
 
 def run(JobInfo, ji_kwargs, resume=False, result_dir='experiments', delete_tmp=True, additional_files=None,
-        max_tasks=None, max_task_time=None, mem_per_task=2, poll_interval=1., username=None, conda_env=None):
+        max_tasks=None, max_task_time=None, mem_per_task=2, poll_interval=1., username=None, conda_env=None,
+        worker_max_tasks=None, worker_max_mem=None, preimport=('numpy', 'scipy', 'tables')):
     """
     There are many conditions we could be running under:
     1) User wants to run locally on their own machine.
@@ -68,6 +70,11 @@ def run(JobInfo, ji_kwargs, resume=False, result_dir='experiments', delete_tmp=T
     :param mem_per_task:
     :param poll_interval:
     :param username:
+    :param worker_max_tasks: local runs only, number of tasks after which a worker process is replaced
+                            (None never, 1 gives a fresh interpreter for every task)
+    :param worker_max_mem: local runs only, resident memory in GB above which a worker is replaced
+                            after finishing a task, defaults to mem_per_task
+    :param preimport: modules imported once by every local worker before it receives tasks
     :return:
     """
     on_cluster = snep.configuration.on_cluster
@@ -240,15 +247,21 @@ def run(JobInfo, ji_kwargs, resume=False, result_dir='experiments', delete_tmp=T
                     kwargs.update(p.load())
                 all_tasks.append((_run_single_task, kwargs, max_task_time))
 
-            num_proc = config.prompt_procs()
+            # concurrent tasks and threads per task from memory and cores, the number entered is an upper limit
+            plan = ResourcePlan(mem_per_task, len(all_tasks))
+            plan.max_procs = config.prompt_procs(default=plan.planned_procs)
+            print(f'Planned {plan}')
             # case without multi process, to run the debugger
             # for n, (rst, kwargs, max_task_time) in enumerate(all_tasks):
             #     task_id, run_time, peak_memory = rst(**kwargs)
-            pool = mp.Pool(processes=num_proc, maxtasksperchild=1)
-            for n, (task_id, run_time, peak_memory) in enumerate(pool.imap_unordered(_run_with_timeout, all_tasks), 1):
+            # persistent workers, recycled after worker_max_tasks or once they grow past worker_max_mem
+            if worker_max_mem is None:
+                worker_max_mem = mem_per_task
+            warm_tasks = _warm_imap_unordered(all_tasks, plan, worker_max_tasks, worker_max_mem, preimport)
+            for n, (task_id, run_time, peak_memory) in enumerate(warm_tasks, 1):
                 task_name = job_info.task_name(task_id)
                 print(160*'=', f'\nFinished task {n} of {len(task_ids)} {task_name}')
-                print(f'Used {peak_memory} of {mem_per_task} GB ({peak_memory/mem_per_task})')
+                print(f'Used {peak_memory} of {mem_per_task} GB ({peak_memory/mem_per_task}), now {plan}')
                 print(160*'=')
             finish = time.time()
             print(f'Total job ran in {(finish - start)/60.:.1f} minutes')
@@ -272,7 +285,7 @@ def run(JobInfo, ji_kwargs, resume=False, result_dir='experiments', delete_tmp=T
             p = pickle.Unpickler(f)
             kwargs = p.load()
             print(f"Results saved in {kwargs['sys_params']['result_file_path']}")
-            task_id, run_time, peak_memory = _run_with_timeout((_run_single_task, kwargs, timeout))
+            task_id, run_time, peak_memory, timedout = _run_with_timeout((_run_single_task, kwargs, timeout))
 
     if manage_temp and delete_tmp:
         # delete main temp-dir
@@ -372,13 +385,15 @@ class SimulationResult(object):
 def _run_with_timeout(args):
     import traceback
     import threading
-    import resource
     from snep.tables.data import open_data_file
     target, kwargs, timeout = args
     task_id = kwargs['task_id']
     # result_q = kwargs['result_q']
     time_start = time.time()
     result = None
+    timedout = False
+    # peak memory of this task only, including the standalone simulations that run as child processes
+    peak = TaskPeakMemory().start()
     try:
         if timeout:
             t = threading.Thread(target=target, kwargs=kwargs)
@@ -419,9 +434,145 @@ def _run_with_timeout(args):
         #     p = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
         #     p.dump(result)
 
-    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 10**6
+    peak_memory = peak.stop()
     run_time = time.time()-time_start
-    return task_id, run_time, peak_memory
+    return task_id, run_time, peak_memory, timedout
+
+
+def _resident_memory():
+    """
+    Current resident memory of this process in GB (ru_maxrss only gives the peak of its lifetime).
+    """
+    import resource
+    try:
+        with open('/proc/self/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * resource.getpagesize() / 10**9
+    except (IOError, OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 10**6
+
+
+def _warm_worker(conn, preimport, max_tasks, max_mem):
+    """
+    Body of a persistent local worker. Imports the heavy modules once, then runs the tasks it receives
+    through _run_with_timeout until told to stop (None) or until it should be recycled.
+    """
+    import importlib
+    for name in preimport:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f'Could not preimport {name}: {e}')
+
+    n_done = 0
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        task_id, run_time, peak_memory, timedout = _run_with_timeout(args)
+        n_done += 1
+        # a timed out task leaves its thread running, this interpreter cannot be reused
+        recycle = timedout or (max_tasks is not None and n_done >= max_tasks) or \
+                  (max_mem is not None and _resident_memory() > max_mem)
+        conn.send(((task_id, run_time, peak_memory), recycle))
+        if recycle:
+            break
+    conn.close()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # skip joining the threads of timed out tasks on exit
+    os._exit(0)
+
+
+def _warm_imap_unordered(all_tasks, plan, max_tasks, max_mem, preimport):
+    """
+    Runs the (target, kwargs, timeout) tuples on persistent worker processes and yields task_id, run_time and
+    peak_memory of each task as it finishes, like Pool.imap_unordered.
+    Each worker gets one task at a time, so a worker that dies (segfault, OOM killer) only takes its own
+    task with it: an error result is written for that task and a new worker replaces it.
+    The number of workers and the threads of each task follow the ResourcePlan, which is updated with the
+    peak memory of every finished task.
+    """
+    from multiprocessing.connection import wait
+    pending = list(reversed(all_tasks))
+    workers = {}  # connection -> [process, args of the running task]
+
+    def spawn():
+        parent_conn, child_conn = mp.Pipe()
+        p = mp.Process(target=_warm_worker, args=(child_conn, preimport, max_tasks, max_mem))
+        p.daemon = True
+        p.start()
+        child_conn.close()
+        workers[parent_conn] = [p, None]
+        return parent_conn
+
+    def dispatch(conn):
+        if pending:
+            args = pending.pop()
+            args[1]['sys_params']['threads'] = plan.threads
+            workers[conn][1] = args
+            conn.send(args)
+        else:
+            retire(conn, stop=True)
+
+    def retire(conn, stop=False):
+        p, _ = workers.pop(conn)
+        if stop:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+        conn.close()
+        p.join()
+
+    try:
+        for _ in range(min(plan.procs, len(pending))):
+            dispatch(spawn())
+
+        while workers:
+            for conn in wait(list(workers)):
+                p, args = workers[conn]
+                try:
+                    ret, recycle = conn.recv()
+                except EOFError:
+                    retire(conn)
+                    ret = _worker_died(args, p.exitcode)
+                    recycle = True
+                else:
+                    if recycle:
+                        retire(conn)
+                plan.task_finished(ret[2])
+                yield ret
+                if not recycle:
+                    if len(workers) > plan.procs:
+                        retire(conn, stop=True)
+                    else:
+                        dispatch(conn)
+                # grow (or replace recycled workers) up to what fits now
+                while pending and len(workers) < plan.procs:
+                    dispatch(spawn())
+    finally:
+        for conn, (p, _) in list(workers.items()):
+            p.terminate()
+            conn.close()
+
+
+def _worker_died(args, exitcode):
+    """
+    Records an error result for a task whose worker process died, so that it is collected like any other.
+    """
+    target, kwargs, timeout = args
+    task_id = kwargs['task_id']
+    msg = f'Worker process died with exit code {exitcode}'
+    print(msg, 'while running', kwargs['sys_params']['task_name'])
+    result = SimulationResult(task_id, {'log_file': {'exc_info': msg}}, 'error', 0)
+    with open_data_file(kwargs['sys_params']['result_file_path']) as f:
+        f.store_data_root(result.to_dict())
+    return task_id, 0., 0.
+
 
 def _run_single_task(task_id, run_task, task_info, sys_params):
     """
@@ -452,6 +603,10 @@ def _run_single_task(task_id, run_task, task_info, sys_params):
         assert os.path.exists(tempdir_task), f"The temp dir {tempdir_task} does not exist for task {task_id}"
         tempfile.tempdir = tempdir_task
         os.environ['PYTHONCOMPILED'] = PYTHONCOMPILED_subproc
+        # threads planned for this task, see snep.resources.task_threads
+        threads = str(sys_params.get('threads', 1))
+        os.environ['SNEP_THREADS'] = threads
+        os.environ['OMP_NUM_THREADS'] = threads
     except:
         traceback.print_exc()
         exception_info += f'\nEXCEPTION SETTING TEMPDIRS: {traceback.format_exc()}'
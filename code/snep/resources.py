@@ -0,0 +1,188 @@
+'''
+Shares a machine between the tasks of a local run: how many run at the same time and how many OpenMP threads
+each of them gets, from the memory a task needs and the memory and cores that are available.
+'''
+import os
+import threading
+import multiprocessing as mp
+
+
+def available_memory():
+    '''
+    Memory in GB that can be used without swapping (MemAvailable), falling back to the free physical pages.
+    '''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 10**6
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 10**9
+    except (ValueError, OSError, AttributeError):
+        return float('inf')
+
+
+def available_cores():
+    '''
+    Cores this process may run on, which can be fewer than the machine has (taskset, cgroups).
+    '''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return mp.cpu_count()
+
+
+def _process_memory(pid):
+    '''
+    Resident memory in GB of process pid and its descendants, from /proc.
+    '''
+    import resource
+    total = 0.
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            total += int(f.read().split()[1]) * resource.getpagesize() / 10**9
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                for child in f.read().split():
+                    total += _process_memory(int(child))
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return total
+
+
+class TaskPeakMemory(object):
+    '''
+    Peak resident memory in GB of this process and its children (where the standalone simulations run) between
+    start and stop, i.e. of one task. ru_maxrss can not be used in a persistent worker: it is the peak of the
+    whole life of the worker, so one large task would inflate the measurement of every later one.
+    The memory of the process tree is sampled every interval seconds, the peak of this process itself is also
+    taken from VmHWM where start can reset it. Without /proc the peak is 0 (unknown).
+    '''
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = 0.
+        self._hwm_reset = False
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _process_memory(os.getpid()))
+
+    def start(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            self._hwm_reset = True
+        except (IOError, OSError):
+            pass
+        self.peak = _process_memory(os.getpid())
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        '''
+        :return: peak memory in GB since start
+        '''
+        self._done.set()
+        self._sampler.join()
+        self.peak = max(self.peak, _process_memory(os.getpid()))
+        if self._hwm_reset:
+            self.peak = max(self.peak, _own_peak_memory())
+        return self.peak
+
+
+def _own_peak_memory():
+    '''
+    Peak resident memory in GB of this process since the last reset of /proc/self/clear_refs, 0 if unknown.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 10**6
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return 0.
+
+
+def task_threads():
+    '''
+    OpenMP threads assigned to the task running in this process by ResourcePlan, 1 outside of a planned run.
+    '''
+    return int(os.environ.get('SNEP_THREADS', 1))
+
+
+class ResourcePlan(object):
+    '''
+    Number of concurrent tasks and threads per task. Tasks run concurrently as long as their memory fits,
+    the cores left over go to each task as threads: small networks run as many single threaded tasks,
+    large ones as few multithreaded tasks.
+
+    The first task runs alone on all cores as a probe, its measured peak memory (times margin) replaces the
+    reserved mem_per_task. The threads per task are fixed from the plan after the probe, since the thread count is
+    part of the build cache key and changes the order of the floating point operations. Later only the number of
+    concurrent tasks follows the largest measured peak.
+    '''
+    def __init__(self, mem_per_task, n_tasks, max_procs=None, cores=None, mem=None, reserve_mem=1., margin=1.25):
+        '''
+        :param mem_per_task: memory in GB reserved per task until a task has been measured
+        :param n_tasks: number of tasks of the run
+        :param max_procs: upper limit of concurrent tasks, defaults to the number of cores
+        :param cores, mem: cores and memory (GB) to plan with, default to what is available now
+        :param reserve_mem: memory in GB kept free for the parent process and the system
+        :param margin: factor on the largest measured peak memory
+        '''
+        self.cores = cores if cores is not None else available_cores()
+        self.mem = (mem if mem is not None else available_memory()) - reserve_mem
+        self.mem_per_task = mem_per_task
+        self.max_procs = max_procs if max_procs is not None else self.cores
+        self.n_unfinished = n_tasks
+        self.margin = margin
+        self.peak_memory = 0.
+        self._threads = None
+
+    @property
+    def probing(self):
+        '''
+        True until the probe task has finished.
+        '''
+        return self._threads is None
+
+    @property
+    def planned_procs(self):
+        '''
+        Concurrent tasks that fit with the current memory per task, also while probing.
+        '''
+        fit = int(self.mem // self.mem_per_task) if self.mem_per_task > 0 else self.cores
+        cores = self.cores if self.probing else self.cores // self._threads
+        return max(1, min(self.max_procs, cores, fit, self.n_unfinished))
+
+    @property
+    def procs(self):
+        return 1 if self.probing else self.planned_procs
+
+    @property
+    def threads(self):
+        return self.cores if self.probing else self._threads
+
+    def task_finished(self, peak_memory):
+        '''
+        :param peak_memory: peak memory in GB of the finished task, 0 if unknown (e.g. its worker died)
+        '''
+        self.n_unfinished = max(0, self.n_unfinished - 1)
+        if peak_memory > self.peak_memory:
+            self.peak_memory = peak_memory
+            self.mem_per_task = self.margin * peak_memory
+        if self.probing:
+            # an unmeasured probe leaves the reserved mem_per_task
+            self._threads = max(1, self.cores // self.planned_procs)
+
+    def __str__(self):
+        if self.probing:
+            return f'1 probe task with {self.threads} threads, then up to {self.planned_procs} concurrent tasks ' \
+                   f'({self.mem_per_task:.1f} of {self.mem:.1f} GB per task reserved, {self.cores} cores)'
+        return f'{self.procs} concurrent tasks with {self.threads} threads each ' \
+               f'({self.mem_per_task:.1f} of {self.mem:.1f} GB per task, {self.cores} cores)'
@@ -33,12 +33,14 @@ class ParameterSpaceReader(object):
         '''
         self.coord_map = {}
         self.flat = flat
+        self._row_index = None
 
     def set_root(self, paramspace):
         '''
         paramspace - a group in the ExperimentTables hdf5 file.
         '''
         self.paramspace = paramspace
+        self._row_index = None
 
     def _update_coord_map(self, coords):
         n = max(self.coord_map.values()) if len(self.coord_map) else 0
@@ -109,13 +111,66 @@ class ParameterSpaceReader(object):
     def _get_results_rows(self, filters):
         pass
 
-    def _get_results_row(self, paramspace_pt):
+    def _key_value(self, col, value):
+        '''
+        value as stored in column col of the results_map, so that equal values (e.g. a float64
+        coordinate and a float32 column) hash equally.
+        '''
+        dtype = self._results_map.coldtypes[col]
+        if dtype.kind == 'S':
+            return decode(value) if isinstance(value, bytes) else value
+        return np.asarray(value).astype(dtype, casting='same_kind').item()
+
+    def _row_key(self, items):
+        return tuple(sorted((k, self._key_value(k, v)) for k, v in items))
+
+    def _build_row_index(self):
+        '''
+        Maps the coordinate values of every row in the results_map to its row numbers, so that
+        looking up a task does not scan the whole table. The index is built lazily on the first
+        lookup after the file is opened, and dropped whenever the results_map is (re)written.
+        '''
+        coord_cols = [decode(c['coord']) for c in self._coordinate_map]
+        columns = [self._results_map.col(col).tolist() for col in coord_cols]
+        index = {}
+        for nrow, values in enumerate(zip(*columns)):
+            index.setdefault(self._row_key(zip(coord_cols, values)), []).append(nrow)
+        self._row_index = (frozenset(coord_cols), index)
+
+    def _get_results_nrows(self, paramspace_pt):
+        '''
+        Given a paramspace_pt returns the numbers of the matching rows in the results_map. The points
+        of a parameter space are unique, so a point with all coordinates matches at most one row. A
+        point with only some of the coordinates matches every row that agrees on them.
+        '''
         tid = {self.make_column_from_coord(coord): coord_val.coordvalue()
                for coord, coord_val in iteritems(paramspace_pt)}
-        for row in self._results_map.iterrows():
-            if all((decode(row[k]) if isinstance(row[k], bytes) else row[k]) == v for k, v in tid.items()):
-                return row
-        raise Exception('Task ID not found {}'.format(paramspace_pt))
+        if self._row_index is None:
+            self._build_row_index()
+        coord_cols, index = self._row_index
+        try:
+            key = self._row_key(tid.items())
+        except (ValueError, TypeError):
+            # a value that the column can not hold matches no row
+            return []
+        if set(tid) == coord_cols:
+            return index.get(key, [])
+        partial = set(key)
+        return sorted(nrow for row_key, nrows in iteritems(index) if partial.issubset(row_key) for nrow in nrows)
+
+    def _get_results_nrow(self, paramspace_pt):
+        '''
+        Given a paramspace_pt returns the number of the first matching row in the results_map, or
+        None if there is none.
+        '''
+        nrows = self._get_results_nrows(paramspace_pt)
+        return nrows[0] if nrows else None
+
+    def _get_results_row(self, paramspace_pt):
+        nrow = self._get_results_nrow(paramspace_pt)
+        if nrow is None:
+            raise Exception('Task ID not found {}'.format(paramspace_pt))
+        return self._results_map[nrow]
 
     def _get_results_row_old(self, paramspace_pt):
         '''
@@ -314,6 +369,7 @@ class ParameterSpaceTables(ParameterSpaceReader):
         ResultRow = self._define_coordinate_map_table(paramspace_pts)
 
         results_map = self.h5f.create_table(self.paramspace, 'results_map', ResultRow)
+        self._row_index = None
         aliased_group = self.h5f.create_group(self.paramspace, 'aliased')
         num_coords = len([None for c in itervalues(self.coord_map) if c >= 0])
         row = results_map.row
@@ -359,15 +415,8 @@ class ParameterSpaceTables(ParameterSpaceReader):
 #        res = self._get_results_row(paramspace_pt)
 #        res['status'] = status
 #        res.update()
-        for res in self._results_map:
-            mismatch = False
-            for coord, coord_val in iteritems(paramspace_pt):
-                col_name = self.make_column_from_coord(coord)
-                cv = res[col_name]
-                if isinstance(cv, bytes):
-                    cv = decode(cv)
-                mismatch = mismatch or cv != coord_val.coordvalue()
-            if not mismatch:
+        for nrow in self._get_results_nrows(paramspace_pt):
+            for res in self._results_map.iterrows(start=nrow, stop=nrow + 1):
                 res['status'] = status
                 res['tasktime'] = tasktime / 60.  # Convert seconds to minutes
                 if cluster_info:
@@ -386,3 +435,4 @@ class ParameterSpaceTables(ParameterSpaceReader):
                 res['seed'] = seed_map[res['seed']]
             res.update()
         self._results_map.flush()
+        self._row_index = None
@@ -0,0 +1,249 @@
+import os
+import shutil
+import tempfile
+import tables
+import numpy as np
+from functools import partial
+from operator import eq
+from six import iteritems
+
+
+class TrialStore(object):
+    '''
+    A columnar copy of the per-task results of an experiment, written once after a sweep, so that
+    analyses can slice across trials without visiting every task group of the experiment file.
+    Every finished task is one trial, in the order of the task_ids the store was built from, tasks of
+    multi-trial runs (raw_data n_trials) are one trial per run.
+
+    Layout of the hdf5 file:
+    / attribute source_mtime    modification time (ns) of the experiment file the store was built from
+    /coords/<coord>             one value per trial, the paramspace coordinates of its task
+    /groups                     results group path of each trial
+    /neuron/<name>              CArray (nn, n_trials, ...) for arrays whose first axis is the neuron,
+                                chunked so that all trials of one neuron are a single contiguous read
+    /trial/<name>               CArray (n_trials, ...) for other fixed-shape arrays
+    /ragged/<name>/values       concatenated variable length arrays (e.g. ISIs) of all trials, the
+    /ragged/<name>/offsets      values of trial k are values[offsets[k]:offsets[k+1]]
+
+    Arrays are given as (where, name) with where either 'raw_data' or 'computed', the name in the
+    store is the name in the experiment file.
+    '''
+    layouts = ('neuron', 'trial', 'ragged')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.h5f = tables.open_file(filename, mode='r')
+        self.groups = [g.decode() for g in self.h5f.root.groups.read()]
+        attrs = self.h5f.root._v_attrs
+        self.source_mtime = attrs['source_mtime'] if 'source_mtime' in attrs._f_list() else None
+        self.coords = {node._v_name: node.read() for node in self.h5f.root.coords._f_iter_nodes()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.h5f and self.h5f.isopen:
+            self.h5f.close()
+
+    @property
+    def n_trials(self):
+        return len(self.groups)
+
+    def names(self, layout):
+        try:
+            return [node._v_name for node in self.h5f.get_node('/' + layout)._f_iter_nodes()]
+        except tables.NoSuchNodeError:
+            return []
+
+    def shape(self, layout, name):
+        return self.h5f.get_node('/' + layout, name).shape
+
+    def select(self, targets):
+        '''
+        Indices of the trials whose coordinates match any of the targets, in the same way as
+        snep.utils.filter_tasks, e.g. {('c',): 0, ('bfb',): 10}. Values can also be callables.
+        '''
+        if not isinstance(targets, list):
+            targets = [targets]
+        selected = np.zeros(self.n_trials, dtype=bool)
+        for t in targets:
+            match = np.ones(self.n_trials, dtype=bool)
+            for coord, v in iteritems(t):
+                values = self.coords['_'.join(coord)]
+                if values.dtype.kind == 'S':
+                    values = values.astype(np.str_)
+                if callable(v):
+                    fn = v
+                elif isinstance(v, (float, np.floating)):
+                    fn = partial(np.isclose, v, atol=1e-10)
+                else:
+                    fn = partial(eq, v)
+                match &= np.array([bool(fn(x)) for x in values], dtype=bool)
+            selected |= match
+        return np.where(selected)[0]
+
+    def neuron(self, name, n, trials=None):
+        ''' Array (n_trials, ...) of neuron n, or (neurons, n_trials, ...) for a slice n, in contiguous reads. '''
+        data = self.h5f.get_node('/neuron', name)[n]
+        if trials is None:
+            return data
+        return data[:, trials] if isinstance(n, slice) else data[trials]
+
+    def trial(self, name, trials=None):
+        ''' Array (n_trials, ...) of a per-trial array. '''
+        data = self.h5f.get_node('/trial', name).read()
+        return data if trials is None else data[trials]
+
+    def ragged(self, name, trials=None):
+        ''' Concatenated values of a variable length array over the given trials. '''
+        group = self.h5f.get_node('/ragged', name)
+        values, offsets = group.values.read(), group.offsets.read()
+        if trials is None:
+            return values
+        return np.concatenate([values[offsets[k]:offsets[k + 1]] for k in trials] +
+                              [np.empty(0, dtype=values.dtype)])
+
+    @staticmethod
+    def task_trials(exp_tables, task_id):
+        ''' Number of trials in a task, tasks of multi-trial runs store it as raw_data n_trials. '''
+        try:
+            return int(np.ravel(exp_tables.get_raw_data(task_id, 'n_trials'))[0])
+        except tables.NoSuchNodeError:
+            return 1
+
+    @staticmethod
+    def build(exp_tables, task_ids, filename, neuron=(), trial=(), ragged=(), block=64):
+        '''
+        Write (or extend) the store with one pass over the tasks. Arrays already present in an
+        existing store for the same tasks are kept, a store for other tasks or built before the last
+        change of the experiment file (e.g. tasks run again after reset_results) is replaced.
+        The store is written to a temporary file that replaces it once complete, so an interrupted
+        build leaves the previous store.
+        A task of a multi-trial run adds one trial per run, its arrays have the trials along the
+        first axis and its ragged arrays come with name_offsets (see helper_funcs.stack_trials).
+        Such trials are named <results group>#<trial> in /groups.
+
+        :param exp_tables: opened ExperimentTables
+        :param task_ids: paramspace points of the tasks, usually the finished ones
+        :param neuron, trial, ragged: lists of (where, name) of the arrays to store for each layout
+        :param block: number of trials buffered before writing, also the chunk length along trials
+        '''
+        counts = [TrialStore.task_trials(exp_tables, tid) for tid in task_ids]
+        groups = [exp_tables.task_name(tid) if n == 1 else f'{exp_tables.task_name(tid)}#{k}'
+                  for tid, n in zip(task_ids, counts) for k in range(n)]
+        # (task index, trial within the task) of every trial of the store
+        trial_ids = [(t, k) for t, n in enumerate(counts) for k in range(n)]
+        source_mtime = os.stat(exp_tables.filename).st_mtime_ns
+        extend = False
+        if os.path.exists(filename):
+            with TrialStore(filename) as store:
+                extend = store.groups == groups and store.source_mtime == source_mtime
+                existing = {layout: store.names(layout) for layout in TrialStore.layouts}
+        if not extend:
+            existing = {layout: [] for layout in TrialStore.layouts}
+
+        todo = {layout: [(where, name) for where, name in arrays if name not in existing[layout]]
+                for layout, arrays in zip(TrialStore.layouts, (neuron, trial, ragged))}
+        if extend and not any(todo.values()):
+            return
+
+        fd, staged = tempfile.mkstemp(prefix='.' + os.path.basename(filename), suffix='.h5',
+                                      dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(fd)
+        try:
+            if extend:
+                shutil.copyfile(filename, staged)
+            TrialStore._write(staged, 'a' if extend else 'w', source_mtime, exp_tables, task_ids, counts,
+                              groups, trial_ids, todo, block)
+            os.replace(staged, filename)
+        finally:
+            if os.path.exists(staged):
+                os.remove(staged)
+
+    @staticmethod
+    def _write(filename, mode, source_mtime, exp_tables, task_ids, counts, groups, trial_ids, todo, block):
+        ''' Writes the arrays of todo into the store file filename, see build. '''
+        n_trials = len(trial_ids)
+        filters = tables.Filters(complevel=5, complib='zlib')
+        read_task = {'raw_data': exp_tables.get_raw_data, 'computed': exp_tables.get_computed}
+        last_read = {}
+
+        def read(where, name, t, k):
+            # each task is read once, all its trials are consecutive
+            if last_read.get(name, (None,))[0] != t:
+                data = read_task[where](task_ids[t], name)
+                offsets = read_task[where](task_ids[t], name + '_offsets') \
+                    if counts[t] > 1 and (where, name) in todo['ragged'] else None
+                last_read[name] = t, data, offsets
+            _, data, offsets = last_read[name]
+            if counts[t] == 1:
+                return data
+            return data[k] if offsets is None else data[offsets[k]:offsets[k + 1]]
+
+        h5f = tables.open_file(filename, mode=mode)
+        try:
+            if 'groups' not in h5f.root:
+                h5f.root._v_attrs.source_mtime = source_mtime
+                h5f.create_array(h5f.root, 'groups', np.array([g.encode() for g in groups]))
+                coords = h5f.create_group(h5f.root, 'coords')
+                for coord in task_ids[0]:
+                    values = [task_ids[t][coord].value for t, k in trial_ids]
+                    if isinstance(values[0], str):
+                        values = [v.encode() for v in values]
+                    h5f.create_array(coords, '_'.join(coord), np.array(values))
+            for layout in TrialStore.layouts:
+                if todo[layout] and '/' + layout not in h5f:
+                    h5f.create_group(h5f.root, layout)
+
+            # allocate from the shapes of the first trial
+            first = {name: np.asarray(read(where, name, 0, 0)) for layout in todo
+                     for where, name in todo[layout]}
+            carrays, buffers = {}, {}
+            for where, name in todo['neuron']:
+                nn, rest = first[name].shape[0], first[name].shape[1:]
+                carrays[name] = h5f.create_carray('/neuron', name, tables.Atom.from_dtype(first[name].dtype),
+                                                  (nn, n_trials) + rest, filters=filters,
+                                                  chunkshape=(1, min(block, n_trials)) + rest)
+                buffers[name] = np.empty((nn, block) + rest, dtype=first[name].dtype)
+            for where, name in todo['trial']:
+                carrays[name] = h5f.create_carray('/trial', name, tables.Atom.from_dtype(first[name].dtype),
+                                                  (n_trials,) + first[name].shape, filters=filters)
+                buffers[name] = np.empty((block,) + first[name].shape, dtype=first[name].dtype)
+            ragged_values = {name: [] for where, name in todo['ragged']}
+
+            for k0 in range(0, n_trials, block):
+                k1 = min(k0 + block, n_trials)
+                for k in range(k0, k1):
+                    t, k_task = trial_ids[k]
+                    for where, name in todo['neuron']:
+                        buffers[name][:, k - k0] = read(where, name, t, k_task)
+                    for where, name in todo['trial']:
+                        buffers[name][k - k0] = read(where, name, t, k_task)
+                    for where, name in todo['ragged']:
+                        ragged_values[name].append(np.atleast_1d(read(where, name, t, k_task)))
+                for where, name in todo['neuron']:
+                    carrays[name][:, k0:k1] = buffers[name][:, :k1 - k0]
+                for where, name in todo['trial']:
+                    carrays[name][k0:k1] = buffers[name][:k1 - k0]
+
+            for where, name in todo['ragged']:
+                group = h5f.create_group('/ragged', name)
+                lengths = [len(v) for v in ragged_values[name]]
+                h5f.create_array(group, 'offsets', np.concatenate(([0], np.cumsum(lengths))).astype(np.int64))
+                h5f.create_array(group, 'values', np.concatenate(ragged_values[name]))
+            h5f.flush()
+        finally:
+            h5f.close()
+
+
+def open_trial_store(exp_tables, task_ids, neuron=(), trial=(), ragged=(), filename='trials.h5'):
+    '''
+    Opens the trial store next to the experiment file, building or extending it first if it does
+    not yet hold the requested arrays for these task_ids.
+    '''
+    path = os.path.join(os.path.dirname(exp_tables.filename), filename)
+    TrialStore.build(exp_tables, task_ids, path, neuron=neuron, trial=trial, ragged=ragged)
+    return TrialStore(path)
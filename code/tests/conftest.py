@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the simulation and analysis modules import each other by name, as when run from their own directories,
+# snep is imported as a package
+code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, code_dir)
+for package in ('simulation', 'analysis'):
+    sys.path.insert(0, os.path.join(code_dir, package))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('brian2')
+import burst_analysis as ba
+
+
+def test_spk_mon2csr_round_trip():
+    rng = np.random.RandomState(0)
+    nn, n_spks = 7, 500
+    spk_t = np.sort(rng.uniform(0, 2, n_spks))
+    spk_idx = rng.randint(0, nn - 1, n_spks)   # the last neuron stays silent
+
+    # chunks smaller than the monitor, spikes before t_start are dropped
+    offsets, times = ba.spk_mon2csr(spk_idx, spk_t, nn, t_start=0.5, chunk=64)
+    assert offsets[0] == 0 and offsets[-1] == len(times) == (spk_t >= 0.5).sum()
+    assert offsets[-1] == offsets[-2]
+    for n in range(nn):
+        expected = spk_t[(spk_idx == n) & (spk_t >= 0.5)].astype(np.float32)
+        np.testing.assert_array_equal(times[offsets[n]:offsets[n + 1]], expected)
+
+
+def test_spk_times2csr_round_trip():
+    spikes = {0: [0.0105, 0.0125, 0.0126], 1: [], 2: [0.0015, 0.0395]}
+    bursts = {0: [0.0105], 2: []}
+    all_spk_times = (spikes, bursts, spikes, spikes)
+
+    fine, coarse = ba.spk_times2csr(all_spk_times, [1e-3, 1e-2], [40, 4])
+    events, bursts_raster, _, spks = fine
+    assert spks.shape == (3, 40) and coarse[3].shape == (3, 4)
+    # two spikes in bin 12 of neuron 0: the earlier one moves back to bin 11
+    assert [spks[n].indices.tolist() for n in range(3)] == [[10, 11, 12], [], [1, 39]]
+    assert bursts_raster.nnz == 1 and bursts_raster[0, 10] == 1
+    np.testing.assert_array_equal(events.toarray(), spks.toarray())
+    # every spike is a 1 at any resolution
+    np.testing.assert_array_equal(coarse[3].toarray().sum(axis=1), [3, 0, 2])
+    assert coarse[3].max() == 1 and coarse[3][2].indices.tolist() == [0, 3]
+
+
+def test_classify_spikes():
+    S, B, M = ba.SINGLE, ba.BURST_START, ba.BURST_MEMBER
+    # neuron 0: a burst of 3 and a single, neuron 1 silent, neuron 2: a single right after the last spike of
+    # neuron 0 and a burst of 2
+    trains = [[0.100, 0.105, 0.110, 0.300], [], [0.301, 0.500, 0.508]]
+    offsets = np.concatenate(([0], np.cumsum([len(t) for t in trains])))
+    times = np.concatenate(trains).astype(np.float32)
+
+    labels, counts, spks_per_burst = ba.classify_spikes(offsets, times, valid_burst=16)
+    assert labels.tolist() == [B, M, M, S, S, B, M]
+    assert counts['events'].tolist() == [2, 0, 2]
+    assert counts['bursts'].tolist() == [1, 0, 1]
+    assert counts['singles'].tolist() == [1, 0, 1]
+    assert spks_per_burst.tolist() == [3, 2]
+
+    # no ISI below the threshold: singles only
+    labels, counts, spks_per_burst = ba.classify_spikes(offsets, times, valid_burst=1)
+    assert (labels == S).all() and counts['events'].tolist() == [4, 0, 3] and not len(spks_per_burst)
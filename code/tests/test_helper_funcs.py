@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('brian2')
+from helper_funcs import roc_auc_batch, RasterPyramid
+
+
+def test_roc_auc_batch_matches_sklearn_with_ties():
+    roc_auc_score = pytest.importorskip('sklearn.metrics').roc_auc_score
+    rng = np.random.RandomState(0)
+    # spike counts: few distinct values, so most trials are tied
+    rates = rng.poisson(2, (3, 40, 5)).astype(np.float32)
+    is_winner = rng.rand(3, 40) < 0.4
+
+    auc = roc_auc_batch(rates, is_winner, max_bytes=4096)
+    assert auc.shape == (3, 5)
+    for n in range(3):
+        for t in range(5):
+            assert auc[n, t] == pytest.approx(roc_auc_score(is_winner[n], rates[n, :, t]))
+
+    # the same winners for all neurons
+    auc = roc_auc_batch(rates, is_winner[0])
+    assert auc[2, 1] == pytest.approx(roc_auc_score(is_winner[0], rates[2, :, 1]))
+    # all trials tied
+    assert roc_auc_batch(np.ones((40, 1)), is_winner[0])[0] == 0.5
+
+
+def test_raster_pyramid_sums_blocks():
+    from scipy.sparse import csr_matrix
+    rng = np.random.RandomState(0)
+    raster = (rng.rand(6, 103) < 0.3).astype(np.float32)
+
+    for pyramid in (RasterPyramid(raster, 1e-3), RasterPyramid(csr_matrix(raster), 1e-3)):
+        # 4 from the finest level, 8 and 12 from 4, the 3 bins left over are dropped
+        for factor in (4, 8, 12, 5):
+            expected = raster[:, :103 // factor * factor].reshape(6, -1, factor).sum(axis=2)
+            np.testing.assert_array_equal(pyramid.counts(factor), expected)
+        assert pyramid.factor(8e-3) == 8
+        np.testing.assert_allclose(pyramid.rate(4e-3), pyramid.counts(4) / 4e-3)
@@ -0,0 +1,25 @@
+import os
+import threading
+import time
+from snep.parallel2 import _warm_imap_unordered
+from snep.resources import ResourcePlan
+
+
+def record_pid(task_id, sys_params, pid_file):
+    with open(pid_file, 'a') as f:
+        f.write(f'{os.getpid()}\n')
+    # a thread left running by the task (e.g. a progress monitor) does not retire the worker
+    threading.Thread(target=time.sleep, args=(10,), daemon=True).start()
+
+
+def test_warm_worker_is_reused(tmp_path):
+    pid_file = str(tmp_path / 'pids')
+    tasks = [(record_pid, {'task_id': k, 'sys_params': {}, 'pid_file': pid_file}, 60) for k in range(2)]
+    plan = ResourcePlan(1., len(tasks), max_procs=1, cores=1, mem=100.)
+
+    finished = sorted(task_id for task_id, run_time, peak_memory in
+                      _warm_imap_unordered(tasks, plan, max_tasks=None, max_mem=None, preimport=()))
+    assert finished == [0, 1]
+    with open(pid_file) as f:
+        pids = f.read().split()
+    assert len(pids) == 2 and pids[0] == pids[1] != str(os.getpid())
@@ -0,0 +1,25 @@
+import numpy as np
+from param_tree import content_hash, FrozenParams
+
+
+def params():
+    return {'sim': {'seed_con': 1, 'runtime': 2.5, 'online_stim': False}, 'c': 0.0,
+            'N': np.arange(3, dtype=np.int64), 'name': 'senE', 'cells': [1, (2, 3)]}
+
+
+def test_content_hash_is_stable():
+    # keys of shared caches: a change of the encoding invalidates them
+    assert content_hash(params()) == '2140dbf7c5866ad6d6e327ca8bb439d823b70686'
+
+
+def test_content_hash_ignores_order_not_types():
+    reordered = dict(reversed(list(params().items())))
+    reordered['sim'] = dict(reversed(list(reordered['sim'].items())))
+    assert content_hash(reordered) == content_hash(params())
+    assert content_hash(FrozenParams(params())) == content_hash(params())
+
+    assert len({content_hash(v) for v in (1, 1.0, True, '1', [1])}) == 5
+    assert content_hash(np.arange(3, dtype=np.int32)) != content_hash(np.arange(3, dtype=np.int64))
+    changed = params()
+    changed['sim']['runtime'] = 3.
+    assert content_hash(changed) != content_hash(params())
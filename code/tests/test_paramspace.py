@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+tables = pytest.importorskip('tables')
+from snep.tables.paramspace import ParameterSpaceTables
+from snep.tables.rows import ParamSpaceCoordinate
+from snep.utils import Parameter
+
+
+def point(c, bfb, seed):
+    return {('c',): Parameter(c), ('bfb',): Parameter(bfb), ('seed',): Parameter(seed)}
+
+
+@pytest.fixture
+def paramspace(tmp_path):
+    h5f = tables.open_file(str(tmp_path / 'exp.h5'), mode='w')
+    ps = ParameterSpaceTables(flat=True)
+    ps.initialize(h5f, h5f.root)
+    # float32 coordinates are stored in a float32 column
+    ps._define_results_table([point(np.float32(c), bfb, seed)
+                              for seed, (c, bfb) in enumerate((c, bfb) for c in (0., .1) for bfb in (0, 10))])
+    yield ps
+    h5f.close()
+
+
+def test_row_index(paramspace):
+    assert paramspace._results_map.coldtypes['c'] == np.float32
+    # float64 values of the points hit the float32 column
+    assert paramspace._get_results_nrow(point(.1, 10, 3)) == 3
+    assert paramspace._get_results_nrows(point(.1, 0, 2)) == [2]
+    assert paramspace._get_results_nrow(point(.2, 0, 2)) is None
+    assert paramspace._get_results_nrow(point('x', 0, 2)) is None
+    assert paramspace._get_results_nrows({('bfb',): Parameter(10)}) == [1, 3]
+
+    # all matching rows of a partial point are updated
+    paramspace.set_results_status({('c',): Parameter(.1)}, 'finished', 60., None)
+    assert paramspace._results_map.col('status').tolist() == [b'none', b'none', b'finished', b'finished']
+    assert paramspace.get_results_status(point(.1, 0, 2)) == 'finished'
+
+
+def test_row_index_invalidated(paramspace):
+    assert paramspace._get_results_nrow(point(0., 10, 1)) == 1
+    paramspace.new_seeds = lambda: {seed: seed + 100 for seed in range(4)}
+    paramspace.reset_results(new_seeds=True)
+    assert paramspace._get_results_nrow(point(0., 10, 1)) is None
+    assert paramspace._get_results_nrow(point(0., 10, 101)) == 1
+
+    # a new parameter space
+    for name in ('results_map', 'aliased', 'coordinate_map'):
+        paramspace.h5f.remove_node(paramspace.paramspace, name, recursive=True)
+    paramspace.h5f.create_table(paramspace.paramspace, 'coordinate_map', ParamSpaceCoordinate)
+    paramspace._define_results_table([point(.5, 0, 7)])
+    assert paramspace._get_results_nrow(point(.5, 0, 7)) == 0
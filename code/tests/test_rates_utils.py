@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+utils = pytest.importorskip('snep.library.rates.utils', exc_type=ImportError)
+
+
+def ring_distances(rows, cols, n_post, n_pre):
+    d = np.linspace(-np.pi, np.pi, n_post, endpoint=False)[rows] - \
+        np.linspace(-np.pi, np.pi, n_pre, endpoint=False)[cols]
+    return np.abs(np.mod(d + np.pi, 2 * np.pi) - np.pi)
+
+
+@pytest.mark.parametrize('n, m, p', [(200, 0, 0.1), (100, 400, 0.05), (400, 100, 0.2)])
+def test_vm_fixed_in_out_csr_degrees(n, m, p):
+    indptr, indices = utils.vm_fixed_in_out_csr(p, n, m, scale=0.2, f_global=0.1, seed=1)
+    recurrent = m == 0
+    n_pre = n if recurrent else m
+    k_in = int(np.round(p * (n_pre - 1 if recurrent else n_pre)))
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+
+    assert np.all(np.diff(indptr) == k_in)
+    assert np.all(np.bincount(indices, minlength=n_pre) == n * k_in // n_pre)
+    # no duplicates (indices are sorted within rows) and no autapses
+    assert np.all((np.diff(indices) > 0) | (np.diff(rows) > 0))
+    if recurrent:
+        assert not np.any(rows == indices)
+
+
+def test_vm_fixed_in_out_csr_seed():
+    first = utils.vm_fixed_in_out_csr(0.1, 200, scale=0.2, seed=3)
+    again = utils.vm_fixed_in_out_csr(0.1, 200, scale=0.2, seed=3)
+    other = utils.vm_fixed_in_out_csr(0.1, 200, scale=0.2, seed=4)
+    np.testing.assert_array_equal(first[0], again[0])
+    np.testing.assert_array_equal(first[1], again[1])
+    assert not np.array_equal(first[1], other[1])
+
+
+def test_vm_fixed_in_out_csr_distance_profile():
+    n, p, scale = 400, 0.1, 0.2
+    indptr, indices = utils.vm_fixed_in_out_csr(p, n, scale=scale, seed=5)
+    fixed = ring_distances(np.repeat(np.arange(n), np.diff(indptr)), indices, n, n)
+
+    np.random.seed(5)
+    conns = utils.compute_connections_base(scale, p, 0., None, n, None, n, 1., True, None, 0., 0.)[0]
+    base = ring_distances(*np.nonzero(conns), n, n)
+
+    # both follow the same von Mises profile: compare the fractions of connections in distance bins
+    bins = np.linspace(0, np.pi, 9)
+    np.testing.assert_allclose(np.histogram(fixed, bins)[0] / fixed.size,
+                               np.histogram(base, bins)[0] / base.size, atol=0.03)
+
+
+def test_compute_connections_fixed_out_is_opt_in():
+    args = (True, 0.2, 0.1, 0., None, 200, None, 200, 1., True, False)
+    np.random.seed(0)
+    in_only = utils.compute_connections(*args, in_degree_cv=0.)
+    np.random.seed(0)
+    in_out = utils.compute_connections(*args, in_degree_cv=0., fixed_out=True)
+
+    assert in_only.conn_prob is not None and in_out.conn_prob is None
+    for c in (in_only, in_out):
+        assert np.all(np.diff(c.csr_indices.indptr) == 20)
+    assert np.all(np.bincount(in_out.col_ind, minlength=200) == 20)
+    with pytest.raises(NotImplementedError):
+        utils.compute_connections(True, 0.2, 0.1, 0., None, 200, None, 200, 1., True, True, in_degree_cv=0.)
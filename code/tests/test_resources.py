@@ -0,0 +1,43 @@
+from snep.resources import ResourcePlan
+
+
+def test_probe_runs_alone_on_all_cores():
+    plan = ResourcePlan(20., 100, cores=16, mem=65., reserve_mem=1.)
+    # the reserved 20 GB fit 3 tasks, but only the probe runs until a task is measured
+    assert plan.planned_procs == 3
+    assert (plan.procs, plan.threads) == (1, 16)
+    str(plan)
+    assert plan.probing and (plan.procs, plan.threads) == (1, 16)
+
+
+def test_small_peak_runs_many_single_threaded_tasks():
+    plan = ResourcePlan(20., 100, cores=16, mem=65., reserve_mem=1.)
+    plan.task_finished(2.)
+    assert plan.mem_per_task == 2.5
+    assert (plan.procs, plan.threads) == (16, 1)
+    # a smaller peak does not lower the memory per task
+    plan.task_finished(1.)
+    assert plan.mem_per_task == 2.5 and plan.procs == 16
+
+
+def test_large_peak_runs_few_multithreaded_tasks():
+    plan = ResourcePlan(2., 100, cores=16, mem=65., reserve_mem=1.)
+    plan.task_finished(12.)
+    assert plan.mem_per_task == 15.
+    assert (plan.procs, plan.threads) == (4, 4)
+    # the threads stay fixed, a larger peak only lowers the number of concurrent tasks
+    plan.task_finished(20.)
+    assert (plan.procs, plan.threads) == (2, 4)
+
+
+def test_procs_limits():
+    plan = ResourcePlan(1., 3, max_procs=8, cores=16, mem=65., reserve_mem=1.)
+    plan.task_finished(0.5)
+    # 2 tasks left, threads from the plan after the probe
+    assert (plan.procs, plan.threads) == (2, 8)
+    plan.task_finished(0.)
+    assert plan.procs == 1
+
+    plan = ResourcePlan(1., 100, max_procs=8, cores=16, mem=65., reserve_mem=1.)
+    plan.task_finished(0.)   # unmeasured probe: the reserved memory per task
+    assert plan.mem_per_task == 1. and (plan.procs, plan.threads) == (8, 2)
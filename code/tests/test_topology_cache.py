@@ -0,0 +1,35 @@
+import numpy as np
+from topology_cache import sample_csr, csr2ij, get_topology
+
+
+def dense(indptr, indices, n_pre, n_post):
+    conn = np.zeros((n_pre, n_post), dtype=int)
+    np.add.at(conn, csr2ij(indptr, indices), 1)
+    return conn
+
+
+def test_sample_csr_probabilities():
+    rng = np.random.default_rng(0)
+    assert sample_csr(50, 40, 0., rng)[1].size == 0
+    np.testing.assert_array_equal(dense(*sample_csr(50, 40, 1., rng, block=16), 50, 40), 1)
+
+    # within the sub-populations only: the first 10 of 50 sources and 8 of 40 targets
+    conn = dense(*sample_csr(50, 40, 1., rng, p_across=0., sub=0.2, block=16), 50, 40)
+    expected = np.zeros((50, 40), dtype=int)
+    expected[:10, :8] = expected[10:, 8:] = 1
+    np.testing.assert_array_equal(conn, expected)
+
+    indptr, indices = sample_csr(400, 500, 0.1, rng, block=64)
+    assert len(indptr) == 401 and indptr[-1] == len(indices)
+    assert dense(indptr, indices, 400, 500).max() == 1
+    assert abs(len(indices) / (400 * 500) - 0.1) < 0.005
+
+
+def test_get_topology_shared_by_seed(tmp_path):
+    indptr, indices = get_topology(3, 'synSESE', 30, 30, 0.2, str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    loaded = get_topology(3, 'synSESE', 30, 30, 0.2, str(tmp_path))
+    np.testing.assert_array_equal(loaded[0], indptr)
+    np.testing.assert_array_equal(loaded[1], indices)
+    other = get_topology(4, 'synSESE', 30, 30, 0.2, str(tmp_path))
+    assert not np.array_equal(other[1], indices)
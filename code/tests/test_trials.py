@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+
+tables = pytest.importorskip('tables')
+from snep.tables.trials import TrialStore, open_trial_store
+
+
+class Coord(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeTables(object):
+    ''' The part of ExperimentTables the store reads: tasks 'a' (one trial) and 'b' (a run of two trials). '''
+    def __init__(self, filename):
+        self.filename = filename
+        open(filename, 'w').close()
+        rng = np.random.RandomState(0)
+        self.data = {'a': {'spikes': rng.rand(3, 4), 'rates': np.array([1., 2.]), 'isis': np.array([.1, .2, .3])},
+                     'b': {'spikes': rng.rand(2, 3, 4), 'rates': np.array([[3., 4.], [5., 6.]]),
+                           'isis': np.array([.4, .5]), 'isis_offsets': np.array([0, 0, 2]),
+                           'n_trials': np.array([2])}}
+        self.task_ids = [{('name',): Coord(name), ('c',): Coord(c)} for name, c in (('a', 0.), ('b', 0.5))]
+
+    def task_name(self, task_id):
+        return task_id[('name',)].value
+
+    def get_raw_data(self, task_id, name):
+        try:
+            return self.data[self.task_name(task_id)][name]
+        except KeyError:
+            raise tables.NoSuchNodeError(name)
+
+    get_computed = get_raw_data
+
+
+def test_round_trip(tmp_path):
+    exp = FakeTables(str(tmp_path / 'exp.h5'))
+    a, b = exp.data['a'], exp.data['b']
+    with open_trial_store(exp, exp.task_ids, neuron=[('computed', 'spikes')], trial=[('raw_data', 'rates')],
+                          ragged=[('computed', 'isis')]) as store:
+        assert store.groups == ['a', 'b#0', 'b#1']
+        np.testing.assert_array_equal(store.coords['c'], [0., .5, .5])
+        np.testing.assert_array_equal(store.select({('c',): .5}), [1, 2])
+        assert store.shape('neuron', 'spikes') == (3, 3, 4)
+        np.testing.assert_array_equal(store.neuron('spikes', 1), [a['spikes'][1], b['spikes'][0, 1],
+                                                                  b['spikes'][1, 1]])
+        np.testing.assert_array_equal(store.neuron('spikes', slice(0, 2), [2]), b['spikes'][1, :2, np.newaxis])
+        np.testing.assert_array_equal(store.trial('rates'), [a['rates'], b['rates'][0], b['rates'][1]])
+        np.testing.assert_array_equal(store.ragged('isis', [0]), a['isis'])
+        assert store.ragged('isis', [1]).size == 0
+        np.testing.assert_array_equal(store.ragged('isis', [2, 0]), [.4, .5, .1, .2, .3])
+
+
+def test_extend_and_rebuild(tmp_path):
+    exp = FakeTables(str(tmp_path / 'exp.h5'))
+    path = str(tmp_path / 'trials.h5')
+    TrialStore.build(exp, exp.task_ids, path, trial=[('raw_data', 'rates')])
+    # the same experiment file: extended with the new arrays only
+    TrialStore.build(exp, exp.task_ids, path, ragged=[('computed', 'isis')])
+    with TrialStore(path) as store:
+        assert store.names('trial') == ['rates'] and store.names('ragged') == ['isis']
+
+    # tasks run again change the experiment file: the store is rebuilt from the new results
+    exp.data['a']['rates'] = np.array([7., 8.])
+    os.utime(exp.filename, ns=(0, os.stat(exp.filename).st_mtime_ns + 10**9))
+    TrialStore.build(exp, exp.task_ids, path, trial=[('raw_data', 'rates')])
+    with TrialStore(path) as store:
+        assert store.names('ragged') == []
+        np.testing.assert_array_equal(store.trial('rates', [0]), [[7., 8.]])
+
+
+def test_interrupted_build_keeps_store(tmp_path):
+    exp = FakeTables(str(tmp_path / 'exp.h5'))
+    path = str(tmp_path / 'trials.h5')
+    TrialStore.build(exp, exp.task_ids, path, trial=[('raw_data', 'rates')])
+    with pytest.raises(tables.NoSuchNodeError):
+        TrialStore.build(exp, exp.task_ids, path, trial=[('raw_data', 'missing')])
+    assert sorted(os.listdir(str(tmp_path))) == ['exp.h5', 'trials.h5']
+    with TrialStore(path) as store:
+        assert store.names('trial') == ['rates']